@@ -23,7 +23,7 @@ setup(
     version='0.6.2',
     packages=find_packages(exclude=['test']),
     install_requires=['setuptools'],
-    zip_safe=True,
+    zip_safe=False,
     author='Morgan Quigley',
     author_email='morgan@osrfoundation.org',
     maintainer='Mikael Arguedas',
@@ -51,6 +51,7 @@ enhance the security of ROS 2 deployments.""",
             'sros2.verb = sros2.verb:VerbExtension',
         ],
         'sros2.verb': [
+            'compact_policy = sros2.verb.compact_policy:CompactPolicyVerb',
             'create_key = sros2.verb.create_key:CreateKeyVerb',
             'create_keystore = sros2.verb.create_keystore:CreateKeystoreVerb',
             'create_permission = sros2.verb.create_permission'
@@ -59,6 +60,7 @@ enhance the security of ROS 2 deployments.""",
             'generate_artifacts = sros2.verb.generate_artifacts:GenerateArtifactsVerb',
             'generate_policy = sros2.verb.generate_policy:GeneratePolicyVerb',
             'list_keys = sros2.verb.list_keys:ListKeysVerb',
+            'list_policy = sros2.verb.list_policy:ListPolicyVerb',
         ],
     },
     package_data={
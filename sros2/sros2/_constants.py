@@ -0,0 +1,21 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Values needed to build the argument parsers of the verbs, kept free of imports so that
+# building them does not load the modules the verbs only need once they run
+
+# how identity directories refer to the CA cert and governance of the keystore
+LINK_MODES = ('copy', 'hardlink', 'symlink')
+# the columns the keystore catalog can be sorted by
+CATALOG_SORT_KEYS = ('identity', 'serial', 'not_before', 'not_after')
@@ -0,0 +1,166 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lightweight spans and counters for the stages of sros2 operations.
+
+Profiling is disabled unless enable_profiling() was called, in which case span() and
+profiled() only cost a global lookup. Spans nest per thread and are aggregated by stack.
+Work done in worker processes is only accounted for in the span of the parent waiting on it.
+"""
+
+import functools
+import json
+import threading
+import time
+
+_profiler = None
+
+
+class _NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.stack = self.profiler._get_stack()
+        self.stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        self.profiler._record(tuple(self.stack), seconds)
+        self.stack.pop()
+        return False
+
+
+class Profiler:
+    """Aggregated durations of spans by stack, and counters."""
+
+    def __init__(self):
+        self.spans = {}
+        self.counters = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _get_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, stack, seconds):
+        with self._lock:
+            count, total = self.spans.get(stack, (0, 0.0))
+            self.spans[stack] = (count + 1, total + seconds)
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def _get_self_seconds(self):
+        self_seconds = {stack: total for stack, (_, total) in self.spans.items()}
+        for stack, (_, total) in self.spans.items():
+            if len(stack) > 1 and stack[:-1] in self_seconds:
+                self_seconds[stack[:-1]] -= total
+        return self_seconds
+
+    def print_report(self, stream):
+        by_name = {}
+        for stack, (count, total) in self.spans.items():
+            # only count the outermost of recursive spans
+            if stack[-1] in stack[:-1]:
+                continue
+            calls, seconds = by_name.get(stack[-1], (0, 0.0))
+            by_name[stack[-1]] = (calls + count, seconds + total)
+        for name, (calls, seconds) in sorted(
+                by_name.items(), key=lambda item: item[1][1], reverse=True):
+            print('%-40s %8d calls %10.3fs' % (name, calls, seconds), file=stream)
+        for name, value in sorted(self.counters.items()):
+            print('%-40s %8d' % (name, value), file=stream)
+
+    def write(self, path):
+        """Write the report as JSON if the path ends with .json, as folded stacks otherwise."""
+        self_seconds = self._get_self_seconds()
+        with open(path, 'w') as f:
+            if path.endswith('.json'):
+                json.dump({
+                    'spans': [
+                        {
+                            'stack': list(stack),
+                            'count': count,
+                            'seconds': total,
+                            'self_seconds': self_seconds[stack],
+                        }
+                        for stack, (count, total) in sorted(self.spans.items())
+                    ],
+                    'counters': self.counters,
+                }, f, indent=2, sort_keys=True)
+            else:
+                # the input format of flamegraph.pl, in microseconds
+                for stack, seconds in sorted(self_seconds.items()):
+                    f.write('%s %d\n' % (';'.join(stack), max(0, round(seconds * 1e6))))
+
+
+def enable_profiling():
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable_profiling():
+    global _profiler
+    _profiler = None
+
+
+def span(name):
+    """Get a context manager timing a stage, which does nothing unless profiling."""
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(name)
+
+
+def count(name, value=1):
+    if _profiler is not None:
+        _profiler.count(name, value)
+
+
+def profiled(name):
+    """Decorate a function to time each of its calls as a span."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
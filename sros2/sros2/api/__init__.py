@@ -12,34 +12,55 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import deque
 from collections import namedtuple
-import itertools
+from collections import OrderedDict
+import concurrent.futures
 import os
-import platform
 import shutil
-import subprocess
 import sys
+import tempfile
 
 from lxml import etree
 
-from rclpy.exceptions import InvalidNamespaceException
-from rclpy.exceptions import InvalidNodeNameException
-from rclpy.validate_namespace import validate_namespace
-from rclpy.validate_node_name import validate_node_name
-
+from sros2._constants import LINK_MODES
+from sros2._profiling import count, profiled, span
+from sros2.api._catalog import KeystoreCatalog
+from sros2.api._distribution import (
+    extract_distribution_archive,
+    get_identity_digests,
+    write_distribution_archive,
+)
+from sros2.api._lock import keystore_lock, PROVISIONING_LOCK_FILE_NAME
+from sros2.api._manifest import ArtifactManifest
+from sros2.api._provisioning import read_provisioning_manifests  # noqa: F401
+from sros2.crypto import get_crypto_backend
+from sros2.crypto._openssl import (  # noqa: F401
+    check_openssl_version,
+    find_openssl_executable,
+    get_openssl_toolchain,
+    run_shell_command,
+)
 from sros2.policy import (
+    get_compiled_transport_schema,
     get_policy_default,
     get_transport_default,
-    get_transport_schema,
-    get_transport_template,
+    iter_policy,
+    iter_profile_keys,
     load_policy,
+    PolicyIndex,
+    transform_permissions,
 )
 
 HIDDEN_NODE_PREFIX = '_'
 DOMAIN_ID_ENV = 'ROS_DOMAIN_ID'
+LINK_MODE_ENV = 'SROS2_KEYSTORE_LINK_MODE'
+# how many identities generate_artifacts transforms and signs the permissions of at once
+PERMISSIONS_BATCH_SIZE = 256
 
 NodeName = namedtuple('NodeName', ('node', 'ns', 'fqn'))
 TopicInfo = namedtuple('Topic', ('fqn', 'type'))
+NodeGraphInfo = namedtuple('NodeGraphInfo', ('subscribers', 'publishers', 'services'))
 
 
 def get_node_names(*, node, include_hidden_nodes=False):
@@ -78,42 +99,23 @@ def get_service_info(node, node_name):
     return get_topics(node_name, node.get_service_names_and_types_by_node)
 
 
-def find_openssl_executable():
-    if platform.system() != 'Darwin':
-        return 'openssl'
-
-    brew_openssl_prefix_result = subprocess.run(
-        ['brew', '--prefix', 'openssl'],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    if brew_openssl_prefix_result.returncode:
-        raise RuntimeError('unable to find openssl from brew')
-    basepath = brew_openssl_prefix_result.stdout.decode().rstrip()
-    return os.path.join(basepath, 'bin', 'openssl')
-
-
-def check_openssl_version(openssl_executable):
-    openssl_version_string_result = subprocess.run(
-        [openssl_executable, 'version'],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    if openssl_version_string_result.returncode:
-        raise RuntimeError('unable to invoke command: "%s"' % openssl_executable)
-    version = openssl_version_string_result.stdout.decode().rstrip()
-    openssl_version_string_list = version.split(' ')
-    if openssl_version_string_list[0].lower() != 'openssl':
-        raise RuntimeError(
-            "expected version of the format 'OpenSSL "
-            "<MAJOR>.<MINOR>.<PATCH_number><PATCH_letter>  <DATE>'")
-    (major, minor, patch) = openssl_version_string_list[1].split('.')
-    major = int(major)
-    minor = int(minor)
-    if major < 1:
-        raise RuntimeError('need openssl 1.0.2 minimum')
-    if major == 1 and minor < 0:
-        raise RuntimeError('need openssl 1.0.2 minimum')
-    if major == 1 and minor == 0 and int(''.join(itertools.takewhile(str.isdigit, patch))) < 2:
-        raise RuntimeError('need openssl 1.0.2 minimum')
+def get_graph_snapshot(node, *, include_hidden_nodes=False):
+    """
+    Get the topics and services of every node of the ROS graph in one go.
+
+    The node names are listed once and each node is then queried in turn, so that callers
+    work on a single snapshot instead of querying the graph as they go. The queries are not
+    spread over threads: they hold the GIL and are serialized by the node anyway.
+
+    :return: an OrderedDict mapping each NodeName to its NodeGraphInfo
+    """
+    node_names = get_node_names(node=node, include_hidden_nodes=include_hidden_nodes)
+    return OrderedDict(
+        (node_name, NodeGraphInfo(
+            subscribers=get_subscriber_info(node=node, node_name=node_name),
+            publishers=get_publisher_info(node=node, node_name=node_name),
+            services=get_service_info(node=node, node_name=node_name)))
+        for node_name in node_names)
 
 
 def create_ca_conf_file(path):
@@ -178,33 +180,25 @@ basicConstraints = CA:true
 """)
 
 
-def run_shell_command(cmd, in_path=None):
-    print('running command in path [%s]: %s' % (in_path, cmd))
-    subprocess.call(cmd, shell=True, cwd=in_path)
-
-
+@profiled('create_ecdsa_param_file')
 def create_ecdsa_param_file(path):
-    openssl_executable = find_openssl_executable()
-    check_openssl_version(openssl_executable)
-    run_shell_command('%s ecparam -name prime256v1 > %s' % (openssl_executable, path))
+    get_crypto_backend().create_ecdsa_param_file(path)
 
 
+@profiled('create_ca_key_cert')
 def create_ca_key_cert(ecdsa_param_path, ca_conf_path, ca_key_path, ca_cert_path):
-    openssl_executable = find_openssl_executable()
-    check_openssl_version(openssl_executable)
-    run_shell_command(
-        '%s req -nodes -x509 -days 3650 -newkey ec:%s -keyout %s -out %s -config %s' %
-        (openssl_executable, ecdsa_param_path, ca_key_path, ca_cert_path, ca_conf_path))
+    get_crypto_backend().create_ca_key_cert(
+        ecdsa_param_path, ca_conf_path, ca_key_path, ca_cert_path)
 
 
+@profiled('create_governance_file')
 def create_governance_file(path, domain_id):
     # for this application we are only looking to authenticate and encrypt;
     # we do not need/want access control at this point.
     governance_xml_path = get_transport_default('dds', 'governance.xml')
     governance_xml = etree.parse(governance_xml_path)
 
-    governance_xsd_path = get_transport_schema('dds', 'governance.xsd')
-    governance_xsd = etree.XMLSchema(etree.parse(governance_xsd_path))
+    governance_xsd = get_compiled_transport_schema('dds', 'governance.xsd')
 
     domain_id_elements = governance_xml.findall(
         'domain_access_rules/domain_rule/domains/id')
@@ -220,21 +214,28 @@ def create_governance_file(path, domain_id):
         f.write(etree.tostring(governance_xml, pretty_print=True))
 
 
+@profiled('create_signed_governance_file')
 def create_signed_governance_file(signed_gov_path, gov_path, ca_cert_path, ca_key_path):
-    openssl_executable = find_openssl_executable()
-    check_openssl_version(openssl_executable)
-    run_shell_command(
-        '%s smime -sign -in %s -text -out %s -signer %s -inkey %s' %
-        (openssl_executable, gov_path, signed_gov_path, ca_cert_path, ca_key_path))
+    get_crypto_backend().create_smime_signed_file(
+        gov_path, signed_gov_path, ca_cert_path, ca_key_path)
 
 
+@profiled('create_keystore')
 def create_keystore(keystore_path):
     if not os.path.exists(keystore_path):
         print('creating directory: %s' % keystore_path)
         os.makedirs(keystore_path, exist_ok=True)
     else:
         print('directory already exists: %s' % keystore_path)
+    # several builds may create the same keystore at once
+    with keystore_lock(keystore_path):
+        _create_keystore_files(keystore_path)
+    print('all done! enjoy your keystore in %s' % keystore_path)
+    print('cheers!')
+    return True
+
 
+def _create_keystore_files(keystore_path):
     ca_conf_path = os.path.join(keystore_path, 'ca_conf.cnf')
     if not os.path.isfile(ca_conf_path):
         print('creating CA file: %s' % ca_conf_path)
@@ -286,10 +287,6 @@ def create_keystore(keystore_path):
         with open(serial_path, 'w') as f:
             f.write('1000')
 
-    print('all done! enjoy your keystore in %s' % keystore_path)
-    print('cheers!')
-    return True
-
 
 def is_valid_keystore(path):
     res = os.path.isfile(os.path.join(path, 'ca_conf.cnf'))
@@ -302,6 +299,12 @@ def is_valid_keystore(path):
 
 
 def is_key_name_valid(name):
+    # rclpy is slow to import and only needed here
+    from rclpy.exceptions import InvalidNamespaceException
+    from rclpy.exceptions import InvalidNodeNameException
+    from rclpy.validate_namespace import validate_namespace
+    from rclpy.validate_node_name import validate_node_name
+
     ns_and_name = name.rsplit('/', 1)
     if len(ns_and_name) != 2:
         print("The key name needs to start with '/'")
@@ -328,91 +331,110 @@ commonName = %s
 """ % name)
 
 
+@profiled('create_key_and_cert_req')
 def create_key_and_cert_req(root, relative_path, cnf_path, ecdsa_param_path, key_path, req_path):
-    key_relpath = os.path.join(relative_path, 'key.pem')
-    ecdsa_param_relpath = os.path.join(relative_path, 'ecdsaparam')
-    cnf_relpath = os.path.join(relative_path, 'request.cnf')
-    key_relpath = os.path.join(relative_path, 'key.pem')
-    req_relpath = os.path.join(relative_path, 'req.pem')
-    openssl_executable = find_openssl_executable()
-    check_openssl_version(openssl_executable)
-    run_shell_command(
-        '%s req -nodes -new -newkey ec:%s -config %s -keyout %s -out %s' %
-        (openssl_executable, ecdsa_param_relpath, cnf_relpath, key_relpath, req_relpath), root)
+    get_crypto_backend().create_key_and_cert_req(
+        root, relative_path, cnf_path, ecdsa_param_path, key_path, req_path)
 
 
+@profiled('create_cert')
 def create_cert(root_path, relative_path):
-    req_relpath = os.path.join(relative_path, 'req.pem')
-    cert_relpath = os.path.join(relative_path, 'cert.pem')
-    openssl_executable = find_openssl_executable()
-    check_openssl_version(openssl_executable)
-    run_shell_command(
-        '%s ca -batch -create_serial -config ca_conf.cnf -days 3650 -in %s -out %s' %
-        (openssl_executable, req_relpath, cert_relpath), root_path)
-
-
-def create_permission_file(path, domain_id, policy_element):
+    count('certs')
+    get_crypto_backend().create_cert(root_path, relative_path)
 
-    permissions_xsl_path = get_transport_template('dds', 'permissions.xsl')
-    permissions_xsl = etree.XSLT(etree.parse(permissions_xsl_path))
-    permissions_xsd_path = get_transport_schema('dds', 'permissions.xsd')
-    permissions_xsd = etree.XMLSchema(etree.parse(permissions_xsd_path))
 
-    permissions_xml = permissions_xsl(policy_element)
-
-    domain_id_elements = permissions_xml.findall('permissions/grant/*/domains/id')
-    for domain_id_element in domain_id_elements:
-        domain_id_element.text = domain_id
+def transform_policy_to_permissions(domain_id, policy_element):
+    permissions_xsd = get_compiled_transport_schema('dds', 'permissions.xsd')
+    permissions_xml = transform_permissions(policy_element, domain_id)
 
     try:
-        permissions_xsd.assertValid(permissions_xml)
+        with span('validate_permissions'):
+            permissions_xsd.assertValid(permissions_xml)
     except etree.DocumentInvalid as e:
         raise RuntimeError(str(e))
+    return permissions_xml
+
+
+@profiled('create_permission_file')
+def create_permission_file(path, domain_id, policy_element):
+    permissions_xml = transform_policy_to_permissions(domain_id, policy_element)
 
+    count('permissions_files')
     with open(path, 'wb') as f:
         f.write(etree.tostring(permissions_xml, pretty_print=True))
 
 
+@profiled('create_permission_files')
+def create_permission_files(paths, domain_id, policy_element):
+    """
+    Create the permissions files of all the profiles of a policy in a single pass.
+
+    The policy is transformed and validated once, then the permissions are split into one
+    document per grant, written in profile order to the given paths.
+    """
+    permissions_xml = transform_policy_to_permissions(domain_id, policy_element)
+    dds_element = permissions_xml.getroot()
+    grant_elements = dds_element.findall('permissions/grant')
+    if len(grant_elements) != len(paths):
+        raise RuntimeError('expected %d grants, got %d' % (len(paths), len(grant_elements)))
+    count('permissions_files', len(paths))
+
+    for path, grant_element in zip(paths, grant_elements):
+        identity_dds_element = etree.Element(
+            dds_element.tag, attrib=dds_element.attrib, nsmap=dds_element.nsmap)
+        permissions_element = etree.SubElement(identity_dds_element, 'permissions')
+        # moving the grant frees it along with the document written
+        permissions_element.append(grant_element)
+        with open(path, 'wb') as f:
+            f.write(etree.tostring(identity_dds_element, pretty_print=True))
+
+
+@profiled('get_policy')
 def get_policy(name, policy_file_path):
     policy_tree = load_policy(policy_file_path)
     return get_policy_from_tree(name, policy_tree)
 
 
 def get_policy_from_tree(name, policy_tree):
+    return get_policy_from_index(name, PolicyIndex(policy_tree))
+
+
+def get_policy_from_index(name, policy_index):
     ns, node = name.rsplit('/', 1)
     ns = '/' if not ns else ns
-    profile_element = policy_tree.find(
-        path='profiles/profile[@ns="{ns}"][@node="{node}"]'.format(
-            ns=ns,
-            node=node))
-    if profile_element is None:
+    policy_element = policy_index.get_policy_element(ns, node)
+    if policy_element is None:
         raise RuntimeError('unable to find profile "{name}"'.format(
             name=name
         ))
-    profiles_element = etree.Element('profiles')
-    profiles_element.append(profile_element)
-    policy_element = etree.Element('policy')
-    policy_element.append(profiles_element)
     return policy_element
 
 
+@profiled('create_signed_permissions_file')
 def create_signed_permissions_file(
         permissions_path, signed_permissions_path, ca_cert_path, ca_key_path):
 
-    openssl_executable = find_openssl_executable()
-    check_openssl_version(openssl_executable)
-    run_shell_command(
-        '%s smime -sign -in %s -text -out %s -signer %s -inkey %s' %
-        (openssl_executable, permissions_path, signed_permissions_path, ca_cert_path, ca_key_path))
+    count('signed_files')
+    get_crypto_backend().create_smime_signed_file(
+        permissions_path, signed_permissions_path, ca_cert_path, ca_key_path)
+
+
+@profiled('create_signed_permissions_files')
+def create_signed_permissions_files(paths, ca_cert_path, ca_key_path):
+    """Sign a list of (permissions_path, signed_permissions_path) with the CA loaded once."""
+    count('signed_files', len(paths))
+    get_crypto_backend().create_smime_signed_files(paths, ca_cert_path, ca_key_path)
 
 
+@profiled('create_permission')
 def create_permission(keystore_path, identity, policy_file_path):
     policy_element = get_policy(identity, policy_file_path)
     create_permissions_from_policy_element(keystore_path, identity, policy_element)
     return True
 
 
-def create_permissions_from_policy_element(keystore_path, identity, policy_element):
+def create_permissions_from_policy_element(
+        keystore_path, identity, policy_element, catalog=None):
     domain_id = os.getenv(DOMAIN_ID_ENV, '0')
     relative_path = os.path.normpath(identity.lstrip('/'))
     key_dir = os.path.join(keystore_path, relative_path)
@@ -423,41 +445,89 @@ def create_permissions_from_policy_element(keystore_path, identity, policy_eleme
     signed_permissions_path = os.path.join(key_dir, 'permissions.p7s')
     keystore_ca_cert_path = os.path.join(keystore_path, 'ca.cert.pem')
     keystore_ca_key_path = os.path.join(keystore_path, 'ca.key.pem')
-    create_signed_permissions_file(
-        permissions_path, signed_permissions_path,
+    create_signed_permissions_files(
+        [(permissions_path, signed_permissions_path)],
         keystore_ca_cert_path, keystore_ca_key_path)
+    _update_catalog(keystore_path, catalog, permissions_identities=[identity])
+
+
+@profiled('update_catalog')
+def _update_catalog(keystore_path, catalog, cert_identities=[], permissions_identities=[]):
+    if catalog is None:
+        with KeystoreCatalog(keystore_path) as catalog:
+            _update_catalog(keystore_path, catalog, cert_identities, permissions_identities)
+        return
+    for identity in cert_identities:
+        catalog.update_cert(identity)
+    for identity in permissions_identities:
+        catalog.update_permissions(identity)
 
 
-def create_key(keystore_path, identity):
+def get_link_mode(link_mode=None):
+    if link_mode is None:
+        link_mode = os.getenv(LINK_MODE_ENV) or 'copy'
+    if link_mode not in LINK_MODES:
+        raise RuntimeError(
+            "unknown link mode '%s', expected one of: %s" % (link_mode, ', '.join(LINK_MODES)))
+    return link_mode
+
+
+def _link_or_copy_file(src, dst, link_mode):
+    # replace whatever is there, as copying onto a link would write through it
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link_mode == 'symlink':
+        os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+    elif link_mode == 'hardlink':
+        os.link(src, dst)
+    else:
+        shutil.copyfile(src, dst)
+
+
+@profiled('create_key')
+def create_key(keystore_path, identity, link_mode=None, policy_file_path=None):
     if not is_valid_keystore(keystore_path):
         print("'%s' is not a valid keystore " % keystore_path)
         return False
     if not is_key_name_valid(identity):
         return False
+    # get the policy first so that a missing profile does not leave a half created identity
+    if policy_file_path is not None:
+        policy_element = get_policy(identity, policy_file_path)
+    else:
+        policy_element = get_default_policy_element(identity)
+    create_key_and_cert_req_for_identity(keystore_path, identity, link_mode)
+    with KeystoreCatalog(keystore_path) as catalog:
+        create_cert_for_identity(keystore_path, identity, catalog)
+        create_permissions_from_policy_element(
+            keystore_path, identity, policy_element, catalog)
+    return True
+
+
+@profiled('create_key_and_cert_req_for_identity')
+def create_key_and_cert_req_for_identity(keystore_path, identity, link_mode=None):
     print("creating key for identity: '%s'" % identity)
+    link_mode = get_link_mode(link_mode)
 
     relative_path = os.path.normpath(identity.lstrip('/'))
     key_dir = os.path.join(keystore_path, relative_path)
     os.makedirs(key_dir, exist_ok=True)
 
-    # copy the CA cert in there
+    # copy or link the CA cert in there, links share a single copy with the keystore so that
+    # replacing or re-signing it there updates every identity
     keystore_ca_cert_path = os.path.join(keystore_path, 'ca.cert.pem')
     dest_identity_ca_cert_path = os.path.join(key_dir, 'identity_ca.cert.pem')
     dest_permissions_ca_cert_path = os.path.join(key_dir, 'permissions_ca.cert.pem')
-    shutil.copyfile(keystore_ca_cert_path, dest_identity_ca_cert_path)
-    shutil.copyfile(keystore_ca_cert_path, dest_permissions_ca_cert_path)
+    _link_or_copy_file(keystore_ca_cert_path, dest_identity_ca_cert_path, link_mode)
+    _link_or_copy_file(keystore_ca_cert_path, dest_permissions_ca_cert_path, link_mode)
 
-    # copy the governance file in there
+    # copy or link the governance file in there
     keystore_governance_path = os.path.join(keystore_path, 'governance.p7s')
     dest_governance_path = os.path.join(key_dir, 'governance.p7s')
-    shutil.copyfile(keystore_governance_path, dest_governance_path)
+    _link_or_copy_file(keystore_governance_path, dest_governance_path, link_mode)
 
-    ecdsa_param_path = os.path.join(key_dir, 'ecdsaparam')
-    if not os.path.isfile(ecdsa_param_path):
-        print('creating ECDSA param file: %s' % ecdsa_param_path)
-        create_ecdsa_param_file(ecdsa_param_path)
-    else:
-        print('found ECDSA param file, not writing a new one!')
+    # keys use the curve parameters of the keystore rather than generating their own
+    ecdsa_param_path = os.path.join(keystore_path, 'ecdsaparam')
 
     cnf_path = os.path.join(key_dir, 'request.cnf')
     if not os.path.isfile(cnf_path):
@@ -478,15 +548,25 @@ def create_key(keystore_path, identity):
     else:
         print('found key and cert req; not creating new ones!')
 
-    cert_path = os.path.join(key_dir, 'cert.pem')
-    if not os.path.isfile(cert_path):
-        print('creating cert')
-        create_cert(keystore_path, relative_path)
-    else:
-        print('found cert; not creating a new one!')
 
-    # create a wildcard permissions file for this node which can be overridden
-    # later using a policy if desired
+@profiled('create_cert_for_identity')
+def create_cert_for_identity(keystore_path, identity, catalog=None):
+    # this updates the serial and the database of the keystore CA, so unlike the other
+    # steps of key creation it must not run concurrently for several identities, even from
+    # other processes
+    relative_path = os.path.normpath(identity.lstrip('/'))
+    cert_path = os.path.join(keystore_path, relative_path, 'cert.pem')
+    with keystore_lock(keystore_path):
+        if not os.path.isfile(cert_path):
+            print('creating cert')
+            create_cert(keystore_path, relative_path)
+            _update_catalog(keystore_path, catalog, cert_identities=[identity])
+        else:
+            print('found cert; not creating a new one!')
+
+
+def get_default_policy_element(identity):
+    # a wildcard policy for this node which can be overridden later using a policy if desired
     policy_file_path = get_policy_default('policy.xml')
     policy_element = get_policy('/default', policy_file_path)
     profile_element = policy_element.find('profiles/profile')
@@ -494,29 +574,76 @@ def create_key(keystore_path, identity):
     ns = '/' if not ns else ns
     profile_element.attrib['ns'] = ns
     profile_element.attrib['node'] = node
+    return policy_element
 
-    permissions_path = os.path.join(key_dir, 'permissions.xml')
-    domain_id = os.getenv(DOMAIN_ID_ENV, '0')
-    create_permission_file(permissions_path, domain_id, policy_element)
 
-    signed_permissions_path = os.path.join(key_dir, 'permissions.p7s')
-    keystore_ca_key_path = os.path.join(keystore_path, 'ca.key.pem')
-    create_signed_permissions_file(
-        permissions_path, signed_permissions_path,
-        keystore_ca_cert_path, keystore_ca_key_path)
+def create_default_permissions_for_identity(keystore_path, identity):
+    create_permissions_from_policy_element(
+        keystore_path, identity, get_default_policy_element(identity))
 
+
+@profiled('list_keys')
+def list_keys(
+        keystore_path, pattern=None, expires_before=None, sort_by='identity', reverse=False,
+        long_format=False, rebuild=False):
+    if not is_valid_keystore(keystore_path):
+        print("'%s' is not a valid keystore " % keystore_path)
+        return False
+    with KeystoreCatalog(keystore_path) as catalog:
+        if rebuild:
+            catalog.rebuild()
+        entries = catalog.query(
+            pattern=pattern, expires_before=expires_before, sort_by=sort_by, reverse=reverse)
+    for entry in entries:
+        if long_format:
+            print('\t'.join(
+                field if field is not None else '-'
+                for field in (entry.identity, entry.serial, entry.not_before, entry.not_after,
+                              entry.fingerprint)))
+        else:
+            print(entry.identity)
     return True
 
 
-def list_keys(keystore_path):
-    for name in os.listdir(keystore_path):
-        if os.path.isdir(os.path.join(keystore_path, name)):
-            print(name)
-    return True
+@profiled('distribute_key')
+def distribute_key(source_keystore_path, target_keystore_path, identities=None):
+    """
+    Push identities of a keystore to a target directory, copying only what changed.
 
+    The content hashes of each identity directory are compared between source and target,
+    and the identities which differ are sent through a single archive. All identities of the
+    keystore are distributed if none are given.
+    """
+    if not is_valid_keystore(source_keystore_path):
+        print("'%s' is not a valid keystore " % source_keystore_path)
+        return False
+    if identities is None:
+        with KeystoreCatalog(source_keystore_path) as catalog:
+            identities = [entry.identity for entry in catalog.query()]
+    relative_paths = []
+    for identity in identities:
+        if not is_key_name_valid(identity):
+            return False
+        relative_path = os.path.normpath(identity.lstrip('/'))
+        if not os.path.isfile(os.path.join(source_keystore_path, relative_path, 'cert.pem')):
+            print("identity '%s' not found in keystore '%s'" % (identity, source_keystore_path))
+            return False
+        relative_paths.append(relative_path)
 
-def distribute_key(source_keystore_path, taget_keystore_path):
-    raise NotImplementedError()
+    changed = [
+        relative_path for relative_path in sorted(set(relative_paths))
+        if get_identity_digests(source_keystore_path, relative_path) !=
+        get_identity_digests(target_keystore_path, relative_path)
+    ]
+    print('distributing %d changed of %d identities to %s' % (
+        len(changed), len(relative_paths), target_keystore_path))
+    if changed:
+        os.makedirs(target_keystore_path, exist_ok=True)
+        with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as archive:
+            write_distribution_archive(source_keystore_path, changed, archive)
+            archive.seek(0)
+            extract_distribution_archive(archive, target_keystore_path)
+    return True
 
 
 def get_keystore_path_from_env():
@@ -527,27 +654,198 @@ def get_keystore_path_from_env():
     return root_keystore_path
 
 
-def generate_artifacts(keystore_path=None, identity_names=[], policy_files=[]):
+def _get_identity(ns, node):
+    return ns.rstrip('/') + '/' + node
+
+
+def get_policy_identities(policy_file_path):
+    """Get the identities a policy file provisions, in the order of its profiles."""
+    identities = []
+    for ns, node in iter_profile_keys(policy_file_path):
+        identity = _get_identity(ns, node)
+        if identity not in identities:
+            identities.append(identity)
+    return identities
+
+
+def _get_last_policy_file_indexes(policy_files):
+    # get the index of the last policy file with a profile of each identity, from the keys of
+    # the profiles only; the first file can not be the last of several, it is not scanned
+    last_indexes = {}
+    for policy_file_index, policy_file in enumerate(policy_files[1:], 1):
+        for ns, node in iter_profile_keys(policy_file):
+            last_indexes[_get_identity(ns, node)] = policy_file_index
+    return last_indexes
+
+
+def _iter_identity_policies(identity_names, policy_files):
+    """
+    Yield each identity to provision with its policy, or None for the default policy.
+
+    The profiles of policy files are streamed. Within a file the first profile found for an
+    identity applies, as with PolicyIndex. The profiles of an identity found in several files
+    are merged and it is yielded once, after the last of these files provided its profile.
+    Only the profiles of such identities are held until then.
+    """
+    last_indexes = {}
+    if len(policy_files) > 1:
+        with span('find_duplicate_profiles'):
+            last_indexes = _get_last_policy_file_indexes(policy_files)
+    # the number of policy files and the merged profiles of each identity found in several
+    merging = {}
+    identities = set()
+    for policy_file_index, policy_file in enumerate(policy_files):
+        policy_file_identities = set()
+        for policy_element in iter_policy(policy_file):
+            profile = policy_element.find('profiles/profile')
+            identity = _get_identity(profile.get('ns'), profile.get('node'))
+            if identity in policy_file_identities or identity in identities:
+                print(
+                    "ignoring profile '%s' of '%s', it was already found" %
+                    (identity, policy_file), file=sys.stderr)
+                continue
+            policy_file_identities.add(identity)
+            last_index = last_indexes.get(identity, policy_file_index)
+            if identity in merging:
+                merging[identity][0] += 1
+                merging[identity][1].merge_profile(profile)
+            elif last_index > policy_file_index:
+                merging[identity] = [1, PolicyIndex(policy_element)]
+            if identity in merging:
+                if last_index > policy_file_index:
+                    continue
+                policy_file_count, index = merging.pop(identity)
+                print(
+                    "merged the profiles of '%s' found in %d policy files" %
+                    (identity, policy_file_count))
+                policy_element = index.policy
+            identities.add(identity)
+            yield identity, policy_element
+    for identity, (_, index) in merging.items():
+        # policy files changed since they were scanned
+        identities.add(identity)
+        yield identity, index.policy
+    for identity in identity_names:
+        if identity not in identities:
+            identities.add(identity)
+            yield identity, None
+
+
+def _create_requested_certs(keystore_path, key_requests, catalog, wait):
+    # serials are allocated in a fixed order whatever the number of jobs, so certs are only
+    # created for the identities at the front of the queue whose key request is done
+    while key_requests:
+        identity, future = key_requests[0]
+        if future is not None:
+            if not wait and not future.done():
+                return
+            future.result()
+        key_requests.popleft()
+        create_cert_for_identity(keystore_path, identity, catalog)
+
+
+def _create_pending_permissions(keystore_path, domain_id, pending, catalog, manifest):
+    """Transform, validate and sign the permissions of pending identities at once."""
+    if not pending:
+        return
+    profiles_element = etree.Element('profiles')
+    for _, policy_element in pending.values():
+        profiles_element.append(policy_element.find('profiles/profile'))
+    policy_element = etree.Element('policy')
+    policy_element.append(profiles_element)
+    key_dirs = [
+        os.path.join(keystore_path, os.path.normpath(identity.lstrip('/')))
+        for identity in pending
+    ]
+    for key_dir in key_dirs:
+        # the key request of the identity may still be in progress in a worker
+        os.makedirs(key_dir, exist_ok=True)
+    create_permission_files(
+        [os.path.join(key_dir, 'permissions.xml') for key_dir in key_dirs],
+        domain_id, policy_element)
+    create_signed_permissions_files(
+        [
+            (
+                os.path.join(key_dir, 'permissions.xml'),
+                os.path.join(key_dir, 'permissions.p7s'))
+            for key_dir in key_dirs
+        ],
+        os.path.join(keystore_path, 'ca.cert.pem'),
+        os.path.join(keystore_path, 'ca.key.pem'))
+    _update_catalog(keystore_path, catalog, permissions_identities=pending.keys())
+    for identity, (inputs_digest, _) in pending.items():
+        manifest.update(identity, inputs_digest)
+    pending.clear()
+
+
+def _generate_artifacts(keystore_path, identity_names, policy_files, jobs, link_mode):
+    link_mode = get_link_mode(link_mode)
+    domain_id = os.getenv(DOMAIN_ID_ENV, '0')
+    executor = None
+    if jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    catalog = KeystoreCatalog(keystore_path)
+    manifest = ArtifactManifest(keystore_path)
+    # identities whose key request may still be in progress, in the order their certs are due
+    key_requests = deque()
+    pending = OrderedDict()
+    success = True
+    try:
+        # identities are provisioned as the policy files are streamed
+        for identity, policy_element in _iter_identity_policies(identity_names, policy_files):
+            if not is_key_name_valid(identity):
+                # the identities provisioned so far are still completed below
+                success = False
+                break
+            future = None
+            if executor is not None:
+                future = executor.submit(
+                    create_key_and_cert_req_for_identity, keystore_path, identity, link_mode)
+            else:
+                create_key_and_cert_req_for_identity(keystore_path, identity, link_mode)
+            key_requests.append((identity, future))
+            _create_requested_certs(keystore_path, key_requests, catalog, wait=False)
+
+            # only regenerate and sign permissions whose inputs changed since the last run
+            if policy_element is None:
+                policy_element = get_default_policy_element(identity)
+            with span('check_manifest'):
+                inputs_digest = manifest.get_inputs_digest(policy_element, domain_id)
+                if manifest.is_up_to_date(identity, inputs_digest):
+                    print("permissions of identity '%s' are up to date" % identity)
+                    continue
+            pending[identity] = (inputs_digest, policy_element)
+            if len(pending) >= PERMISSIONS_BATCH_SIZE:
+                _create_pending_permissions(keystore_path, domain_id, pending, catalog, manifest)
+        _create_requested_certs(keystore_path, key_requests, catalog, wait=True)
+        _create_pending_permissions(keystore_path, domain_id, pending, catalog, manifest)
+        with span('save_manifest'):
+            manifest.save()
+    finally:
+        catalog.close()
+        if executor is not None:
+            executor.shutdown()
+    return success
+
+
+@profiled('generate_artifacts')
+def generate_artifacts(
+        keystore_path=None, identity_names=[], policy_files=[], jobs=1, link_mode=None):
     if keystore_path is None:
         keystore_path = get_keystore_path_from_env()
         if keystore_path is None:
             return False
+    if jobs < 1:
+        print('the number of jobs must be at least 1, got %d' % jobs, file=sys.stderr)
+        return False
+    # only the names of profiles are found out as the policy files are streamed
+    if not all(is_key_name_valid(identity) for identity in identity_names):
+        return False
     if not is_valid_keystore(keystore_path):
         print('%s is not a valid keystore, creating new keystore' % keystore_path)
         create_keystore(keystore_path)
 
-    # create keys for all provided identities
-    for identity in identity_names:
-        if not create_key(keystore_path, identity):
-            return False
-    for policy_file in policy_files:
-        policy_tree = load_policy(policy_file)
-        profiles_element = policy_tree.find('profiles')
-        for profile in profiles_element:
-            identity_name = profile.get('ns').rstrip('/') + '/' + profile.get('node')
-            if not create_key(keystore_path, identity_name):
-                return False
-            policy_element = get_policy_from_tree(identity_name, policy_tree)
-            create_permissions_from_policy_element(
-                keystore_path, identity_name, policy_element)
-    return True
+    # concurrent runs, e.g. the batched provisioning of several packages of a workspace,
+    # would otherwise provision the same identities and race on the artifacts manifest
+    with keystore_lock(keystore_path, PROVISIONING_LOCK_FILE_NAME):
+        return _generate_artifacts(keystore_path, identity_names, policy_files, jobs, link_mode)
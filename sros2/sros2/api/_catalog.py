@@ -0,0 +1,184 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+import contextlib
+import hashlib
+import os
+import sqlite3
+
+from sros2._constants import CATALOG_SORT_KEYS
+from sros2.crypto import get_crypto_backend
+
+CATALOG_FILE_NAME = 'keystore_catalog.db'
+# seconds a process waits for another one writing to the catalog, e.g. during a rebuild
+CATALOG_TIMEOUT = 300
+# stored as the user_version of the database once the catalog has been built
+_CATALOG_VERSION = 1
+
+CatalogEntry = namedtuple(
+    'CatalogEntry',
+    ('identity', 'serial', 'subject', 'fingerprint', 'not_before', 'not_after',
+     'permissions_hash'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS identities (
+    identity TEXT PRIMARY KEY,
+    serial TEXT,
+    subject TEXT,
+    fingerprint TEXT,
+    not_before TEXT,
+    not_after TEXT,
+    permissions_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS identities_not_after ON identities (not_after);
+"""
+# serials are hex strings of varying length
+_ORDER_BY = {
+    'identity': 'identity',
+    'serial': 'length(serial), serial',
+    'not_before': 'not_before',
+    'not_after': 'not_after',
+}
+
+
+def _hash_file(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_identity_from_relative_path(relative_path):
+    return '/' + '/'.join(relative_path.split(os.sep))
+
+
+class KeystoreCatalog:
+    """
+    Index of the metadata of every identity of a keystore.
+
+    The catalog is a SQLite database stored at the root of the keystore, holding for each
+    identity the serial, subject, fingerprint and validity window of its certificate and the
+    hash of its permissions. It is built by walking the keystore the first time it is opened
+    and kept up to date by the API creating keys and permissions afterwards.
+    Each update is committed on its own, so that processes provisioning the same keystore,
+    e.g. the commands a build runs in parallel, only wait for each other briefly.
+    """
+
+    def __init__(self, keystore_path):
+        self.keystore_path = keystore_path
+        self.path = os.path.join(keystore_path, CATALOG_FILE_NAME)
+        # transactions are explicit, to take the write lock before checking for a catalog
+        self._connection = sqlite3.connect(
+            self.path, timeout=CATALOG_TIMEOUT, isolation_level=None)
+        self._connection.executescript(_SCHEMA)
+        with self._transaction():
+            # only the first of several processes opening a new catalog builds it
+            version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+            if version != _CATALOG_VERSION:
+                self._rebuild()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _get_key_dir(self, identity):
+        return os.path.join(self.keystore_path, os.path.normpath(identity.lstrip('/')))
+
+    def update_cert(self, identity):
+        with self._transaction():
+            self._update_cert(identity)
+
+    def _update_cert(self, identity):
+        cert_info = get_crypto_backend().get_cert_info(
+            os.path.join(self._get_key_dir(identity), 'cert.pem'))
+        self._connection.execute(
+            'INSERT OR IGNORE INTO identities (identity) VALUES (?)', (identity,))
+        self._connection.execute(
+            'UPDATE identities SET serial = ?, subject = ?, fingerprint = ?, '
+            'not_before = ?, not_after = ? WHERE identity = ?', cert_info + (identity,))
+
+    def update_permissions(self, identity):
+        with self._transaction():
+            self._update_permissions(identity)
+
+    def _update_permissions(self, identity):
+        permissions_hash = _hash_file(
+            os.path.join(self._get_key_dir(identity), 'permissions.xml'))
+        self._connection.execute(
+            'INSERT OR IGNORE INTO identities (identity) VALUES (?)', (identity,))
+        self._connection.execute(
+            'UPDATE identities SET permissions_hash = ? WHERE identity = ?',
+            (permissions_hash, identity))
+
+    def rebuild(self):
+        """Index every identity directory holding a certificate, at any namespace depth."""
+        with self._transaction():
+            self._rebuild()
+
+    def _rebuild(self):
+        self._connection.execute('DELETE FROM identities')
+        for dirpath, dirnames, filenames in os.walk(self.keystore_path):
+            dirnames.sort()
+            if dirpath == self.keystore_path or 'cert.pem' not in filenames:
+                continue
+            identity = get_identity_from_relative_path(
+                os.path.relpath(dirpath, self.keystore_path))
+            self._update_cert(identity)
+            if 'permissions.xml' in filenames:
+                self._update_permissions(identity)
+        self._connection.execute('PRAGMA user_version = %d' % _CATALOG_VERSION)
+
+    def query(self, pattern=None, expires_before=None, sort_by='identity', reverse=False):
+        """
+        Get the entries of the identities matching the given filters.
+
+        :param pattern: a glob pattern the identity has to match, e.g. '/fleet/*'
+        :param expires_before: a UTC ISO 8601 date or time the certificate expires before
+        :param sort_by: one of CATALOG_SORT_KEYS
+        """
+        if sort_by not in _ORDER_BY:
+            raise RuntimeError(
+                "unknown sort key '%s', expected one of: %s" %
+                (sort_by, ', '.join(CATALOG_SORT_KEYS)))
+        conditions = []
+        parameters = []
+        if pattern is not None:
+            conditions.append('identity GLOB ?')
+            parameters.append(pattern)
+        if expires_before is not None:
+            conditions.append('not_after < ?')
+            parameters.append(expires_before)
+        statement = 'SELECT %s FROM identities' % ', '.join(CatalogEntry._fields)
+        if conditions:
+            statement += ' WHERE ' + ' AND '.join(conditions)
+        direction = ' DESC' if reverse else ''
+        statement += ' ORDER BY ' + ', '.join(
+            column + direction for column in _ORDER_BY[sort_by].split(', '))
+        if sort_by != 'identity':
+            statement += ', identity'
+        return [CatalogEntry(*row) for row in self._connection.execute(statement, parameters)]
@@ -0,0 +1,148 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import hashlib
+import os
+import shutil
+import sys
+import tarfile
+
+_STAGING_SUFFIX = '.sros2-staging'
+_OLD_SUFFIX = '.sros2-old'
+
+# renameat2() arguments, from linux/fcntl.h and linux/fs.h
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+
+
+def _hash_file(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_identity_digests(keystore_path, relative_path):
+    """
+    Get the content hashes of the files of an identity directory, or None if it is missing.
+
+    Subdirectories hold nested identities and are not part of the identity.
+    """
+    key_dir = os.path.join(keystore_path, relative_path)
+    try:
+        names = os.listdir(key_dir)
+    except FileNotFoundError:
+        return None
+    return {
+        name: _hash_file(os.path.join(key_dir, name))
+        for name in names
+        if os.path.isfile(os.path.join(key_dir, name))
+    }
+
+
+def write_distribution_archive(source_keystore_path, relative_paths, fileobj):
+    """
+    Stream the files of the given identity directories into a single tar archive.
+
+    Files linked to the shared copies of the keystore are archived as real copies.
+    """
+    with tarfile.open(fileobj=fileobj, mode='w|', dereference=True) as archive:
+        for relative_path in relative_paths:
+            key_dir = os.path.join(source_keystore_path, relative_path)
+            for name in sorted(os.listdir(key_dir)):
+                path = os.path.join(key_dir, name)
+                if os.path.isfile(path):
+                    archive.add(path, arcname='/'.join(relative_path.split(os.sep) + [name]))
+
+
+def _exchange_paths(path, other_path):
+    """Atomically exchange two paths, returning False where the platform can not."""
+    if not sys.platform.startswith('linux'):
+        return False
+    # ctypes is only needed here
+    import ctypes
+    renameat2 = getattr(ctypes.CDLL(None, use_errno=True), 'renameat2', None)
+    if renameat2 is None:
+        return False
+    if renameat2(
+            _AT_FDCWD, os.fsencode(path), _AT_FDCWD, os.fsencode(other_path),
+            _RENAME_EXCHANGE) == 0:
+        return True
+    error = ctypes.get_errno()
+    # old kernels and some filesystems do not support the exchange
+    if error in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+        return False
+    raise OSError(error, os.strerror(error), path)
+
+
+def _move_nested_identities(path, new_path):
+    for name in os.listdir(path):
+        if os.path.isdir(os.path.join(path, name)) and not name.endswith(
+                (_STAGING_SUFFIX, _OLD_SUFFIX)):
+            os.rename(os.path.join(path, name), os.path.join(new_path, name))
+
+
+def _swap_directory(staging_path, path):
+    if not os.path.isdir(path):
+        os.rename(staging_path, path)
+        return
+    if _exchange_paths(staging_path, path):
+        # the staging path now holds the previous directory, whose nested identities are
+        # carried over to the new one untouched
+        _move_nested_identities(staging_path, path)
+        shutil.rmtree(staging_path)
+        return
+    _move_nested_identities(path, staging_path)
+    old_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + _OLD_SUFFIX)
+    os.rename(path, old_path)
+    os.rename(staging_path, path)
+    shutil.rmtree(old_path)
+
+
+def extract_distribution_archive(fileobj, target_keystore_path):
+    """
+    Extract a distribution archive, swapping in each identity directory as a whole.
+
+    The files of an identity are first written with their final modes to a staging directory
+    next to it. On Linux the staging directory is then atomically exchanged with the previous
+    one, so that the files of an identity are never seen half updated; elsewhere, or where the
+    filesystem can not exchange directories, the previous directory is renamed away first
+    and the identity is missing for a moment. Nested identities are moved into the new
+    directory after the swap, and are briefly missing either way.
+    """
+    staging_path = None
+    key_dir = None
+    with tarfile.open(fileobj=fileobj, mode='r|') as archive:
+        for member in archive:
+            parts = member.name.split('/')
+            if not member.isfile() or len(parts) < 2 or any(
+                    part in ('', '.', '..') for part in parts):
+                raise RuntimeError("unexpected member '%s' in archive" % member.name)
+            member_key_dir = os.path.join(target_keystore_path, *parts[:-1])
+            if member_key_dir != key_dir:
+                if staging_path is not None:
+                    _swap_directory(staging_path, key_dir)
+                key_dir = member_key_dir
+                staging_path = os.path.join(
+                    os.path.dirname(key_dir), '.' + os.path.basename(key_dir) + _STAGING_SUFFIX)
+                shutil.rmtree(staging_path, ignore_errors=True)
+                os.makedirs(staging_path)
+            path = os.path.join(staging_path, parts[-1])
+            # private keys must not be readable by others, even while they are written
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, member.mode & 0o777)
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(archive.extractfile(member), f)
+            # the umask may have dropped bits of the archived mode
+            os.chmod(path, member.mode)
+        if staging_path is not None:
+            _swap_directory(staging_path, key_dir)
@@ -0,0 +1,66 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+LOCK_FILE_NAME = 'keystore.lock'
+# held by whole provisioning runs, which take the keystore lock for each identity
+PROVISIONING_LOCK_FILE_NAME = 'provisioning.lock'
+
+
+def _lock(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            # gives up after 10 attempts a second apart
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextlib.contextmanager
+def keystore_lock(keystore_path, lock_file_name=LOCK_FILE_NAME):
+    """
+    Hold the lock of a keystore for the duration of the block.
+
+    The lock is advisory, and taken by every update of the keystore CA and its database, so
+    that processes provisioning identities of the same keystore, e.g. the commands a build
+    runs in parallel, can not allocate the same serial.
+    Locks of different names are independent, a process may hold several of them.
+    """
+    with open(os.path.join(keystore_path, lock_file_name), 'a') as f:
+        _lock(f)
+        try:
+            yield
+        finally:
+            _unlock(f)
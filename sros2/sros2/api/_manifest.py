@@ -0,0 +1,134 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import hashlib
+import json
+import os
+
+from lxml import etree
+
+from sros2.policy import (
+    get_permissions_engine_files,
+    get_permissions_engine_name,
+    get_transport_schema,
+    get_transport_template,
+)
+
+MANIFEST_FILE_NAME = 'artifacts_manifest.json'
+MANIFEST_VERSION = 1
+
+_XML_BASE_ATTRIBUTE = '{http://www.w3.org/XML/1998/namespace}base'
+
+
+def _hash_file(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def canonicalize_policy_element(policy_element):
+    """
+    Get a canonical serialization of a policy element.
+
+    Formatting whitespace, the xml:base attributes left behind by XInclude and unused
+    namespace declarations do not change the generated permissions, so they are left out.
+    """
+    policy_element = copy.deepcopy(policy_element)
+    for element in policy_element.iter():
+        element.attrib.pop(_XML_BASE_ATTRIBUTE, None)
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    return etree.tostring(policy_element, method='c14n', exclusive=True)
+
+
+class ArtifactManifest:
+    """
+    Digests of the inputs each identity's permissions were last generated from.
+
+    The manifest is stored at the root of the keystore. An identity is up to date when the
+    digest of its canonicalized policy, the domain id, the keystore CA certificate, the
+    permissions templates and the permissions engine, by name and source, match the recorded
+    one and its permissions files were not changed since they were generated.
+    """
+
+    def __init__(self, keystore_path):
+        self.keystore_path = keystore_path
+        self.path = os.path.join(keystore_path, MANIFEST_FILE_NAME)
+        self.identities = {}
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.identities = manifest['identities']
+        except (OSError, ValueError, KeyError):
+            pass
+        self._common_digest = None
+
+    def _get_common_digest(self):
+        if self._common_digest is None:
+            digest = hashlib.sha256()
+            # a fix of the engine or a switch to another one changes the generated permissions
+            digest.update(get_permissions_engine_name().encode() + b'\0')
+            for path in [
+                os.path.join(self.keystore_path, 'ca.cert.pem'),
+                get_transport_template('dds', 'permissions.xsl'),
+                get_transport_schema('dds', 'permissions.xsd'),
+            ] + get_permissions_engine_files():
+                digest.update(_hash_file(path).encode())
+            self._common_digest = digest.hexdigest()
+        return self._common_digest
+
+    def get_inputs_digest(self, policy_element, domain_id):
+        digest = hashlib.sha256()
+        digest.update(self._get_common_digest().encode())
+        digest.update(domain_id.encode() + b'\0')
+        digest.update(canonicalize_policy_element(policy_element))
+        return digest.hexdigest()
+
+    def _get_permissions_paths(self, identity):
+        key_dir = os.path.join(self.keystore_path, os.path.normpath(identity.lstrip('/')))
+        return (
+            os.path.join(key_dir, 'permissions.xml'),
+            os.path.join(key_dir, 'permissions.p7s'))
+
+    def is_up_to_date(self, identity, inputs_digest):
+        entry = self.identities.get(identity)
+        if entry is None or entry.get('inputs') != inputs_digest:
+            return False
+        permissions_path, signed_permissions_path = self._get_permissions_paths(identity)
+        try:
+            return (
+                _hash_file(permissions_path) == entry.get('permissions') and
+                _hash_file(signed_permissions_path) == entry.get('signed_permissions'))
+        except OSError:
+            return False
+
+    def update(self, identity, inputs_digest):
+        permissions_path, signed_permissions_path = self._get_permissions_paths(identity)
+        self.identities[identity] = {
+            'inputs': inputs_digest,
+            'permissions': _hash_file(permissions_path),
+            'signed_permissions': _hash_file(signed_permissions_path),
+        }
+
+    def save(self):
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'identities': self.identities,
+            }, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
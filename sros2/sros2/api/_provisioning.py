@@ -0,0 +1,83 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+PROVISIONING_MANIFEST_EXTENSION = '.txt'
+
+
+def _get_manifest_paths(path):
+    if not os.path.isdir(path):
+        return [path]
+    return [
+        os.path.join(path, name) for name in sorted(os.listdir(path))
+        if name.endswith(PROVISIONING_MANIFEST_EXTENSION)]
+
+
+def _read_declarations(manifest_path):
+    with open(manifest_path) as f:
+        lines = f.read().splitlines()
+    declarations = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        kind, _, value = line.partition(' ')
+        value = value.strip()
+        if kind not in ('source', 'node', 'policy') or not value:
+            raise RuntimeError(
+                "invalid declaration '%s' in provisioning manifest '%s', line %d" %
+                (line, manifest_path, line_number))
+        declarations.append((kind, value))
+    return declarations
+
+
+def read_provisioning_manifests(paths):
+    """
+    Read the identities and policy files declared in provisioning manifests.
+
+    A manifest is a text file with one declaration per line, either 'node <identity>',
+    'policy <path of a policy file>' or 'source <directory>', e.g. as written by sros2_cmake
+    for each package of a workspace. A directory stands for the manifests it holds. Each
+    declaration is returned once. Manifests whose source directory does not exist anymore,
+    e.g. of a removed package, are skipped, as are policy files which do not exist anymore.
+    :return: the identities and the absolute paths of the policy files, in declaration order
+    """
+    identities = []
+    policy_files = []
+    for manifest_path in (p for path in paths for p in _get_manifest_paths(path)):
+        declarations = _read_declarations(manifest_path)
+        manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+        missing_sources = [
+            os.path.join(manifest_dir, value) for kind, value in declarations
+            if kind == 'source' and not os.path.isdir(os.path.join(manifest_dir, value))]
+        if missing_sources:
+            print(
+                "ignoring provisioning manifest '%s', its source directory '%s' does not "
+                'exist' % (manifest_path, missing_sources[0]), file=sys.stderr)
+            continue
+        for kind, value in declarations:
+            if kind == 'node':
+                if value not in identities:
+                    identities.append(value)
+            elif kind == 'policy':
+                policy_file = os.path.join(manifest_dir, value)
+                if not os.path.isfile(policy_file):
+                    print(
+                        "ignoring policy file '%s' declared in '%s', it does not exist" %
+                        (policy_file, manifest_path), file=sys.stderr)
+                elif policy_file not in policy_files:
+                    policy_files.append(policy_file)
+    return identities, policy_files
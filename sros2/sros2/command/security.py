@@ -12,10 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+
 from ros2cli.command import add_subparsers
 from ros2cli.command import CommandExtension
 from ros2cli.verb import get_verb_extensions
 
+from sros2._profiling import disable_profiling, enable_profiling, span
+
 
 class SecurityCommand(CommandExtension):
     """Various security related sub-commands."""
@@ -33,5 +37,19 @@ class SecurityCommand(CommandExtension):
             return 0
         extension = getattr(args, '_verb')
 
-        # call the verb's main method
-        return extension.main(args=args)
+        timings = getattr(args, 'timings', False)
+        profile_out = getattr(args, 'profile_out', None)
+        if not timings and profile_out is None:
+            # call the verb's main method
+            return extension.main(args=args)
+
+        profiler = enable_profiling()
+        try:
+            with span(extension.NAME or type(extension).__name__):
+                return extension.main(args=args)
+        finally:
+            disable_profiling()
+            if timings:
+                profiler.print_report(sys.stderr)
+            if profile_out is not None:
+                profiler.write(profile_out)
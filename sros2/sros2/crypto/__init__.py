@@ -0,0 +1,62 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import os
+
+from sros2.crypto._openssl import OpenSSLBackend
+
+CRYPTO_BACKEND_ENV = 'SROS2_CRYPTO_BACKEND'
+
+_backends = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _get_cryptography_backend_class():
+    # the cryptography package is slow to import, only load it once a backend is needed
+    try:
+        from sros2.crypto._cryptography import CryptographyBackend
+    except ImportError:
+        return None
+    return CryptographyBackend
+
+
+def get_crypto_backend_names():
+    names = [OpenSSLBackend.NAME]
+    CryptographyBackend = _get_cryptography_backend_class()
+    if CryptographyBackend is not None:
+        names.insert(0, CryptographyBackend.NAME)
+    return names
+
+
+def get_crypto_backend(name=None):
+    """
+    Get the backend used to create keys, certificates and signatures.
+
+    Unless a name is given or set in the SROS2_CRYPTO_BACKEND environment variable, the
+    in-process 'cryptography' backend is preferred and the 'openssl' executable is used as a
+    fallback when the cryptography package is not available.
+    """
+    if name is None:
+        name = os.getenv(CRYPTO_BACKEND_ENV) or get_crypto_backend_names()[0]
+    if name not in _backends:
+        if name == OpenSSLBackend.NAME:
+            _backends[name] = OpenSSLBackend()
+        elif name in get_crypto_backend_names():
+            _backends[name] = _get_cryptography_backend_class()()
+        else:
+            raise RuntimeError(
+                "unknown or unavailable crypto backend '%s', expected one of: %s" %
+                (name, ', '.join(get_crypto_backend_names())))
+    return _backends[name]
@@ -0,0 +1,363 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import datetime
+import os
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import pkcs7
+from cryptography.x509.oid import NameOID
+
+from sros2.crypto._openssl import CERT_DATE_FORMAT, CertInfo
+
+# Same validity period as the `-days 3650` passed to `openssl req` and `openssl ca`
+_CERT_VALIDITY = datetime.timedelta(days=3650)
+# Short attribute names used by openssl when printing distinguished names
+_NAME_OID_SHORT_NAMES = {
+    NameOID.COMMON_NAME: 'CN',
+    NameOID.COUNTRY_NAME: 'C',
+    NameOID.STATE_OR_PROVINCE_NAME: 'ST',
+    NameOID.ORGANIZATION_NAME: 'O',
+    NameOID.ORGANIZATIONAL_UNIT_NAME: 'OU',
+    NameOID.EMAIL_ADDRESS: 'emailAddress',
+}
+
+
+def _parse_openssl_conf(path):
+    """
+    Parse the subset of the openssl configuration format written by sros2.
+
+    Keys found before the first section header end up in the '' section.
+    """
+    sections = {'': {}}
+    section = sections['']
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                section = sections.setdefault(line[1:-1].strip(), {})
+                continue
+            key, _, value = line.partition('=')
+            section[key.strip()] = value.strip()
+    return sections
+
+
+def _get_common_name(conf_path):
+    sections = _parse_openssl_conf(conf_path)
+    try:
+        return sections['req_distinguished_name']['commonName']
+    except KeyError:
+        raise RuntimeError("no commonName found in '%s'" % conf_path)
+
+
+def _encode_oid(dotted_string):
+    arcs = [int(arc) for arc in dotted_string.split('.')]
+    body = bytearray([40 * arcs[0] + arcs[1]])
+    for arc in arcs[2:]:
+        chunk = [arc & 0x7f]
+        arc >>= 7
+        while arc:
+            chunk.insert(0, 0x80 | (arc & 0x7f))
+            arc >>= 7
+        body.extend(chunk)
+    return bytes([0x06, len(body)]) + bytes(body)
+
+
+def _decode_oid(der):
+    if len(der) < 2 or der[0] != 0x06 or der[1] != len(der) - 2:
+        raise ValueError('not a DER encoded object identifier')
+    body = der[2:]
+    arcs = [body[0] // 40, body[0] % 40]
+    value = 0
+    for byte in body[1:]:
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            arcs.append(value)
+            value = 0
+    return '.'.join(str(arc) for arc in arcs)
+
+
+def _pem_body(data, label):
+    begin = '-----BEGIN %s-----' % label
+    end = '-----END %s-----' % label
+    text = data.decode('ascii')
+    start = text.find(begin)
+    stop = text.find(end, start)
+    if start < 0 or stop < 0:
+        raise ValueError('no %s block found' % label)
+    return base64.b64decode(''.join(text[start + len(begin):stop].split()))
+
+
+def _pem_encode(der, label):
+    encoded = base64.b64encode(der).decode('ascii')
+    lines = [encoded[i:i + 64] for i in range(0, len(encoded), 64)]
+    return ('-----BEGIN %s-----\n%s\n-----END %s-----\n' % (
+        label, '\n'.join(lines), label)).encode('ascii')
+
+
+def _load_curve(ecdsa_param_path):
+    with open(ecdsa_param_path, 'rb') as f:
+        oid = _decode_oid(_pem_body(f.read(), 'EC PARAMETERS'))
+    return ec.get_curve_for_oid(x509.ObjectIdentifier(oid))()
+
+
+def _write_private_key(path, private_key):
+    # openssl creates private keys readable by their owner only
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()))
+
+
+def _load_private_key(path):
+    with open(path, 'rb') as f:
+        return serialization.load_pem_private_key(
+            f.read(), password=None, backend=default_backend())
+
+
+def _load_cert(path):
+    with open(path, 'rb') as f:
+        return x509.load_pem_x509_certificate(f.read(), default_backend())
+
+
+def _not_valid_before(cert):
+    # not_valid_before is deprecated in favor of not_valid_before_utc in newer releases
+    return getattr(cert, 'not_valid_before_utc', None) or cert.not_valid_before
+
+
+def _not_valid_after(cert):
+    # not_valid_after is deprecated in favor of not_valid_after_utc in newer releases
+    return getattr(cert, 'not_valid_after_utc', None) or cert.not_valid_after
+
+
+def _format_serial(serial):
+    # openssl always writes an even number of upper case hex digits
+    serial_hex = '%X' % serial
+    if len(serial_hex) % 2:
+        serial_hex = '0' + serial_hex
+    return serial_hex
+
+
+def _format_subject(name):
+    # mimic X509_NAME_oneline() as used by `openssl ca` for its database
+    return ''.join(
+        '/%s=%s' % (
+            _NAME_OID_SHORT_NAMES.get(attribute.oid, attribute.oid.dotted_string),
+            attribute.value.replace('/', '\\/'))
+        for attribute in name)
+
+
+def _rotate_file(path, content):
+    if os.path.exists(path):
+        os.replace(path, path + '.old')
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class CADatabase:
+    """
+    The `openssl ca` text database (index.txt and serial) of a keystore.
+
+    Certificates issued in-process are recorded exactly as `openssl ca` would record them,
+    so that both backends can keep operating on the same keystore.
+    """
+
+    def __init__(self, root_path):
+        self.root_path = root_path
+        self.index_path = os.path.join(root_path, 'index.txt')
+        self.serial_path = os.path.join(root_path, 'serial')
+
+    def next_serial(self):
+        with open(self.serial_path, 'r') as f:
+            return int(f.read().strip(), 16)
+
+    def record(self, cert):
+        serial = cert.serial_number
+        with open(self.index_path, 'r') as f:
+            index = f.read()
+        index += 'V\t%s\t\t%s\tunknown\t%s\n' % (
+            _not_valid_after(cert).strftime('%y%m%d%H%M%SZ'),
+            _format_serial(serial),
+            _format_subject(cert.subject))
+        _rotate_file(self.serial_path, _format_serial(serial + 1) + '\n')
+        _rotate_file(self.index_path, index)
+        _rotate_file(self.index_path + '.attr', 'unique_subject = no\n')
+
+
+class CryptographyBackend:
+    """Crypto backend running in-process on top of the cryptography package."""
+
+    NAME = 'cryptography'
+
+    def create_ecdsa_param_file(self, path):
+        # same as `openssl ecparam -name prime256v1`
+        oid = ec.EllipticCurveOID.SECP256R1
+        with open(path, 'wb') as f:
+            f.write(_pem_encode(_encode_oid(oid.dotted_string), 'EC PARAMETERS'))
+
+    def create_ca_key_cert(self, ecdsa_param_path, ca_conf_path, ca_key_path, ca_cert_path):
+        private_key = ec.generate_private_key(_load_curve(ecdsa_param_path), default_backend())
+        name = x509.Name([
+            x509.NameAttribute(NameOID.COMMON_NAME, _get_common_name(ca_conf_path)),
+        ])
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        builder = x509.CertificateBuilder(
+        ).subject_name(
+            name
+        ).issuer_name(
+            name
+        ).public_key(
+            private_key.public_key()
+        ).serial_number(
+            x509.random_serial_number()
+        ).not_valid_before(
+            now
+        ).not_valid_after(
+            now + _CERT_VALIDITY
+        ).add_extension(
+            x509.BasicConstraints(ca=True, path_length=None), critical=False
+        ).add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(private_key.public_key()), critical=False
+        )
+        cert = builder.sign(private_key, hashes.SHA256(), default_backend())
+
+        _write_private_key(ca_key_path, private_key)
+        with open(ca_cert_path, 'wb') as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+    def create_key_and_cert_req(
+            self, root, relative_path, cnf_path, ecdsa_param_path, key_path, req_path):
+        private_key = ec.generate_private_key(_load_curve(ecdsa_param_path), default_backend())
+        csr = x509.CertificateSigningRequestBuilder().subject_name(x509.Name([
+            x509.NameAttribute(NameOID.COMMON_NAME, _get_common_name(cnf_path)),
+        ])).sign(private_key, hashes.SHA256(), default_backend())
+
+        _write_private_key(key_path, private_key)
+        with open(req_path, 'wb') as f:
+            f.write(csr.public_bytes(serialization.Encoding.PEM))
+
+    def create_cert(self, root_path, relative_path):
+        req_path = os.path.join(root_path, relative_path, 'req.pem')
+        cert_path = os.path.join(root_path, relative_path, 'cert.pem')
+        with open(req_path, 'rb') as f:
+            csr = x509.load_pem_x509_csr(f.read(), default_backend())
+        if not csr.is_signature_valid:
+            raise RuntimeError("invalid signature on certificate request '%s'" % req_path)
+        ca_cert = _load_cert(os.path.join(root_path, 'ca.cert.pem'))
+        ca_key = _load_private_key(os.path.join(root_path, 'ca.key.pem'))
+        database = CADatabase(root_path)
+
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        builder = x509.CertificateBuilder(
+        ).subject_name(
+            csr.subject
+        ).issuer_name(
+            ca_cert.subject
+        ).public_key(
+            csr.public_key()
+        ).serial_number(
+            database.next_serial()
+        ).not_valid_before(
+            now
+        ).not_valid_after(
+            now + _CERT_VALIDITY
+        ).add_extension(
+            x509.BasicConstraints(ca=False, path_length=None), critical=False
+        ).add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(csr.public_key()), critical=False
+        ).add_extension(
+            x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()),
+            critical=False
+        )
+        # copy_extensions = copy: keep the extensions requested but not set by the CA
+        issued = {x509.BasicConstraints.oid, x509.SubjectKeyIdentifier.oid,
+                  x509.AuthorityKeyIdentifier.oid}
+        for extension in csr.extensions:
+            if extension.oid not in issued:
+                builder = builder.add_extension(extension.value, extension.critical)
+        cert = builder.sign(ca_key, hashes.SHA256(), default_backend())
+
+        cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+        with open(cert_path, 'wb') as f:
+            f.write(cert_pem)
+        # new_certs_dir of the CA configuration is the keystore root
+        with open(os.path.join(root_path, _format_serial(cert.serial_number) + '.pem'), 'wb') as f:
+            f.write(cert_pem)
+        database.record(cert)
+
+    def get_cert_info(self, cert_path):
+        cert = _load_cert(cert_path)
+        return CertInfo(
+            serial=_format_serial(cert.serial_number),
+            subject=cert.subject.rfc4514_string(),
+            fingerprint=cert.fingerprint(hashes.SHA256()).hex(),
+            not_before=_not_valid_before(cert).strftime(CERT_DATE_FORMAT),
+            not_after=_not_valid_after(cert).strftime(CERT_DATE_FORMAT))
+
+    def create_smime_signed_file(self, in_path, out_path, signer_cert_path, signer_key_path):
+        self.create_smime_signed_files([(in_path, out_path)], signer_cert_path, signer_key_path)
+
+    def create_smime_signed_files(self, paths, signer_cert_path, signer_key_path):
+        # the signer is loaded once for the whole batch
+        signer_cert = _load_cert(signer_cert_path)
+        signer_key = _load_private_key(signer_key_path)
+        for in_path, out_path in paths:
+            with open(in_path, 'rb') as f:
+                content = f.read()
+            with open(out_path, 'wb') as f:
+                f.write(sign_smime(content, signer_cert, signer_key))
+
+
+def sign_smime(content, signer_cert, signer_key):
+    """
+    Produce the same clear-signed S/MIME document as `openssl smime -sign -text`.
+
+    Like openssl, the text/plain MIME part is written in its canonical (CRLF) form, which is
+    also what the detached signature covers.
+    """
+    text_header = b'Content-Type: text/plain\r\n\r\n'
+    canonical = text_header + content.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+    signature = pkcs7.PKCS7SignatureBuilder().set_data(
+        canonical
+    ).add_signer(
+        signer_cert, signer_key, hashes.SHA256()
+    ).sign(
+        serialization.Encoding.DER,
+        [pkcs7.PKCS7Options.DetachedSignature, pkcs7.PKCS7Options.Binary]
+    )
+    signature = _pem_encode(signature, 'PKCS7').decode('ascii').splitlines()[1:-1]
+    boundary = '----' + os.urandom(16).hex().upper()
+    return b''.join([
+        ('MIME-Version: 1.0\n'
+         'Content-Type: multipart/signed; protocol="application/x-pkcs7-signature"; '
+         'micalg="sha-256"; boundary="%s"\n\n'
+         'This is an S/MIME signed message\n\n'
+         '--%s\n' % (boundary, boundary)).encode('ascii'),
+        canonical,
+        ('\n--%s\n'
+         'Content-Type: application/x-pkcs7-signature; name="smime.p7s"\n'
+         'Content-Transfer-Encoding: base64\n'
+         'Content-Disposition: attachment; filename="smime.p7s"\n\n'
+         '%s\n\n'
+         '--%s--\n\n' % (boundary, '\n'.join(signature), boundary)).encode('ascii'),
+    ])
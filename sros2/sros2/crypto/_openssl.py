@@ -0,0 +1,219 @@
+# Copyright 2016-2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import threading
+
+from sros2._profiling import count
+
+TOOLCHAIN_CACHE_FILE_NAME = 'openssl_toolchain.json'
+
+OpenSSLToolchain = namedtuple('OpenSSLToolchain', ('executable', 'version'))
+# Metadata of a certificate: the serial as upper case hex, the subject as an RFC 2253 string,
+# the lower case hex SHA-256 fingerprint and the validity window as UTC ISO 8601 strings
+CertInfo = namedtuple(
+    'CertInfo', ('serial', 'subject', 'fingerprint', 'not_before', 'not_after'))
+
+CERT_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+_toolchain = None
+_toolchain_cache_dirs = set()
+_toolchain_lock = threading.Lock()
+
+
+def find_openssl_executable():
+    if platform.system() != 'Darwin':
+        return 'openssl'
+
+    brew_openssl_prefix_result = subprocess.run(
+        ['brew', '--prefix', 'openssl'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if brew_openssl_prefix_result.returncode:
+        raise RuntimeError('unable to find openssl from brew')
+    basepath = brew_openssl_prefix_result.stdout.decode().rstrip()
+    return os.path.join(basepath, 'bin', 'openssl')
+
+
+def check_openssl_version(openssl_executable):
+    openssl_version_string_result = subprocess.run(
+        [openssl_executable, 'version'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if openssl_version_string_result.returncode:
+        raise RuntimeError('unable to invoke command: "%s"' % openssl_executable)
+    version = openssl_version_string_result.stdout.decode().rstrip()
+    openssl_version_string_list = version.split(' ')
+    if openssl_version_string_list[0].lower() != 'openssl':
+        raise RuntimeError(
+            "expected version of the format 'OpenSSL "
+            "<MAJOR>.<MINOR>.<PATCH_number><PATCH_letter>  <DATE>'")
+    (major, minor, patch) = openssl_version_string_list[1].split('.')
+    major = int(major)
+    minor = int(minor)
+    if major < 1:
+        raise RuntimeError('need openssl 1.0.2 minimum')
+    if major == 1 and minor < 0:
+        raise RuntimeError('need openssl 1.0.2 minimum')
+    if major == 1 and minor == 0 and int(''.join(itertools.takewhile(str.isdigit, patch))) < 2:
+        raise RuntimeError('need openssl 1.0.2 minimum')
+    return version
+
+
+def _resolve_executable(executable):
+    return os.path.realpath(shutil.which(executable) or executable)
+
+
+def _read_toolchain_cache(cache_dir):
+    cache_path = os.path.join(cache_dir, TOOLCHAIN_CACHE_FILE_NAME)
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+        executable = cache['executable']
+        if os.stat(executable).st_mtime != cache['mtime']:
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    # locating openssl only requires a fork on macOS
+    if platform.system() != 'Darwin' and _resolve_executable('openssl') != executable:
+        return None
+    return OpenSSLToolchain(executable=executable, version=cache['version'])
+
+
+def _write_toolchain_cache(cache_dir, toolchain):
+    cache_path = os.path.join(cache_dir, TOOLCHAIN_CACHE_FILE_NAME)
+    tmp_cache_path = '%s.%d.tmp' % (cache_path, os.getpid())
+    try:
+        with open(tmp_cache_path, 'w') as f:
+            json.dump({
+                'executable': toolchain.executable,
+                'mtime': os.stat(toolchain.executable).st_mtime,
+                'version': toolchain.version,
+            }, f, indent=2)
+        os.replace(tmp_cache_path, cache_path)
+    except OSError:
+        # the cache is an optimization, failing to write it is not an error
+        pass
+
+
+def get_openssl_toolchain(cache_dir=None):
+    """
+    Get the openssl executable, located and version checked once per process.
+
+    If a cache directory (usually the keystore) is given, the result of the discovery is
+    also stored there, keyed by the path and modification time of the executable, so that
+    later invocations of the command line tools can skip probing openssl altogether.
+    """
+    global _toolchain
+    with _toolchain_lock:
+        if cache_dir is not None:
+            cache_dir = os.path.abspath(cache_dir)
+        if _toolchain is None and cache_dir is not None:
+            _toolchain = _read_toolchain_cache(cache_dir)
+            if _toolchain is not None:
+                _toolchain_cache_dirs.add(cache_dir)
+        if _toolchain is None:
+            executable = _resolve_executable(find_openssl_executable())
+            version = check_openssl_version(executable)
+            _toolchain = OpenSSLToolchain(executable=executable, version=version)
+        if cache_dir is not None and cache_dir not in _toolchain_cache_dirs:
+            if _read_toolchain_cache(cache_dir) != _toolchain:
+                _write_toolchain_cache(cache_dir, _toolchain)
+            _toolchain_cache_dirs.add(cache_dir)
+        return _toolchain
+
+
+def run_shell_command(cmd, in_path=None):
+    print('running command in path [%s]: %s' % (in_path, cmd))
+    count('openssl_commands')
+    subprocess.call(cmd, shell=True, cwd=in_path)
+
+
+def _format_cert_date(openssl_date):
+    return datetime.datetime.strptime(
+        openssl_date, '%b %d %H:%M:%S %Y GMT').strftime(CERT_DATE_FORMAT)
+
+
+class OpenSSLBackend:
+    """Crypto backend shelling out to the openssl command line tool."""
+
+    NAME = 'openssl'
+
+    def create_ecdsa_param_file(self, path):
+        openssl_executable = get_openssl_toolchain().executable
+        run_shell_command('%s ecparam -name prime256v1 > %s' % (openssl_executable, path))
+
+    def create_ca_key_cert(self, ecdsa_param_path, ca_conf_path, ca_key_path, ca_cert_path):
+        openssl_executable = get_openssl_toolchain(os.path.dirname(ca_conf_path)).executable
+        run_shell_command(
+            '%s req -nodes -x509 -days 3650 -newkey ec:%s -keyout %s -out %s -config %s' %
+            (openssl_executable, ecdsa_param_path, ca_key_path, ca_cert_path, ca_conf_path))
+
+    def create_key_and_cert_req(
+            self, root, relative_path, cnf_path, ecdsa_param_path, key_path, req_path):
+        ecdsa_param_relpath = os.path.relpath(ecdsa_param_path, root)
+        cnf_relpath = os.path.join(relative_path, 'request.cnf')
+        key_relpath = os.path.join(relative_path, 'key.pem')
+        req_relpath = os.path.join(relative_path, 'req.pem')
+        openssl_executable = get_openssl_toolchain(root).executable
+        run_shell_command(
+            '%s req -nodes -new -newkey ec:%s -config %s -keyout %s -out %s' %
+            (openssl_executable, ecdsa_param_relpath, cnf_relpath, key_relpath, req_relpath),
+            root)
+
+    def create_cert(self, root_path, relative_path):
+        req_relpath = os.path.join(relative_path, 'req.pem')
+        cert_relpath = os.path.join(relative_path, 'cert.pem')
+        openssl_executable = get_openssl_toolchain(root_path).executable
+        run_shell_command(
+            '%s ca -batch -create_serial -config ca_conf.cnf -days 3650 -in %s -out %s' %
+            (openssl_executable, req_relpath, cert_relpath), root_path)
+
+    def create_smime_signed_file(self, in_path, out_path, signer_cert_path, signer_key_path):
+        # the signer is the keystore CA which lives at the root of the keystore
+        openssl_executable = get_openssl_toolchain(
+            os.path.dirname(signer_cert_path)).executable
+        run_shell_command(
+            '%s smime -sign -in %s -text -out %s -signer %s -inkey %s' %
+            (openssl_executable, in_path, out_path, signer_cert_path, signer_key_path))
+
+    def create_smime_signed_files(self, paths, signer_cert_path, signer_key_path):
+        # openssl 3 has no interactive mode to keep a session open, so sign file by file
+        for in_path, out_path in paths:
+            self.create_smime_signed_file(in_path, out_path, signer_cert_path, signer_key_path)
+
+    def get_cert_info(self, cert_path):
+        openssl_executable = get_openssl_toolchain().executable
+        output = subprocess.check_output([
+            openssl_executable, 'x509', '-in', cert_path, '-noout', '-serial',
+            '-subject', '-nameopt', 'RFC2253', '-fingerprint', '-sha256',
+            '-startdate', '-enddate'], universal_newlines=True)
+        fields = {}
+        for line in output.splitlines():
+            key, _, value = line.partition('=')
+            fields[key.strip().lower()] = value.strip()
+        serial = fields['serial']
+        return CertInfo(
+            serial=('0' + serial) if len(serial) % 2 else serial,
+            subject=fields['subject'],
+            fingerprint=fields['sha256 fingerprint'].replace(':', '').lower(),
+            not_before=_format_cert_date(fields['notbefore']),
+            not_after=_format_cert_date(fields['notafter']))
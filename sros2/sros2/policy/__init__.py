@@ -12,72 +12,479 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import copy
+import hashlib
 import os
+from stat import S_ISREG
+import tempfile
+import threading
+from urllib.parse import unquote, urlparse
 
 from lxml import etree
 
-import pkg_resources
+from sros2._profiling import count, profiled, span
+from sros2.policy import _permissions
+from sros2.policy._cache import PolicyCache
+from sros2.policy._canonical import canonicalize_policy
+from sros2.policy._compact import compact_policy, GrantSize  # noqa: F401
+from sros2.policy._index import PolicyIndex  # noqa: F401
+from sros2.policy._permissions import compile_permissions
 
 POLICY_VERSION = '0.1.0'
+PERMISSIONS_ENGINE_ENV = 'SROS2_PERMISSIONS_ENGINE'
+POLICY_CACHE_ENV = 'SROS2_POLICY_CACHE'
+
+_XINCLUDE_INCLUDE = '{http://www.w3.org/2001/XInclude}include'
+
+# defaults, schemas and templates are installed as plain files next to this module, looking
+# them up there avoids the cost of importing pkg_resources on every invocation
+_POLICY_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+class _CompiledCache(threading.local):
+    """Per-thread cache of compiled stylesheets and schemas, lxml ones are not thread-safe."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.entries = {}
+
+
+_compiled_cache = _CompiledCache()
+
+
+class _IncludeResolver(etree.Resolver):
+    """
+    Serve the documents included by policies from memory.
+
+    The contents of included files are kept for the whole process keyed by absolute path and
+    modification time, so that fragments shared by many policies or profiles are read once.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.entries = {}
+        # the files resolved by this thread are recorded in a dict, while one is set
+        self.recording = threading.local()
+
+    def _get_entry(self, path):
+        # the (mtime, contents, digest) of a file by absolute path, or None if there is none
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != stat.st_mtime_ns:
+            count('included_files_read')
+            with open(path, 'rb') as f:
+                entry = (stat.st_mtime_ns, f.read(), None)
+            self.entries[path] = entry
+        return entry
+
+    def _get_digest(self, path, entry):
+        if entry is None:
+            return None
+        mtime, data, digest = entry
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest()
+            self.entries[path] = (mtime, data, digest)
+        return digest
+
+    def get_digest(self, path):
+        """Get the digest of the contents of a file, or None if it does not exist."""
+        path = os.path.abspath(path)
+        return self._get_digest(path, self._get_entry(path))
+
+    def resolve(self, url, pubid, context):
+        included_files = getattr(self.recording, 'included_files', None)
+        if url.startswith('file:'):
+            path = unquote(urlparse(url).path)
+        elif '://' in url:
+            if included_files is not None:
+                # an empty digest never matches, remote documents are not cached
+                included_files[url] = ''
+            return None
+        else:
+            path = os.path.abspath(url)
+        entry = self._get_entry(path)
+        if included_files is not None:
+            included_files[path] = self._get_digest(path, entry)
+        if entry is None:
+            return None
+        # the url is kept as base so that nested includes and xml:base are resolved as usual
+        return self.resolve_string(entry[1], context, base_url=url)
+
+
+_include_resolver = _IncludeResolver()
+
+
+@contextlib.contextmanager
+def _record_included_files(included_files):
+    previous = getattr(_include_resolver.recording, 'included_files', None)
+    _include_resolver.recording.included_files = included_files
+    try:
+        yield
+    finally:
+        _include_resolver.recording.included_files = previous
 
 
 def get_policy_default(name):
-    return pkg_resources.resource_filename(
-        package_or_requirement='sros2',
-        resource_name=os.path.join('policy', 'defaults', name))
+    return os.path.join(_POLICY_PATH, 'defaults', name)
 
 
 def get_policy_schema(name):
-    return pkg_resources.resource_filename(
-        package_or_requirement='sros2',
-        resource_name=os.path.join('policy', 'schemas', name))
+    return os.path.join(_POLICY_PATH, 'schemas', name)
 
 
 def get_policy_template(name):
-    return pkg_resources.resource_filename(
-        package_or_requirement='sros2',
-        resource_name=os.path.join('policy', 'templates', name))
+    return os.path.join(_POLICY_PATH, 'templates', name)
 
 
 def get_transport_default(transport, name):
-    return pkg_resources.resource_filename(
-        package_or_requirement='sros2',
-        resource_name=os.path.join('policy', 'defaults', transport, name))
+    return os.path.join(_POLICY_PATH, 'defaults', transport, name)
 
 
 def get_transport_schema(transport, name):
-    return pkg_resources.resource_filename(
-        package_or_requirement='sros2',
-        resource_name=os.path.join('policy', 'schemas', transport, name))
+    return os.path.join(_POLICY_PATH, 'schemas', transport, name)
 
 
 def get_transport_template(transport, name):
-    return pkg_resources.resource_filename(
-        package_or_requirement='sros2',
-        resource_name=os.path.join('policy', 'templates', transport, name))
+    return os.path.join(_POLICY_PATH, 'templates', transport, name)
+
+
+def _get_compiled_entries():
+    # a forked child does not share the libxml2 state of its parent, start afresh
+    if _compiled_cache.pid != os.getpid():
+        _compiled_cache.pid = os.getpid()
+        _compiled_cache.entries = {}
+    return _compiled_cache.entries
+
+
+def _get_compiled(path, compile_document):
+    entries = _get_compiled_entries()
+    mtime = os.stat(path).st_mtime_ns
+    key = (compile_document, path)
+    entry = entries.get(key)
+    if entry is None or entry[0] != mtime:
+        entry = (mtime, compile_document(etree.parse(path)))
+        entries[key] = entry
+    return entry[1]
+
+
+def _get_policy_parser():
+    """Get the parser of this thread for policies, resolving XIncludes from the cache."""
+    entries = _get_compiled_entries()
+    parser = entries.get('policy_parser')
+    if parser is None:
+        parser = etree.XMLParser()
+        parser.resolvers.add(_include_resolver)
+        entries['policy_parser'] = parser
+    return parser
+
+
+def get_compiled_policy_schema(name):
+    return _get_compiled(get_policy_schema(name), etree.XMLSchema)
+
+
+def get_compiled_transport_schema(transport, name):
+    return _get_compiled(get_transport_schema(transport, name), etree.XMLSchema)
+
+
+def get_compiled_transport_template(transport, name):
+    return _get_compiled(get_transport_template(transport, name), etree.XSLT)
+
+
+def get_policy_cache():
+    """
+    Get the cache of resolved and validated policies, or None if it is disabled.
+
+    The cache is disabled unless the SROS2_POLICY_CACHE environment variable is set to the
+    directory to store it in, e.g. ~/.cache/sros2/policies. Cached policies are not validated
+    again, so only trusted users must be able to write to that directory.
+    """
+    cache_dir = os.getenv(POLICY_CACHE_ENV)
+    if not cache_dir:
+        return None
+    # XInclude and validation are only skipped for entries made with the same schema and
+    # libxml2 version
+    version = '%s-%s' % (
+        _include_resolver.get_digest(get_policy_schema('policy.xsd')),
+        '.'.join(str(n) for n in etree.LIBXML_VERSION))
+    return PolicyCache(cache_dir, version, _include_resolver.get_digest)
+
+
+def _transform_permissions_with_xslt(policy, domain_id):
+    permissions_xsl = get_compiled_transport_template('dds', 'permissions.xsl')
+    permissions = permissions_xsl(policy)
+    domain_id_elements = permissions.findall('permissions/grant/*/domains/id')
+    for domain_id_element in domain_id_elements:
+        domain_id_element.text = domain_id
+    return permissions
+
+
+_permissions_engines = {
+    'python': compile_permissions,
+    'xslt': _transform_permissions_with_xslt,
+}
+
+
+def get_permissions_engine_names():
+    return list(_permissions_engines.keys())
 
 
+def get_permissions_engine_name(engine=None):
+    """Get the name of the permissions engine to use, by default the one set in the env."""
+    if engine is None:
+        engine = os.getenv(PERMISSIONS_ENGINE_ENV) or 'python'
+    if engine not in _permissions_engines:
+        raise RuntimeError(
+            "unknown permissions engine '%s', expected one of: %s" %
+            (engine, ', '.join(get_permissions_engine_names())))
+    return engine
+
+
+def get_permissions_engine_files(engine=None):
+    """Get the paths of the files which define how a permissions engine transforms policies."""
+    engine = get_permissions_engine_name(engine)
+    if engine == 'xslt':
+        return [get_transport_template('dds', 'permissions.xsl')]
+    return [os.path.abspath(_permissions.__file__)]
+
+
+@profiled('transform_permissions')
+def transform_permissions(policy, domain_id='0', engine=None):
+    """
+    Transform a policy into DDS permissions.
+
+    The native 'python' engine is used unless another one is given or set in the
+    SROS2_PERMISSIONS_ENGINE environment variable; 'xslt' runs the permissions.xsl reference
+    template instead. Both produce the same documents.
+    """
+    transform = _permissions_engines[get_permissions_engine_name(engine)]
+    return transform(policy, domain_id)
+
+
+def _open_cached_policy(cache, policy_file_path):
+    # get the entry path of a policy and the entry itself, if it can be used
+    if cache is None:
+        return None, None
+    entry_path = cache.get_entry_path(policy_file_path)
+    cached = cache.open(entry_path)
+    if cached is not None:
+        count('cached_policies')
+    return entry_path, cached
+
+
+@profiled('load_policy')
 def load_policy(policy_file_path):
+    """
+    Load a policy file, with its XIncludes resolved, and validate it.
+
+    Resolved and validated policies are cached, see get_policy_cache, and loading a policy
+    which is in the cache only takes parsing the resolved document.
+    """
     if not os.path.isfile(policy_file_path):
         raise FileNotFoundError("policy file '%s' does not exist" % policy_file_path)
-    policy = etree.parse(policy_file_path)
-    policy.xinclude()
+    cache = get_policy_cache()
+    entry_path, cached = _open_cached_policy(cache, policy_file_path)
+    if cached is not None:
+        with cached, span('parse_policy'):
+            return etree.parse(cached, _get_policy_parser(), base_url=policy_file_path)
+    included_files = {}
+    with span('parse_policy'), _record_included_files(included_files):
+        # the policy itself is not kept in the include cache, only what it includes
+        with open(policy_file_path, 'rb') as f:
+            policy = etree.parse(f, _get_policy_parser(), base_url=policy_file_path)
+        policy.xinclude()
     try:
-        policy_xsd_path = get_policy_schema('policy.xsd')
-        policy_xsd = etree.XMLSchema(etree.parse(policy_xsd_path))
-        policy_xsd.assertValid(policy)
+        with span('validate_policy'):
+            policy_xsd = get_compiled_policy_schema('policy.xsd')
+            policy_xsd.assertValid(policy)
     except etree.DocumentInvalid as e:
         raise RuntimeError(str(e))
+    if cache is not None:
+        cache.write(entry_path, included_files, [etree.tostring(policy)])
     return policy
 
 
+def _include_profiles(root, element, policy_file_path, included_files):
+    # resolve a child of <profiles> as a policy of its own, with the same base
+    policy = _get_policy_parser().makeelement(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+    profiles = etree.SubElement(policy, 'profiles')
+    profiles.append(copy.deepcopy(element))
+    policy = etree.ElementTree(policy)
+    policy.docinfo.URL = policy_file_path
+    with span('parse_policy'), _record_included_files(included_files):
+        policy.xinclude()
+    return policy, profiles
+
+
+def _resolve_profiles(root, element, policy_file_path, policy_xsd, included_files):
+    policy, profiles = _include_profiles(root, element, policy_file_path, included_files)
+    try:
+        with span('validate_policy'):
+            policy_xsd.assertValid(policy)
+    except etree.DocumentInvalid as e:
+        raise RuntimeError(str(e))
+    # included nodes must not be moved to another document, libxml2 may crash when freeing
+    # them, so the profiles are copied out
+    return [copy.deepcopy(profile) for profile in profiles.iterchildren('profile')]
+
+
+def _include_top_level(root, element, policy_file_path, included_files):
+    # resolve an XInclude of the policy root, e.g. of its whole <profiles>, with the same base
+    policy = _get_policy_parser().makeelement(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+    policy.append(copy.deepcopy(element))
+    policy = etree.ElementTree(policy)
+    policy.docinfo.URL = policy_file_path
+    with span('parse_policy'), _record_included_files(included_files):
+        policy.xinclude()
+    for included in policy.getroot():
+        if included.tag != 'profiles':
+            raise RuntimeError("unexpected element '%s' in policy" % included.tag)
+        yield from included
+
+
+def _iterparse_profiles(policy_file_path, source=None, included_files=None):
+    # yield the root and each child of <profiles> once parsed, freeing them afterwards, then
+    # the root and None at the end of the document; the <profiles> the root includes are
+    # resolved and their children yielded in turn
+    if not os.path.isfile(policy_file_path):
+        raise FileNotFoundError("policy file '%s' does not exist" % policy_file_path)
+    root = None
+    depth = 0
+    for event, element in etree.iterparse(
+            policy_file_path if source is None else source, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if root is None:
+                root = element
+            continue
+        depth -= 1
+        if depth == 2 and element.getparent().tag == 'profiles':
+            yield root, element
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        elif depth == 1 and element.tag == _XINCLUDE_INCLUDE:
+            for child in _include_top_level(root, element, policy_file_path, included_files):
+                yield root, child
+            element.clear(keep_tail=True)
+        elif depth == 1 and element.tag != 'profiles':
+            raise RuntimeError("unexpected element '%s' in policy" % element.tag)
+    yield root, None
+
+
+def _get_standalone_policy_element(profile):
+    profiles_element = etree.Element('profiles')
+    profiles_element.append(profile)
+    policy_element = etree.Element('policy')
+    policy_element.append(profiles_element)
+    return policy_element
+
+
+def _split_policy_document(root):
+    # get the start of a policy document, up to its <profiles>, and the end
+    policy = etree.Element(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+    etree.SubElement(policy, 'profiles').text = ''
+    start, end, tail = etree.tostring(policy).rpartition(b'</profiles>')
+    return start, end + tail
+
+
+def iter_policy(policy_file_path):
+    """
+    Stream the profiles of a policy file, validating them one at a time.
+
+    Each profile is yielded in document order, with its XIncludes resolved, as a standalone
+    policy like the ones of PolicyIndex.get_policy_element. Profiles are freed as soon as
+    they have been yielded, so that memory is bounded by the largest profile rather than by
+    the size of the file. Policies are cached like with load_policy once fully streamed.
+    """
+    cache = get_policy_cache() if os.path.isfile(policy_file_path) else None
+    entry_path, cached = _open_cached_policy(cache, policy_file_path)
+    if cached is not None:
+        with cached:
+            for _, element in _iterparse_profiles(policy_file_path, cached):
+                if element is not None:
+                    yield _get_standalone_policy_element(copy.deepcopy(element))
+        return
+
+    policy_xsd = get_compiled_policy_schema('policy.xsd')
+    has_profiles = False
+    included_files = {}
+    # the resolved profiles are kept aside to write the cache entry once all are valid
+    resolved_file = tempfile.TemporaryFile() if cache is not None else None
+    try:
+        for root, element in _iterparse_profiles(
+                policy_file_path, included_files=included_files):
+            if element is None:
+                break
+            for profile in _resolve_profiles(
+                    root, element, policy_file_path, policy_xsd, included_files):
+                has_profiles = True
+                if resolved_file is not None:
+                    resolved_file.write(etree.tostring(profile))
+                yield _get_standalone_policy_element(profile)
+        if not has_profiles:
+            # let the schema report what is missing
+            policy = etree.Element(root.tag, attrib=dict(root.attrib))
+            etree.SubElement(policy, 'profiles')
+            try:
+                policy_xsd.assertValid(policy)
+            except etree.DocumentInvalid as e:
+                raise RuntimeError(str(e))
+        if resolved_file is not None:
+            start, end = _split_policy_document(root)
+            resolved_file.seek(0)
+            cache.write(entry_path, included_files, [start, resolved_file, end])
+    finally:
+        if resolved_file is not None:
+            resolved_file.close()
+
+
+def iter_profile_keys(policy_file_path):
+    """
+    Stream the (ns, node) of the profiles of a policy file, in document order.
+
+    Only the XIncludes of <profiles> are resolved and nothing is validated, which makes this
+    much cheaper than iter_policy to find out which identities a policy file provisions.
+    """
+    cache = get_policy_cache() if os.path.isfile(policy_file_path) else None
+    _, cached = _open_cached_policy(cache, policy_file_path)
+    try:
+        for root, element in _iterparse_profiles(policy_file_path, cached):
+            if element is None:
+                break
+            if element.tag == 'profile':
+                yield element.get('ns'), element.get('node')
+                continue
+            _, profiles = _include_profiles(root, element, policy_file_path, None)
+            for profile in profiles.iterchildren('profile'):
+                yield profile.get('ns'), profile.get('node')
+    finally:
+        if cached is not None:
+            cached.close()
+
+
+def get_included_files(policy_file_path):
+    """
+    Get the absolute paths of the files a policy file includes, directly or not.
+
+    Included files which do not exist, e.g. when an XInclude falls back, are left out.
+    """
+    included_files = {}
+    for root, element in _iterparse_profiles(policy_file_path, included_files=included_files):
+        if element is not None:
+            _include_profiles(root, element, policy_file_path, included_files)
+    return sorted(path for path, digest in included_files.items() if digest)
+
+
 def dump_policy(policy, stream):
-    policy_xsl_path = get_policy_template('policy.xsl')
-    policy_xsl = etree.XSLT(etree.parse(policy_xsl_path))
-    policy = policy_xsl(policy)
+    policy = canonicalize_policy(policy)
     try:
-        policy_xsd_path = get_policy_schema('policy.xsd')
-        policy_xsd = etree.XMLSchema(etree.parse(policy_xsd_path))
+        policy_xsd = get_compiled_policy_schema('policy.xsd')
         policy_xsd.assertValid(policy)
     except etree.DocumentInvalid as e:
         raise RuntimeError(str(e))
@@ -0,0 +1,142 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+POLICY_CACHE_VERSION = 2
+# entries of policies which were not loaded for this long are removed
+POLICY_CACHE_MAX_AGE = 30 * 24 * 3600
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PolicyCache:
+    """
+    On-disk cache of resolved and validated policies.
+
+    An entry holds a policy with its XIncludes resolved, which is loaded with a single parse
+    and without validation. Entries are looked up by the path and content of the policy file
+    and a version, of the schema and libxml2, and are only used while the files the policy
+    included are unchanged.
+    Each policy file has a single entry, replaced whenever the policy is validated anew, and
+    entries start with a digest of their contents, so that corrupted ones are not used.
+    """
+
+    def __init__(self, cache_dir, version, get_digest):
+        self.cache_dir = cache_dir
+        self.version = version
+        # digest of a file, or None if it does not exist
+        self.get_digest = get_digest
+
+    def get_entry_path(self, policy_file_path):
+        policy_file_path = os.path.abspath(policy_file_path)
+        key = json.dumps([
+            POLICY_CACHE_VERSION, self.version, policy_file_path,
+            hash_file(policy_file_path)])
+        return os.path.join(
+            self.cache_dir, hashlib.sha256(policy_file_path.encode()).hexdigest(),
+            hashlib.sha256(key.encode()).hexdigest() + '.xml')
+
+    def open(self, entry_path):
+        """Open an entry positioned at the start of its policy, or return None."""
+        try:
+            f = open(entry_path, 'rb')
+        except OSError:
+            return None
+        try:
+            # the digest covers the included files and the policy which follow it
+            entry_digest = f.readline().strip().decode()
+            start = f.tell()
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+            if digest.hexdigest() == entry_digest:
+                f.seek(start)
+                included_files = json.loads(f.readline().decode())
+                if all(
+                    self.get_digest(path) == file_digest
+                    for path, file_digest in included_files
+                ):
+                    # entries in use are kept from being pruned
+                    os.utime(entry_path)
+                    return f
+        except (OSError, ValueError, TypeError):
+            pass
+        f.close()
+        return None
+
+    def write(self, entry_path, included_files, chunks):
+        """
+        Write an entry from the chunks of its policy document.
+
+        :param included_files: the digest of each file included by the policy, by path;
+          a digest of None stands for a missing file
+        """
+        tmp_path = '%s.%d.%d.tmp' % (entry_path, os.getpid(), threading.get_ident())
+        try:
+            entry_dir = os.path.dirname(entry_path)
+            os.makedirs(entry_dir, mode=0o700, exist_ok=True)
+            digest = hashlib.sha256()
+            with open(tmp_path, 'wb') as f:
+                # the digest is only known once the rest is written
+                f.write(b'0' * digest.digest_size * 2 + b'\n')
+                header = json.dumps(sorted(included_files.items())).encode() + b'\n'
+                for chunk in [header] + list(chunks):
+                    if isinstance(chunk, bytes):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        continue
+                    for data in iter(lambda: chunk.read(1 << 20), b''):
+                        digest.update(data)
+                        f.write(data)
+                f.seek(0)
+                f.write(digest.hexdigest().encode())
+            os.replace(tmp_path, entry_path)
+            # entries of previous versions of the policy are not needed anymore
+            for name in os.listdir(entry_dir):
+                if name.endswith('.xml') and name != os.path.basename(entry_path):
+                    os.remove(os.path.join(entry_dir, name))
+            self._prune()
+        except OSError:
+            # the cache is an optimization, policies are loaded all the same without it
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _prune(self):
+        # remove the entries of policies which were not loaded for a while, e.g. deleted ones
+        oldest = time.time() - POLICY_CACHE_MAX_AGE
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            try:
+                entry_names = os.listdir(entry_dir)
+                if all(
+                    os.stat(os.path.join(entry_dir, entry_name)).st_mtime < oldest
+                    for entry_name in entry_names
+                ):
+                    shutil.rmtree(entry_dir)
+            except OSError:
+                pass
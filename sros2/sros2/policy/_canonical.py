@@ -0,0 +1,77 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+from lxml import etree
+
+_EXPRESSION_TAGS = ('topic', 'service', 'action')
+
+
+def _get_text(element):
+    # whitespace only text is formatting, not content
+    if element.text is not None and element.text.strip():
+        return element.text
+    return ''
+
+
+def _get_sort_key(node):
+    if not isinstance(node.tag, str):
+        # comments and processing instructions have no name and come first
+        return ('', _get_text(node), '', ())
+    return (
+        node.tag,
+        _get_text(node),
+        node.get('ns', '') + node.get('node', ''),
+        tuple(sorted(node.attrib.items())),
+    )
+
+
+def _canonicalize_element(element):
+    attributes = sorted(element.attrib.items())
+    element.attrib.clear()
+    for name, value in attributes:
+        element.set(name, value)
+    if not _get_text(element):
+        element.text = None
+    element.tail = None
+
+    children = list(element)
+    if not children:
+        return
+    seen = {tag: set() for tag in _EXPRESSION_TAGS}
+    for child in children:
+        element.remove(child)
+    for child in sorted(children, key=_get_sort_key):
+        if child.tag in seen:
+            if child.text in seen[child.tag]:
+                continue
+            seen[child.tag].add(child.text)
+        _canonicalize_element(child)
+        element.append(child)
+
+
+def canonicalize_policy(policy):
+    """
+    Get a copy of a policy in canonical form.
+
+    Attributes and elements are sorted alphabetically, elements by tag, text, namespace and
+    node and then attributes, and duplicate expressions are pruned, so that policies holding
+    the same rules are serialized to the same bytes.
+    """
+    if isinstance(policy, etree._ElementTree):
+        policy = policy.getroot()
+    policy = copy.deepcopy(policy)
+    _canonicalize_element(policy)
+    return etree.ElementTree(policy)
@@ -0,0 +1,134 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import namedtuple
+from collections import OrderedDict
+import copy
+import fnmatch
+
+from lxml import etree
+
+from sros2.policy._permissions import _get_fqn, compile_permissions
+
+GrantSize = namedtuple(
+    'GrantSize', ('name', 'topics_before', 'topics_after', 'bytes_before', 'bytes_after'))
+
+_XML_BASE_ATTRIBUTE = '{http://www.w3.org/XML/1998/namespace}base'
+
+
+def _get_rules(expressions):
+    return tuple(sorted(
+        (name, value) for name, value in expressions.attrib.items()
+        if name != _XML_BASE_ATTRIBUTE))
+
+
+def _set_expressions(expressions, names):
+    tag = expressions.tag[:-1]
+    for expression in list(expressions):
+        expressions.remove(expression)
+    expressions.text = None
+    for name in names:
+        etree.SubElement(expressions, tag).text = name
+
+
+def _get_names(expressions):
+    return [expression.text for expression in expressions.iterchildren(tag=etree.Element)]
+
+
+def _merge_lists_with_same_rules(profile):
+    lists = OrderedDict()
+    for expressions in list(profile.iterchildren(tag=etree.Element)):
+        key = (expressions.tag, _get_rules(expressions))
+        if key in lists:
+            profile.remove(expressions)
+        else:
+            lists[key] = (expressions, OrderedDict())
+        lists[key][1].update((name, None) for name in _get_names(expressions))
+    for expressions, names in lists.values():
+        if list(names) != _get_names(expressions):
+            expressions.attrib.pop(_XML_BASE_ATTRIBUTE, None)
+            _set_expressions(expressions, names)
+
+
+def _fold_wildcards(profile, allowed_wildcards, min_expressions):
+    ns = profile.get('ns')
+    node = profile.get('node')
+    for expressions in profile.iterchildren(tag=etree.Element):
+        # folding widens access, so it is only done for lists which allow everything they hold
+        rules = _get_rules(expressions)
+        if not rules or any(qualifier != 'ALLOW' for _, qualifier in rules):
+            continue
+        names = _get_names(expressions)
+        for wildcard in allowed_wildcards:
+            matching = [
+                name for name in names if fnmatch.fnmatchcase(_get_fqn(name, ns, node), wildcard)
+            ]
+            if len(matching) < min_expressions:
+                continue
+            index = names.index(matching[0])
+            names = [name for name in names if name not in matching]
+            names.insert(index, wildcard)
+        if names != _get_names(expressions):
+            expressions.attrib.pop(_XML_BASE_ATTRIBUTE, None)
+            _set_expressions(expressions, names)
+
+
+def _merge_lists_with_same_expressions(profile):
+    lists = OrderedDict()
+    for expressions in list(profile.iterchildren(tag=etree.Element)):
+        key = (expressions.tag, tuple(sorted(_get_names(expressions))))
+        merged = lists.get(key)
+        if merged is not None and not set(expressions.attrib) & set(merged.attrib) - {
+                _XML_BASE_ATTRIBUTE}:
+            for name, value in _get_rules(expressions):
+                merged.set(name, value)
+            merged.attrib.pop(_XML_BASE_ATTRIBUTE, None)
+            profile.remove(expressions)
+        else:
+            lists.setdefault(key, expressions)
+
+
+def _get_grant_sizes(permissions):
+    return OrderedDict(
+        (grant.get('name'), (len(grant.findall('.//topic')), len(etree.tostring(grant))))
+        for grant in permissions.getroot().iterfind('permissions/grant'))
+
+
+def compact_policy(policy, allowed_wildcards=(), min_expressions=2):
+    """
+    Get a compacted copy of a policy, with a report of the size of each grant.
+
+    In each profile, expression lists with the same rules are merged, expressions of lists
+    only holding ALLOW rules are folded into a wildcard of `allowed_wildcards` when at least
+    `min_expressions` of them match it, and lists with the same expressions are merged into
+    a single list with all of their rules. Wildcards are fully qualified patterns such as
+    '/robot/sensors/*', which are never introduced unless explicitly allowed.
+
+    :return: the compacted policy and a list of GrantSize
+    """
+    if isinstance(policy, etree._ElementTree):
+        policy = policy.getroot()
+    compacted = copy.deepcopy(policy)
+    for profile in compacted.iterfind('profiles/profile'):
+        _merge_lists_with_same_rules(profile)
+        _fold_wildcards(profile, allowed_wildcards, min_expressions)
+        _merge_lists_with_same_expressions(profile)
+
+    sizes_before = _get_grant_sizes(compile_permissions(policy))
+    sizes_after = _get_grant_sizes(compile_permissions(compacted))
+    report = [
+        GrantSize(name, topics_before, sizes_after[name][0], bytes_before, sizes_after[name][1])
+        for name, (topics_before, bytes_before) in sizes_before.items()
+    ]
+    return etree.ElementTree(compacted), report
@@ -0,0 +1,162 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+import copy
+
+from lxml import etree
+
+_XML_BASE_ATTRIBUTE = '{http://www.w3.org/XML/1998/namespace}base'
+
+
+class PolicyIndex:
+    """
+    Constant time lookups of profiles and expression lists of a policy.
+
+    Profiles are indexed by (ns, node), and expression lists by (ns, node, permission_type,
+    rule_type, rule_qualifier), e.g. ('/', 'talker', 'topic', 'publish', 'ALLOW'). As with
+    an XPath search, the first matching element in document order is the one indexed.
+    """
+
+    def __init__(self, policy):
+        if isinstance(policy, etree._ElementTree):
+            policy = policy.getroot()
+        self.policy = policy
+        self._profiles = OrderedDict()
+        self._permissions = {}
+        self._expressions = {}
+        profiles = policy.find('profiles')
+        if profiles is None:
+            profiles = etree.SubElement(policy, 'profiles')
+        self._profiles_element = profiles
+        for profile in profiles.iterchildren('profile'):
+            key = (profile.get('ns'), profile.get('node'))
+            if key in self._profiles:
+                continue
+            self._profiles[key] = profile
+            for permissions in profile.iterchildren(tag=etree.Element):
+                self._index_permissions(key, permissions)
+
+    def _index_permissions(self, profile_key, permissions):
+        permission_type = permissions.tag[:-1]
+        for rule_type, rule_qualifier in permissions.attrib.items():
+            self._permissions.setdefault(
+                profile_key + (permission_type, rule_type, rule_qualifier), permissions)
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def keys(self):
+        return self._profiles.keys()
+
+    def profiles(self):
+        return self._profiles.values()
+
+    def get_profile(self, ns, node):
+        return self._profiles.get((ns, node))
+
+    def add_profile(self, ns, node):
+        profile = self.get_profile(ns, node)
+        if profile is None:
+            profile = etree.SubElement(self._profiles_element, 'profile')
+            profile.attrib['ns'] = ns
+            profile.attrib['node'] = node
+            self._profiles[(ns, node)] = profile
+        return profile
+
+    def get_permissions(self, ns, node, permission_type, rule_type, rule_qualifier):
+        return self._permissions.get((ns, node, permission_type, rule_type, rule_qualifier))
+
+    def add_permissions(self, ns, node, permission_type, rule_type, rule_qualifier):
+        permissions = self.get_permissions(
+            ns, node, permission_type, rule_type, rule_qualifier)
+        if permissions is None:
+            profile = self.add_profile(ns, node)
+            permissions = etree.SubElement(profile, permission_type + 's')
+            permissions.attrib[rule_type] = rule_qualifier
+            self._index_permissions((ns, node), permissions)
+        return permissions
+
+    def _get_expressions(self, key):
+        expressions = self._expressions.get(key)
+        if expressions is None:
+            # an expression may be in any of the lists of the profile with the same rule
+            ns, node, permission_type, rule_type, rule_qualifier = key
+            expressions = set()
+            profile = self.get_profile(ns, node)
+            for permissions in profile.iterchildren(permission_type + 's'):
+                if permissions.get(rule_type) == rule_qualifier:
+                    expressions.update(
+                        expression.text
+                        for expression in permissions.iterchildren(permission_type))
+            self._expressions[key] = expressions
+        return expressions
+
+    def add_expressions(
+            self, ns, node, permission_type, rule_type, rule_qualifier, expressions):
+        """
+        Add the expressions a rule of a profile does not have yet.
+
+        Expressions are added once in the order given, so adding the same expressions again
+        leaves the policy untouched.
+        :return: the expressions which were added
+        """
+        permissions = self.add_permissions(ns, node, permission_type, rule_type, rule_qualifier)
+        existing = self._get_expressions((ns, node, permission_type, rule_type, rule_qualifier))
+        added = []
+        for expression in expressions:
+            if expression in existing:
+                continue
+            existing.add(expression)
+            etree.SubElement(permissions, permission_type).text = expression
+            added.append(expression)
+        return added
+
+    def merge_profile(self, profile):
+        """
+        Merge a profile, e.g. of another policy, into the one with the same ns and node.
+
+        The expression lists which grant something the profile does not grant yet are copied
+        to it, so merging the same profile again leaves the policy untouched.
+        :return: the profile merged into
+        """
+        key = (profile.get('ns'), profile.get('node'))
+        merged = self.add_profile(*key)
+        for permissions in profile.iterchildren(tag=etree.Element):
+            permission_type = permissions.tag[:-1]
+            names = {
+                expression.text for expression in permissions.iterchildren(permission_type)}
+            expressions_keys = [
+                key + (permission_type, rule_type, rule_qualifier)
+                for rule_type, rule_qualifier in permissions.attrib.items()
+                if rule_type != _XML_BASE_ATTRIBUTE]
+            if all(names <= self._get_expressions(k) for k in expressions_keys):
+                continue
+            permissions = copy.deepcopy(permissions)
+            merged.append(permissions)
+            self._index_permissions(key, permissions)
+            for expressions_key in expressions_keys:
+                self._get_expressions(expressions_key).update(names)
+        return merged
+
+    def get_policy_element(self, ns, node):
+        """Get a standalone policy holding a copy of a single profile, or None."""
+        profile = self.get_profile(ns, node)
+        if profile is None:
+            return None
+        profiles_element = etree.Element('profiles')
+        profiles_element.append(copy.deepcopy(profile))
+        policy_element = etree.Element('policy')
+        policy_element.append(profiles_element)
+        return policy_element
@@ -0,0 +1,160 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from lxml import etree
+
+# Kept in sync with templates/dds/permissions.xsl, which remains the reference implementation
+_XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+_SCHEMA_LOCATION = \
+    'http://www.omg.org/spec/DDS-SECURITY/20170901/omg_shared_ca_permissions.xsd'
+_NOT_BEFORE = '2013-10-26T00:00:00'
+_NOT_AFTER = '2023-10-26T22:45:30'
+
+_ACTION_REQUESTS = ('cancel_goal', 'get_result', 'send_goal')
+_ACTION_TOPICS = ('feedback', 'status')
+
+
+def _request_topics(fqn):
+    return ['rq' + fqn + 'Request']
+
+
+def _reply_topics(fqn):
+    return ['rr' + fqn + 'Reply']
+
+
+def _action_request_topics(fqn):
+    return ['rq%s/_action/%sRequest' % (fqn, name) for name in _ACTION_REQUESTS]
+
+
+def _action_reply_topics(fqn):
+    return (
+        ['rr%s/_action/%sReply' % (fqn, name) for name in _ACTION_REQUESTS] +
+        ['rt%s/_action/%s' % (fqn, name) for name in _ACTION_TOPICS])
+
+
+def _topic_topics(fqn):
+    return ['rt' + fqn]
+
+
+# For each expression list and rule type: the DDS topics to publish and to subscribe to,
+# in the order the stylesheet's TranslatePermissions template considers the rule types
+_RULES = {
+    'topics': (
+        ('publish', _topic_topics, None),
+        ('subscribe', None, _topic_topics),
+    ),
+    'services': (
+        ('request', _request_topics, _reply_topics),
+        ('reply', _reply_topics, _request_topics),
+    ),
+    'actions': (
+        ('call', _action_request_topics, _action_reply_topics),
+        ('execute', _action_reply_topics, _action_request_topics),
+    ),
+}
+
+
+def _delimit_namespace(ns):
+    return ns if ns.endswith('/') else ns + '/'
+
+
+def _get_string_value(element):
+    # whitespace only text is stripped from the policy by the stylesheet
+    value = ''.join(element.itertext())
+    return value if value.strip() else ''
+
+
+def _get_fqn(name, ns, node):
+    if name.startswith('/'):
+        return name
+    if name.startswith('~'):
+        return _delimit_namespace(ns) + node + '/' + name[1:]
+    return _delimit_namespace(ns) + name
+
+
+def _add_criteria(rule_element, tag, topic_lists):
+    if not topic_lists:
+        return
+    # like the stylesheet, order expression lists by their first topic, keeping the order
+    # of the topics within each list
+    topic_lists.sort(key=lambda topics: topics[0] if topics else '')
+    topics_element = etree.SubElement(etree.SubElement(rule_element, tag), 'topics')
+    for topics in topic_lists:
+        for topic in topics:
+            etree.SubElement(topics_element, 'topic').text = topic
+
+
+def _add_rule(grant_element, tag, domain_id, publish_lists, subscribe_lists):
+    rule_element = etree.SubElement(grant_element, tag)
+    domains_element = etree.SubElement(rule_element, 'domains')
+    etree.SubElement(domains_element, 'id').text = domain_id
+    _add_criteria(rule_element, 'publish', publish_lists)
+    _add_criteria(rule_element, 'subscribe', subscribe_lists)
+
+
+def _add_grant(permissions_element, profile, domain_id):
+    ns = profile.get('ns')
+    node = profile.get('node')
+    common_name = _delimit_namespace(ns) + node
+    grant_element = etree.SubElement(permissions_element, 'grant', name=common_name)
+    etree.SubElement(grant_element, 'subject_name').text = 'CN=' + common_name
+    validity_element = etree.SubElement(grant_element, 'validity')
+    etree.SubElement(validity_element, 'not_before').text = _NOT_BEFORE
+    etree.SubElement(validity_element, 'not_after').text = _NOT_AFTER
+
+    # qualifier -> (publish topic lists, subscribe topic lists)
+    rules = {'DENY': ([], []), 'ALLOW': ([], [])}
+    for expressions in profile.iterchildren(tag=etree.Element):
+        fqns = [
+            _get_fqn(_get_string_value(expression), ns, node)
+            for expression in expressions.iterchildren(tag=etree.Element)
+        ]
+        for rule_type, publish, subscribe in _RULES.get(expressions.tag, ()):
+            qualifier = expressions.get(rule_type)
+            if qualifier not in rules:
+                continue
+            publish_lists, subscribe_lists = rules[qualifier]
+            if publish is not None:
+                publish_lists.append([topic for fqn in fqns for topic in publish(fqn)])
+            if subscribe is not None:
+                subscribe_lists.append([topic for fqn in fqns for topic in subscribe(fqn)])
+
+    for qualifier, tag in (('DENY', 'deny_rule'), ('ALLOW', 'allow_rule')):
+        if _has_qualifier(profile, qualifier):
+            publish_lists, subscribe_lists = rules[qualifier]
+            _add_rule(grant_element, tag, domain_id, publish_lists, subscribe_lists)
+    etree.SubElement(grant_element, 'default').text = 'DENY'
+
+
+def _has_qualifier(profile, qualifier):
+    return any(
+        qualifier in expressions.attrib.values()
+        for expressions in profile.iterchildren(tag=etree.Element))
+
+
+def compile_permissions(policy, domain_id='0'):
+    """
+    Compile a policy into DDS permissions, as the permissions.xsl template does.
+
+    Every profile is turned into a grant in a single pass over the policy, expanding topic,
+    service and action names into their DDS topics along the way.
+    """
+    if isinstance(policy, etree._ElementTree):
+        policy = policy.getroot()
+    dds_element = etree.Element('dds', nsmap={'xsi': _XSI_NAMESPACE})
+    dds_element.set('{%s}noNamespaceSchemaLocation' % _XSI_NAMESPACE, _SCHEMA_LOCATION)
+    permissions_element = etree.SubElement(dds_element, 'permissions')
+    for profile in policy.iterfind('profiles/profile'):
+        _add_grant(permissions_element, profile, domain_id)
+    return etree.ElementTree(dds_element)
@@ -28,6 +28,9 @@ class VerbExtension:
 
     The following methods can be defined:
     * `add_arguments`
+
+    Every verb module is imported to build the parser of the security command, so modules
+    which are slow to import should only be imported by `main`.
     """
 
     NAME = None
@@ -42,3 +45,14 @@ class VerbExtension:
 
     def main(self, *, args):
         raise NotImplementedError()
+
+
+def add_profiling_arguments(parser):
+    """Add the arguments profiling the stages of a verb, handled by the security command."""
+    parser.add_argument(
+        '--timings', action='store_true',
+        help='print the time spent in each stage to stderr')
+    parser.add_argument(
+        '--profile-out', metavar='PATH',
+        help='write the time spent in each stage to a file, as JSON if its name ends with '
+             '.json and as folded stacks for flamegraph.pl otherwise')
@@ -0,0 +1,80 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+try:
+    from argcomplete.completers import FilesCompleter
+except ImportError:
+    def FilesCompleter(*, allowednames, directories):
+        return None
+
+from sros2.verb import add_profiling_arguments, VerbExtension
+
+
+class CompactPolicyVerb(VerbExtension):
+    """Compact the expressions of a policy, folding them into allowed wildcards."""
+
+    def add_arguments(self, parser, cli_name):
+        arg = parser.add_argument(
+            'POLICY_FILE_PATH', help='path of the policy xml file')
+        arg.completer = FilesCompleter(
+            allowednames=('xml'), directories=False)
+        parser.add_argument(
+            '-w', '--wildcards', nargs='*', default=[], metavar='PATTERN',
+            help="fully qualified wildcards expressions may be folded into, e.g. '/robot/*'")
+        arg = parser.add_argument(
+            '--wildcards-file', metavar='PATH',
+            help='file listing allowed wildcards, one per line')
+        arg.completer = FilesCompleter(allowednames=(), directories=False)
+        parser.add_argument(
+            '--min-expressions', type=int, default=2,
+            help='number of expressions a wildcard must replace to be used (default: 2)')
+        parser.add_argument(
+            '-o', '--output', metavar='PATH',
+            help='path to write the compacted policy to (default: overwrite the policy file)')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='only report the size of the grants, without writing the policy')
+        add_profiling_arguments(parser)
+
+    def main(self, *, args):
+        from sros2.policy import compact_policy, dump_policy, load_policy
+
+        wildcards = list(args.wildcards)
+        try:
+            if args.wildcards_file is not None:
+                with open(args.wildcards_file) as f:
+                    wildcards.extend(
+                        line.strip() for line in f
+                        if line.strip() and not line.startswith('#'))
+            policy = load_policy(args.POLICY_FILE_PATH)
+        except FileNotFoundError as e:
+            raise RuntimeError(str(e))
+        if any(not wildcard.startswith('/') for wildcard in wildcards):
+            raise RuntimeError('wildcards must be fully qualified')
+
+        compacted, report = compact_policy(policy, wildcards, args.min_expressions)
+        for grant_size in report:
+            if grant_size.topics_before != grant_size.topics_after:
+                print('%s: %d -> %d topics, %d -> %d bytes' % grant_size)
+        print('total: %d -> %d topics, %d -> %d bytes in %d grants' % (
+            sum(grant_size.topics_before for grant_size in report),
+            sum(grant_size.topics_after for grant_size in report),
+            sum(grant_size.bytes_before for grant_size in report),
+            sum(grant_size.bytes_after for grant_size in report),
+            len(report)))
+
+        if not args.dry_run:
+            with open(args.output or args.POLICY_FILE_PATH, 'w') as stream:
+                dump_policy(compacted, stream)
+        return 0
@@ -17,9 +17,14 @@ try:
 except ImportError:
     def DirectoriesCompleter():
         return None
+try:
+    from argcomplete.completers import FilesCompleter
+except ImportError:
+    def FilesCompleter(*, allowednames, directories):
+        return None
 
-from sros2.api import create_key
-from sros2.verb import VerbExtension
+from sros2._constants import LINK_MODES
+from sros2.verb import add_profiling_arguments, VerbExtension
 
 
 class CreateKeyVerb(VerbExtension):
@@ -29,7 +34,24 @@ class CreateKeyVerb(VerbExtension):
         arg = parser.add_argument('ROOT', help='root path of keystore')
         arg.completer = DirectoriesCompleter()
         parser.add_argument('NAME', help='key name, aka ROS node name')
+        arg = parser.add_argument(
+            '-p', '--policy-file',
+            help='path of a policy xml file to create the permissions from instead of the '
+                 'default wildcard policy')
+        arg.completer = FilesCompleter(allowednames=('xml'), directories=False)
+        parser.add_argument(
+            '--link-mode', choices=LINK_MODES, default=None,
+            help='how identities refer to the keystore CA cert and governance: real copies, '
+                 'or hard or symbolic links to a single shared copy (default: copy, or '
+                 'the SROS2_KEYSTORE_LINK_MODE environment variable)')
+        add_profiling_arguments(parser)
 
     def main(self, *, args):
-        success = create_key(args.ROOT, args.NAME)
+        from sros2.api import create_key
+
+        try:
+            success = create_key(
+                args.ROOT, args.NAME, args.link_mode, policy_file_path=args.policy_file)
+        except FileNotFoundError as e:
+            raise RuntimeError(str(e))
         return 0 if success else 1
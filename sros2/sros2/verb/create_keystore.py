@@ -18,8 +18,7 @@ except ImportError:
     def DirectoriesCompleter():
         return None
 
-from sros2.api import create_keystore
-from sros2.verb import VerbExtension
+from sros2.verb import add_profiling_arguments, VerbExtension
 
 
 class CreateKeystoreVerb(VerbExtension):
@@ -28,7 +27,10 @@ class CreateKeystoreVerb(VerbExtension):
     def add_arguments(self, parser, cli_name):
         arg = parser.add_argument('ROOT', help='root path of keystore')
         arg.completer = DirectoriesCompleter()
+        add_profiling_arguments(parser)
 
     def main(self, *, args):
+        from sros2.api import create_keystore
+
         success = create_keystore(args.ROOT)
         return 0 if success else 1
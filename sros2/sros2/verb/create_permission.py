@@ -23,8 +23,7 @@ except ImportError:
     def FilesCompleter(*, allowednames, directories):
         return None
 
-from sros2.api import create_permission
-from sros2.verb import VerbExtension
+from sros2.verb import add_profiling_arguments, VerbExtension
 
 
 class CreatePermissionVerb(VerbExtension):
@@ -38,8 +37,11 @@ class CreatePermissionVerb(VerbExtension):
             'POLICY_FILE_PATH', help='path of the policy xml file')
         arg.completer = FilesCompleter(
             allowednames=('xml'), directories=False)
+        add_profiling_arguments(parser)
 
     def main(self, *, args):
+        from sros2.api import create_permission
+
         try:
             success = create_permission(args.ROOT, args.NAME, args.POLICY_FILE_PATH)
         except FileNotFoundError as e:
@@ -18,8 +18,7 @@ except ImportError:
     def DirectoriesCompleter():
         return None
 
-from sros2.api import distribute_key
-from sros2.verb import VerbExtension
+from sros2.verb import add_profiling_arguments, VerbExtension
 
 
 class DistributeKeyVerb(VerbExtension):
@@ -28,9 +27,15 @@ class DistributeKeyVerb(VerbExtension):
     def add_arguments(self, parser, cli_name):
         arg = parser.add_argument('ROOT', help='root path of keystore')
         arg.completer = DirectoriesCompleter()
-        parser.add_argument('TARGET', help='target keystore path')
+        arg = parser.add_argument('TARGET', help='target keystore path')
         arg.completer = DirectoriesCompleter()
+        parser.add_argument(
+            'NAMES', nargs='*',
+            help='names of the identities to distribute (default: all of the keystore)')
+        add_profiling_arguments(parser)
 
     def main(self, *, args):
-        success = distribute_key(args.ROOT, args.TARGET)
+        from sros2.api import distribute_key
+
+        success = distribute_key(args.ROOT, args.TARGET, args.NAMES or None)
         return 0 if success else 1
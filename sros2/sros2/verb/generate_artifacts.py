@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
 try:
     from argcomplete.completers import DirectoriesCompleter
 except ImportError:
@@ -23,8 +25,8 @@ except ImportError:
     def FilesCompleter(*, allowednames, directories):
         return None
 
-from sros2.api import generate_artifacts
-from sros2.verb import VerbExtension
+from sros2._constants import LINK_MODES
+from sros2.verb import add_profiling_arguments, VerbExtension
 
 
 class GenerateArtifactsVerb(VerbExtension):
@@ -41,11 +43,39 @@ class GenerateArtifactsVerb(VerbExtension):
             help='list of policy xml file paths')
         arg.completer = FilesCompleter(
             allowednames=('xml'), directories=False)
+        arg = parser.add_argument(
+            '-m', '--manifests', nargs='*', default=[],
+            help='list of provisioning manifests, or directories of them, declaring more '
+                 "identities and policy files with lines of 'node <identity>' and "
+                 "'policy <policy xml file path>'")
+        arg.completer = FilesCompleter(
+            allowednames=('txt'), directories=True)
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=1,
+            help='number of identities to provision in parallel (default: 1)')
+        parser.add_argument(
+            '--link-mode', choices=LINK_MODES, default=None,
+            help='how identities refer to the keystore CA cert and governance: real copies, '
+                 'or hard or symbolic links to a single shared copy (default: copy, or '
+                 'the SROS2_KEYSTORE_LINK_MODE environment variable)')
+        add_profiling_arguments(parser)
 
     def main(self, *, args):
+        from sros2.api import generate_artifacts, read_provisioning_manifests
+
         try:
+            node_names = list(args.node_names)
+            policy_files = list(args.policy_files)
+            if args.manifests:
+                # a workspace declares its identities and policy files once in the manifests
+                manifest_node_names, manifest_policy_files = read_provisioning_manifests(
+                    args.manifests)
+                node_names += [n for n in manifest_node_names if n not in node_names]
+                policy_files += [
+                    p for p in manifest_policy_files
+                    if not any(os.path.abspath(f) == p for f in policy_files)]
             success = generate_artifacts(
-                args.keystore_root_path, args.node_names, args.policy_files)
+                args.keystore_root_path, node_names, policy_files, args.jobs, args.link_mode)
         except FileNotFoundError as e:
             raise RuntimeError(str(e))
         return 0 if success else 1
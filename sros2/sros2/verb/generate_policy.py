@@ -12,7 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import os
+import time
 
 try:
     from argcomplete.completers import DirectoriesCompleter
@@ -25,25 +27,15 @@ except ImportError:
     def FilesCompleter(*, allowednames, directories):
         return None
 
-from lxml import etree
+from sros2._profiling import count, span
+from sros2.verb import add_profiling_arguments, VerbExtension
 
-from ros2cli.node.direct import DirectNode
-from ros2cli.node.strategy import NodeStrategy
 
-from sros2.api import (
-    get_node_names,
-    get_publisher_info,
-    get_service_info,
-    get_subscriber_info
-)
-
-from sros2.policy import (
-    dump_policy,
-    load_policy,
-    POLICY_VERSION,
-)
-
-from sros2.verb import VerbExtension
+def _non_negative_float(value):
+    seconds = float(value)
+    if seconds < 0:
+        raise argparse.ArgumentTypeError("'%s' is not a non-negative number of seconds" % value)
+    return seconds
 
 
 def formatTopics(topic_list, permission, topic_map):
@@ -51,6 +43,14 @@ def formatTopics(topic_list, permission, topic_map):
         topic_map[topic.name].append(permission)
 
 
+# Graph information of a node and the rules they are allowed by in the policy
+_GRAPH_RULES = (
+    ('subscribers', 'topic', 'subscribe', 'ALLOW'),
+    ('publishers', 'topic', 'publish', 'ALLOW'),
+    ('services', 'service', 'reply', 'ALLOW'),
+)
+
+
 class GeneratePolicyVerb(VerbExtension):
     """Generate XML policy file from ROS graph data."""
 
@@ -60,8 +60,23 @@ class GeneratePolicyVerb(VerbExtension):
             'POLICY_FILE_PATH', help='path of the policy xml file')
         arg.completer = FilesCompleter(
             allowednames=('xml'), directories=False)
+        parser.add_argument(
+            '--watch', action='store_true',
+            help='keep sampling the graph until interrupted, adding what appears to the '
+                 'policy file as it is found')
+        parser.add_argument(
+            '--duration', type=_non_negative_float, default=None, metavar='SECONDS',
+            help='keep sampling the graph for this long, implies --watch')
+        parser.add_argument(
+            '--interval', type=_non_negative_float, default=1.0, metavar='SECONDS',
+            help='time between two samples of the graph when watching (default: %(default)s)')
+        add_profiling_arguments(parser)
 
     def get_policy(self, policy_file_path):
+        from lxml import etree
+
+        from sros2.policy import load_policy, POLICY_VERSION
+
         if os.path.isfile(policy_file_path):
             return load_policy(policy_file_path)
         else:
@@ -71,67 +86,102 @@ class GeneratePolicyVerb(VerbExtension):
             policy.append(profiles)
             return policy
 
-    def get_profile(self, policy, node_name):
-        profile = policy.find(
-            path='profiles/profile[@ns="{ns}"][@node="{node}"]'.format(
-                ns=node_name.ns,
-                node=node_name.node))
-        if profile is None:
-            profile = etree.Element('profile')
-            profile.attrib['ns'] = node_name.ns
-            profile.attrib['node'] = node_name.node
-            profiles = policy.find('profiles')
-            profiles.append(profile)
-        return profile
-
-    def get_permissions(self, profile, permission_type, rule_type, rule_qualifier):
-        permissions = profile.find(
-            path='{permission_type}s[@{rule_type}="{rule_qualifier}"]'.format(
-                permission_type=permission_type,
-                rule_type=rule_type,
-                rule_qualifier=rule_qualifier))
-        if permissions is None:
-            permissions = etree.Element(permission_type + 's')
-            permissions.attrib[rule_type] = rule_qualifier
-            profile.append(permissions)
-        return permissions
+    def get_profile(self, policy_index, node_name):
+        return policy_index.add_profile(node_name.ns, node_name.node)
+
+    def get_expression(self, expression, node_name):
+        if expression.fqn.startswith(node_name.fqn + '/'):
+            return '~' + expression.fqn[len(node_name.fqn + '/'):]
+        elif expression.fqn.startswith(node_name.ns + '/'):
+            return expression.fqn[len(node_name.ns + '/'):]
+        elif expression.fqn.count('/') == 1 and node_name.ns == '/':
+            return expression.fqn[len('/'):]
+        return expression.fqn
 
     def add_permission(
-            self, profile, permission_type, rule_type, rule_qualifier, expressions, node_name):
-        permissions = self.get_permissions(profile, permission_type, rule_type, rule_qualifier)
-        for expression in expressions:
-            permission = etree.Element(permission_type)
-            if expression.fqn.startswith(node_name.fqn + '/'):
-                permission.text = '~' + expression.fqn[len(node_name.fqn + '/'):]
-            elif expression.fqn.startswith(node_name.ns + '/'):
-                permission.text = expression.fqn[len(node_name.ns + '/'):]
-            elif expression.fqn.count('/') == 1 and node_name.ns == '/':
-                permission.text = expression.fqn[len('/'):]
-            else:
-                permission.text = expression.fqn
-            permissions.append(permission)
+            self, policy_index, permission_type, rule_type, rule_qualifier, expressions,
+            node_name):
+        # expressions already in the profile are skipped, which keeps merges idempotent
+        return policy_index.add_expressions(
+            node_name.ns, node_name.node, permission_type, rule_type, rule_qualifier,
+            [self.get_expression(expression, node_name) for expression in expressions])
+
+    def add_graph(self, policy_index, graph, seen):
+        """
+        Add the expressions of a graph snapshot which were not seen in previous samples.
+
+        `seen` maps each (node name, permission type, rule type, rule qualifier) to the set of
+        names already added, so that a sample only costs what changed in the graph.
+        :return: whether anything was added
+        """
+        changed = False
+        for node_name, node_graph_info in graph.items():
+            if node_name not in seen:
+                seen[node_name] = {}
+                self.get_profile(policy_index, node_name)
+                changed = True
+            node_seen = seen[node_name]
+            for field, permission_type, rule_type, rule_qualifier in _GRAPH_RULES:
+                rule_seen = node_seen.setdefault(
+                    (permission_type, rule_type, rule_qualifier), set())
+                expressions = [
+                    expression for expression in getattr(node_graph_info, field)
+                    if expression.fqn not in rule_seen
+                ]
+                if expressions:
+                    rule_seen.update(expression.fqn for expression in expressions)
+                    self.add_permission(
+                        policy_index, permission_type, rule_type, rule_qualifier,
+                        expressions, node_name)
+                    changed = True
+        return changed
+
+    def write_policy(self, policy, policy_file_path):
+        from sros2.policy import dump_policy
+
+        # write atomically so that interrupting a watch never leaves a truncated policy
+        tmp_path = '%s.%d.tmp' % (policy_file_path, os.getpid())
+        with open(tmp_path, 'w') as stream:
+            dump_policy(policy, stream)
+        os.replace(tmp_path, policy_file_path)
 
     def main(self, *, args):
-        policy = self.get_policy(args.POLICY_FILE_PATH)
-        node_names = []
-        with NodeStrategy(args) as node:
-            node_names = get_node_names(node=node, include_hidden_nodes=False)
+        from ros2cli.node.direct import DirectNode
 
-        with DirectNode(args) as node:
-            for node_name in node_names:
-                profile = self.get_profile(policy, node_name)
-                subscribe_topics = get_subscriber_info(node=node, node_name=node_name)
-                if subscribe_topics:
-                    self.add_permission(
-                        profile, 'topic', 'subscribe', 'ALLOW', subscribe_topics, node_name)
-                publish_topics = get_publisher_info(node=node, node_name=node_name)
-                if publish_topics:
-                    self.add_permission(
-                        profile, 'topic', 'publish', 'ALLOW', publish_topics, node_name)
-                reply_services = get_service_info(node=node, node_name=node_name)
-                if reply_services:
-                    self.add_permission(
-                        profile, 'service', 'reply', 'ALLOW', reply_services, node_name)
+        from sros2.api import get_graph_snapshot
+        from sros2.policy import PolicyIndex
 
-        with open(args.POLICY_FILE_PATH, 'w') as stream:
-            dump_policy(policy, stream)
+        with span('get_policy'):
+            policy = self.get_policy(args.POLICY_FILE_PATH)
+            policy_index = PolicyIndex(policy)
+
+        watch = args.watch or args.duration is not None
+        deadline = None if args.duration is None else time.monotonic() + args.duration
+        seen = {}
+        samples = 0
+        with DirectNode(args) as node:
+            try:
+                while True:
+                    with span('snapshot_graph'):
+                        graph = get_graph_snapshot(node)
+                    with span('build_profiles'):
+                        changed = self.add_graph(policy_index, graph, seen)
+                    samples += 1
+                    count('graph_samples')
+                    if changed or samples == 1:
+                        with span('write_policy'):
+                            self.write_policy(policy, args.POLICY_FILE_PATH)
+                        if watch:
+                            print('sample %d: %d nodes, policy updated' % (samples, len(seen)))
+                    if not watch:
+                        break
+                    delay = args.interval
+                    if deadline is not None:
+                        delay = min(delay, deadline - time.monotonic())
+                        if delay <= 0:
+                            break
+                    time.sleep(delay)
+            except KeyboardInterrupt:
+                # everything found so far was already written
+                pass
+        count('nodes', len(seen))
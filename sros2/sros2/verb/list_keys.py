@@ -18,8 +18,8 @@ except ImportError:
     def DirectoriesCompleter():
         return None
 
-from sros2.api import list_keys
-from sros2.verb import VerbExtension
+from sros2._constants import CATALOG_SORT_KEYS
+from sros2.verb import add_profiling_arguments, VerbExtension
 
 
 class ListKeysVerb(VerbExtension):
@@ -28,7 +28,31 @@ class ListKeysVerb(VerbExtension):
     def add_arguments(self, parser, cli_name):
         arg = parser.add_argument('ROOT', help='root path of keystore')
         arg.completer = DirectoriesCompleter()
+        parser.add_argument(
+            '--filter', metavar='PATTERN',
+            help="only list identities matching a glob pattern, e.g. '/fleet/*'")
+        parser.add_argument(
+            '--expires-before', metavar='DATE',
+            help='only list identities whose certificate expires before a UTC date, '
+                 'e.g. 2020-01-01')
+        parser.add_argument(
+            '--sort', choices=CATALOG_SORT_KEYS, default='identity',
+            help='sort identities by this field (default: %(default)s)')
+        parser.add_argument(
+            '--reverse', action='store_true', help='reverse the sort order')
+        parser.add_argument(
+            '-l', '--long', action='store_true',
+            help='also print the serial, validity window and fingerprint of certificates')
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='rebuild the keystore catalog from the identity directories first')
+        add_profiling_arguments(parser)
 
     def main(self, *, args):
-        success = list_keys(args.ROOT)
+        from sros2.api import list_keys
+
+        success = list_keys(
+            args.ROOT, pattern=args.filter, expires_before=args.expires_before,
+            sort_by=args.sort, reverse=args.reverse, long_format=args.long,
+            rebuild=args.rebuild)
         return 0 if success else 1
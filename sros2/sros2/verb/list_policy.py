@@ -0,0 +1,51 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+try:
+    from argcomplete.completers import FilesCompleter
+except ImportError:
+    def FilesCompleter(*, allowednames, directories):
+        return None
+
+from sros2.verb import add_profiling_arguments, VerbExtension
+
+
+class ListPolicyVerb(VerbExtension):
+    """List the identities of a policy, or the files it includes."""
+
+    def add_arguments(self, parser, cli_name):
+        arg = parser.add_argument(
+            'POLICY_FILE_PATH', help='path of the policy xml file')
+        arg.completer = FilesCompleter(
+            allowednames=('xml'), directories=False)
+        parser.add_argument(
+            '--included-files', action='store_true',
+            help='list the absolute paths of the files the policy includes, directly or not, '
+                 'instead of its identities')
+        add_profiling_arguments(parser)
+
+    def main(self, *, args):
+        from sros2.api import get_policy_identities
+        from sros2.policy import get_included_files
+
+        try:
+            if args.included_files:
+                lines = get_included_files(args.POLICY_FILE_PATH)
+            else:
+                lines = get_policy_identities(args.POLICY_FILE_PATH)
+        except FileNotFoundError as e:
+            raise RuntimeError(str(e))
+        for line in lines:
+            print(line)
+        return 0
@@ -0,0 +1,71 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-identity cost of generating a permissions document.
+
+Compares compiling permissions.xsl and permissions.xsd for every identity with using the
+compiled objects memoized by sros2.policy.
+
+Usage: python3 bench_compiled_cache.py [-n ITERATIONS]
+"""
+
+import argparse
+import copy
+import os
+import timeit
+
+from lxml import etree
+
+from sros2.policy import (
+    get_compiled_transport_schema,
+    get_compiled_transport_template,
+    get_transport_schema,
+    get_transport_template,
+    load_policy,
+)
+
+
+def transform_uncached(policy_element):
+    permissions_xsl = etree.XSLT(etree.parse(get_transport_template('dds', 'permissions.xsl')))
+    permissions_xsd = etree.XMLSchema(etree.parse(get_transport_schema('dds', 'permissions.xsd')))
+    permissions_xsd.assertValid(permissions_xsl(policy_element))
+
+
+def transform_cached(policy_element):
+    permissions_xsl = get_compiled_transport_template('dds', 'permissions.xsl')
+    permissions_xsd = get_compiled_transport_schema('dds', 'permissions.xsd')
+    permissions_xsd.assertValid(permissions_xsl(policy_element))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    test_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    policy = load_policy(os.path.join(test_dir, 'policies', 'sample_policy.xml'))
+    # a single identity policy, as generate_artifacts transforms it
+    policy_element = copy.deepcopy(policy.getroot())
+    profiles = policy_element.find('profiles')
+    for profile in profiles[1:]:
+        profiles.remove(profile)
+
+    for name, transform in (('uncached', transform_uncached), ('cached', transform_cached)):
+        seconds = timeit.timeit(lambda: transform(policy_element), number=args.iterations)
+        print('%-8s %8.3f ms per identity' % (name, 1000 * seconds / args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time keystore and permissions generation for increasing numbers of identities.
+
+For each size a synthetic policy is generated and every stage is timed in a fresh
+temporary keystore. Results are written as JSON and can be compared with the results of
+another commit.
+
+Usage: python3 bench_scale.py [--sizes 10 100 1000 5000] [-j JOBS] [-o RESULTS.json]
+                              [--compare PREVIOUS.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from sros2.api import (
+    create_key,
+    create_keystore,
+    create_permission,
+    generate_artifacts,
+    list_keys,
+)
+from sros2.policy import load_policy, transform_permissions
+from synthetic_policy import generate_policy
+
+# create_key and create_permission are timed for at most this many identities per size
+SAMPLE_SIZE = 50
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(results, stage, function, *args, **kwargs):
+    # the API is chatty, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        results[stage] = time.perf_counter() - start
+
+
+def bench_size(work_dir, size, jobs):
+    results = {}
+    policy_path, identities = generate_policy(os.path.join(work_dir, 'policy'), nodes=size)
+    timed(results, 'load_policy', load_policy, policy_path)
+    policy = load_policy(policy_path)
+    timed(results, 'transform_permissions', transform_permissions, policy)
+
+    keystore_path = os.path.join(work_dir, 'keystore')
+    timed(results, 'create_keystore', create_keystore, keystore_path)
+    timed(
+        results, 'generate_artifacts', generate_artifacts, keystore_path,
+        policy_files=[policy_path], jobs=jobs)
+    timed(
+        results, 'generate_artifacts_unchanged', generate_artifacts, keystore_path,
+        policy_files=[policy_path], jobs=jobs)
+    timed(results, 'list_keys', list_keys, keystore_path)
+
+    sample = identities[:SAMPLE_SIZE]
+    other_keystore_path = os.path.join(work_dir, 'other_keystore')
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_keystore(other_keystore_path)
+    timed(results, 'create_key', lambda: [
+        create_key(other_keystore_path, identity) for identity in sample])
+    results['create_key'] /= len(sample)
+    timed(results, 'create_permission', lambda: [
+        create_permission(other_keystore_path, identity, policy_path) for identity in sample])
+    results['create_permission'] /= len(sample)
+    return results
+
+
+def compare(results, previous):
+    print('\ncompared with %s:' % (previous.get('commit') or 'previous results'))
+    for size, stages in results['sizes'].items():
+        previous_stages = previous['sizes'].get(size, {})
+        for stage, seconds in stages.items():
+            if previous_stages.get(stage):
+                print('%6s %-30s %6.2fx' % (size, stage, seconds / previous_stages[stage]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('-o', '--output', default='bench_scale.json')
+    parser.add_argument('--compare', metavar='PREVIOUS', help='results of a previous run')
+    args = parser.parse_args()
+
+    results = {
+        'commit': get_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'jobs': args.jobs,
+        'sizes': {},
+    }
+    for size in args.sizes:
+        work_dir = tempfile.mkdtemp(prefix='sros2_bench_')
+        try:
+            stages = bench_size(work_dir, size, args.jobs)
+        finally:
+            shutil.rmtree(work_dir)
+        results['sizes'][str(size)] = stages
+        for stage, seconds in stages.items():
+            print('%6d %-30s %10.4f s' % (size, stage, seconds))
+        sys.stdout.flush()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print('results written to %s' % args.output)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time the startup of the security verbs in fresh interpreters.
+
+For each verb two costs are measured, above the cost of starting an empty interpreter:
+- 'parser': importing the verb module and adding its arguments, which every
+  `ros2 security` invocation pays for all verbs when building its parser
+- 'main': additionally importing everything the main of the verb needs
+Results are written as JSON and can be compared with the results of another commit.
+
+Usage: python3 bench_startup.py [-n RUNS] [-o RESULTS.json] [--compare PREVIOUS.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# the modules imported by the main of each verb, as of the commit benchmarked
+VERBS = {
+    'compact_policy': ('CompactPolicyVerb', ['sros2.policy']),
+    'create_key': ('CreateKeyVerb', ['sros2.api']),
+    'create_keystore': ('CreateKeystoreVerb', ['sros2.api']),
+    'create_permission': ('CreatePermissionVerb', ['sros2.api']),
+    'distribute_key': ('DistributeKeyVerb', ['sros2.api']),
+    'generate_artifacts': ('GenerateArtifactsVerb', ['sros2.api']),
+    'generate_policy': (
+        'GeneratePolicyVerb', ['lxml.etree', 'ros2cli.node.direct', 'sros2.api', 'sros2.policy']),
+    'list_keys': ('ListKeysVerb', ['sros2.api']),
+    'list_policy': ('ListPolicyVerb', ['sros2.api', 'sros2.policy']),
+}
+
+_PARSER_SCRIPT = """\
+import argparse
+from sros2.verb.{verb} import {cls}
+{cls}().add_arguments(argparse.ArgumentParser(), 'ros2')
+"""
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def time_script(script, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', script])
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=10)
+    parser.add_argument('-o', '--output', default='bench_startup.json')
+    parser.add_argument('--compare', metavar='PREVIOUS', help='results of a previous run')
+    args = parser.parse_args()
+
+    baseline = time_script('pass', args.runs)
+    results = {
+        'commit': get_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'interpreter': baseline,
+        'verbs': {},
+    }
+    print('%-20s %10s %10s' % ('verb', 'parser', 'main'))
+    for verb, (cls, modules) in sorted(VERBS.items()):
+        parser_script = _PARSER_SCRIPT.format(verb=verb, cls=cls)
+        main_script = parser_script + ''.join('import %s\n' % module for module in modules)
+        stages = {
+            'parser': time_script(parser_script, args.runs) - baseline,
+            'main': time_script(main_script, args.runs) - baseline,
+        }
+        results['verbs'][verb] = stages
+        print('%-20s %8.1fms %8.1fms' % (verb, stages['parser'] * 1e3, stages['main'] * 1e3))
+        sys.stdout.flush()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print('results written to %s' % args.output)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print('\ncompared with %s:' % (previous.get('commit') or 'previous results'))
+        for verb, stages in sorted(results['verbs'].items()):
+            previous_stages = previous['verbs'].get(verb, {})
+            for stage, seconds in sorted(stages.items()):
+                if previous_stages.get(stage):
+                    print('%-20s %-6s %6.2fx' % (verb, stage, seconds / previous_stages[stage]))
+
+
+if __name__ == '__main__':
+    main()
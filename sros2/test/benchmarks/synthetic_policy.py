@@ -0,0 +1,127 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Generate a synthetic policy of arbitrary size.
+
+Nodes are spread over nested namespaces, each has its own topics, services and actions, and
+all of them xinclude the expression lists common to every node from a separate fragment.
+
+Usage: python3 synthetic_policy.py OUTPUT_DIR [-n NODES] [-t TOPICS] [-s SERVICES]
+                                   [-a ACTIONS] [-d DEPTH]
+"""
+
+import argparse
+import os
+
+POLICY_FILE_NAME = 'policy.xml'
+COMMON_FILE_NAME = 'common.xml'
+
+_COMMON = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<profile>
+  <topics publish="ALLOW" subscribe="ALLOW">
+    <topic>parameter_events</topic>
+  </topics>
+  <topics publish="ALLOW">
+    <topic>rosout</topic>
+  </topics>
+  <topics subscribe="ALLOW">
+    <topic>/clock</topic>
+  </topics>
+  <services reply="ALLOW" request="ALLOW">
+    <service>~describe_parameters</service>
+    <service>~get_parameter_types</service>
+    <service>~get_parameters</service>
+    <service>~list_parameters</service>
+    <service>~set_parameters</service>
+    <service>~set_parameters_atomically</service>
+  </services>
+</profile>
+"""
+
+
+def get_namespace(index, depth):
+    # ten children per namespace level, e.g. /ns1/ns4 for node 41 at depth 2
+    return '/' + '/'.join(
+        'ns%d' % (index // 10 ** (depth - level) % 10) for level in range(depth))
+
+
+def _write_expressions(f, tag, attributes, names):
+    f.write('      <%ss %s>\n' % (tag, attributes))
+    for name in names:
+        f.write('        <%s>%s</%s>\n' % (tag, name, tag))
+    f.write('      </%ss>\n' % tag)
+
+
+def generate_policy(output_dir, nodes=10, topics=5, services=2, actions=1, depth=2):
+    """
+    Write a policy with `nodes` profiles and the fragment it includes to a directory.
+
+    :return: the path of the policy and the identities of its profiles
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, COMMON_FILE_NAME), 'w') as f:
+        f.write(_COMMON)
+
+    identities = []
+    policy_path = os.path.join(output_dir, POLICY_FILE_NAME)
+    with open(policy_path, 'w') as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<policy version="0.1.0" xmlns:xi="http://www.w3.org/2001/XInclude">\n'
+            '  <profiles>\n')
+        for index in range(nodes):
+            ns = get_namespace(index, depth)
+            node = 'node%d' % index
+            identities.append(ns.rstrip('/') + '/' + node)
+            f.write('    <profile ns="%s" node="%s">\n' % (ns, node))
+            f.write(
+                '      <xi:include href="%s" xpointer="xpointer(/profile/*)"/>\n' %
+                COMMON_FILE_NAME)
+            # half of the topics are shared with the neighbouring node
+            _write_expressions(f, 'topic', 'publish="ALLOW"', [
+                'topic%d_%d' % (index, topic) for topic in range(topics)])
+            _write_expressions(f, 'topic', 'subscribe="ALLOW"', [
+                'topic%d_%d' % (index - 1 if topic % 2 else index, topic)
+                for topic in range(topics)])
+            if services:
+                _write_expressions(f, 'service', 'reply="ALLOW"', [
+                    '~service%d' % service for service in range(services)])
+                _write_expressions(f, 'service', 'request="ALLOW"', [
+                    '/service%d' % service for service in range(services)])
+            if actions:
+                _write_expressions(f, 'action', 'call="ALLOW" execute="ALLOW"', [
+                    'action%d' % action for action in range(actions)])
+            f.write('    </profile>\n')
+        f.write('  </profiles>\n</policy>\n')
+    return policy_path, identities
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('OUTPUT_DIR')
+    parser.add_argument('-n', '--nodes', type=int, default=10)
+    parser.add_argument('-t', '--topics', type=int, default=5)
+    parser.add_argument('-s', '--services', type=int, default=2)
+    parser.add_argument('-a', '--actions', type=int, default=1)
+    parser.add_argument('-d', '--depth', type=int, default=2)
+    args = parser.parse_args()
+    policy_path, _ = generate_policy(
+        args.OUTPUT_DIR, args.nodes, args.topics, args.services, args.actions, args.depth)
+    print(policy_path)
+
+
+if __name__ == '__main__':
+    main()
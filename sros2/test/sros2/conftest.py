@@ -0,0 +1,23 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def policy_cache_dir(tmp_path_factory, monkeypatch):
+    # each test gets a cache of its own, never the one of the user running them
+    cache_dir = str(tmp_path_factory.mktemp('policy_cache'))
+    monkeypatch.setenv('SROS2_POLICY_CACHE', cache_dir)
+    return cache_dir
@@ -12,7 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from sros2.api import is_key_name_valid
+import concurrent.futures
+import os
+
+import pytest
+
+from sros2.api import _distribution
+from sros2.api import (
+    create_key,
+    create_keystore,
+    create_permission_file,
+    create_permission_files,
+    create_signed_governance_file,
+    distribute_key,
+    generate_artifacts,
+    get_graph_snapshot,
+    get_policy_identities,
+    is_key_name_valid,
+    list_keys,
+    read_provisioning_manifests,
+)
+from sros2.api._catalog import CATALOG_FILE_NAME, KeystoreCatalog
+from sros2.api._manifest import ArtifactManifest
+from sros2.policy import load_policy, PolicyIndex
 
 
 def test_is_key_name_valid():
@@ -30,3 +52,399 @@ def test_is_key_name_valid():
     assert not is_key_name_valid('foo/bar')
     assert not is_key_name_valid('/42foo')
     assert not is_key_name_valid('/foo/42bar')
+
+
+class FakeGraphNode:
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def get_node_names_and_namespaces(self):
+        return list(self.graph.keys())
+
+    def get_subscriber_names_and_types_by_node(self, node, ns):
+        return self.graph[(node, ns)]['subscribers']
+
+    def get_publisher_names_and_types_by_node(self, node, ns):
+        return self.graph[(node, ns)]['publishers']
+
+    def get_service_names_and_types_by_node(self, node, ns):
+        return self.graph[(node, ns)]['services']
+
+
+def test_get_graph_snapshot():
+    graph = {}
+    for i in range(20):
+        graph[('talker%d' % i, '/ns%d' % (i % 3))] = {
+            'subscribers': [],
+            'publishers': [('/chatter%d' % i, ['std_msgs/String'])],
+            'services': [('/ns%d/talker%d/get_parameters' % (i % 3, i), ['GetParameters'])],
+        }
+    graph[('_hidden', '/')] = {'subscribers': [], 'publishers': [], 'services': []}
+
+    snapshot = get_graph_snapshot(FakeGraphNode(graph))
+    assert [node_name.fqn for node_name in snapshot] == \
+        ['/ns%d/talker%d' % (i % 3, i) for i in range(20)]
+    for i, node_graph_info in enumerate(snapshot.values()):
+        assert node_graph_info.subscribers == []
+        assert [topic.fqn for topic in node_graph_info.publishers] == ['/chatter%d' % i]
+        assert len(node_graph_info.services) == 1
+
+
+def test_generate_artifacts_parallel(tmpdir):
+    keystore_path = str(tmpdir)
+    identities = ['/foo', '/foo/bar', '/baz']
+    assert generate_artifacts(keystore_path, identities, jobs=2)
+    assert not generate_artifacts(keystore_path, ['/foo'], jobs=0)
+
+    for identity in identities:
+        key_dir = os.path.join(keystore_path, identity.lstrip('/'))
+        for name in ('cert.pem', 'key.pem', 'permissions.xml', 'permissions.p7s'):
+            assert os.path.isfile(os.path.join(key_dir, name))
+    # serials are allocated in the order identities were given
+    with open(os.path.join(keystore_path, 'index.txt')) as f:
+        entries = [line.split('\t') for line in f.read().splitlines()]
+    assert [entry[3] for entry in entries] == ['1000', '1001', '1002']
+    assert [entry[5] for entry in entries] == ['/CN=\\/foo', '/CN=\\/foo\\/bar', '/CN=\\/baz']
+
+
+def test_generate_artifacts_with_invalid_name(tmpdir):
+    keystore_path = str(tmpdir.join('keystore'))
+    # names given directly are checked before anything is provisioned
+    assert not generate_artifacts(keystore_path, ['/foo', '/1nvalid'])
+    assert not os.path.exists(keystore_path)
+
+    # the identities streamed before an invalid profile are provisioned completely
+    policy_file_path = str(tmpdir.join('policy.xml'))
+    with open(policy_file_path, 'w') as f:
+        f.write(
+            '<policy version="0.1.0"><profiles>'
+            '<profile ns="/" node="foo"/><profile ns="/" node="bar"/>'
+            '<profile ns="/" node="1nvalid"/><profile ns="/" node="baz"/>'
+            '</profiles></policy>')
+    assert not generate_artifacts(keystore_path, policy_files=[policy_file_path], jobs=2)
+    for identity in ('foo', 'bar'):
+        for name in ('cert.pem', 'key.pem', 'permissions.xml', 'permissions.p7s'):
+            assert os.path.isfile(os.path.join(keystore_path, identity, name))
+    assert not os.path.exists(os.path.join(keystore_path, '1nvalid'))
+    assert not os.path.exists(os.path.join(keystore_path, 'baz'))
+    assert sorted(ArtifactManifest(keystore_path).identities) == ['/bar', '/foo']
+
+
+def test_keystore_catalog(tmpdir, capsys):
+    keystore_path = str(tmpdir)
+    identities = ['/fleet/robot2/talker', '/fleet/robot1/talker', '/listener']
+    assert generate_artifacts(keystore_path, identities)
+
+    with KeystoreCatalog(keystore_path) as catalog:
+        entries = catalog.query()
+        assert [entry.identity for entry in entries] == sorted(identities)
+        assert [entry.identity for entry in catalog.query(sort_by='serial', reverse=True)] == \
+            list(reversed(identities))
+        assert [entry.identity for entry in catalog.query(pattern='/fleet/*')] == \
+            ['/fleet/robot1/talker', '/fleet/robot2/talker']
+        assert catalog.query(expires_before='2000-01-01') == []
+    entry = entries[-1]
+    assert entry.subject == 'CN=/listener'
+    assert entry.serial == '1002'
+    assert entry.not_before < entry.not_after
+    assert len(entry.fingerprint) == 64
+    assert entry.permissions_hash is not None
+
+    # keystores without a catalog are indexed when it is first opened
+    os.remove(os.path.join(keystore_path, CATALOG_FILE_NAME))
+    capsys.readouterr()
+    assert list_keys(keystore_path, pattern='/fleet/robot1/*')
+    assert capsys.readouterr().out == '/fleet/robot1/talker\n'
+    with KeystoreCatalog(keystore_path) as catalog:
+        assert catalog.query() == entries
+
+    # processes opening a new catalog at once wait for the one building it
+    os.remove(os.path.join(keystore_path, CATALOG_FILE_NAME))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(_query_catalog, [keystore_path] * 4)) == [entries] * 4
+    # and updates are committed right away, without holding the catalog for others
+    with KeystoreCatalog(keystore_path) as catalog:
+        catalog.update_permissions('/listener')
+        with KeystoreCatalog(keystore_path) as other_catalog:
+            other_catalog.update_cert('/listener')
+            assert other_catalog.query() == entries
+
+
+def _query_catalog(keystore_path):
+    with KeystoreCatalog(keystore_path) as catalog:
+        return catalog.query()
+
+
+def test_distribute_key(tmpdir):
+    keystore_path = str(tmpdir.join('keystore'))
+    target_path = str(tmpdir.join('target'))
+    assert generate_artifacts(keystore_path, ['/foo', '/foo/bar', '/baz'])
+
+    assert distribute_key(keystore_path, target_path, ['/foo', '/foo/bar'])
+    assert sorted(os.listdir(target_path)) == ['foo']
+    assert distribute_key(keystore_path, target_path)
+    assert sorted(os.listdir(target_path)) == ['baz', 'foo']
+    for name in ('cert.pem', 'key.pem', 'permissions.p7s', 'governance.p7s'):
+        with open(os.path.join(keystore_path, 'foo', name), 'rb') as f:
+            with open(os.path.join(target_path, 'foo', name), 'rb') as g:
+                assert f.read() == g.read()
+    assert os.stat(os.path.join(target_path, 'foo', 'key.pem')).st_mode & 0o077 == 0
+
+    # only the changed identity is swapped in, nested identities are kept
+    unchanged_inode = os.stat(os.path.join(target_path, 'baz', 'cert.pem')).st_ino
+    with open(os.path.join(keystore_path, 'foo', 'permissions.xml'), 'a') as f:
+        f.write('\n')
+    with open(os.path.join(target_path, 'foo', 'stale.txt'), 'w') as f:
+        f.write('stale')
+    assert distribute_key(keystore_path, target_path)
+    assert os.stat(os.path.join(target_path, 'baz', 'cert.pem')).st_ino == unchanged_inode
+    assert not os.path.exists(os.path.join(target_path, 'foo', 'stale.txt'))
+    assert os.path.isfile(os.path.join(target_path, 'foo', 'bar', 'cert.pem'))
+    assert sorted(os.listdir(target_path)) == ['baz', 'foo']
+
+    assert not distribute_key(keystore_path, target_path, ['/missing'])
+
+
+@pytest.mark.parametrize('exchange', [True, False])
+def test_swap_identity_directory(tmpdir, monkeypatch, exchange):
+    if not exchange:
+        # platforms which can not exchange directories rename the previous one away first
+        monkeypatch.setattr(_distribution, '_exchange_paths', lambda path, other_path: False)
+    key_dir = tmpdir.mkdir('foo')
+    key_dir.join('cert.pem').write('old')
+    key_dir.mkdir('bar').join('cert.pem').write('nested')
+    staging_dir = tmpdir.mkdir('.foo.sros2-staging')
+    staging_dir.join('cert.pem').write('new')
+
+    _distribution._swap_directory(str(staging_dir), str(key_dir))
+    assert key_dir.join('cert.pem').read() == 'new'
+    assert key_dir.join('bar', 'cert.pem').read() == 'nested'
+    assert sorted(os.listdir(str(tmpdir))) == ['foo']
+
+
+def test_generate_artifacts_link_modes(tmpdir):
+    keystore_path = str(tmpdir.join('keystore'))
+    assert generate_artifacts(keystore_path, ['/foo/bar'], link_mode='symlink')
+    assert generate_artifacts(keystore_path, ['/baz'], link_mode='hardlink')
+    symlinked_dir = os.path.join(keystore_path, 'foo', 'bar')
+    hardlinked_dir = os.path.join(keystore_path, 'baz')
+    for name in ('identity_ca.cert.pem', 'permissions_ca.cert.pem', 'governance.p7s'):
+        assert os.path.islink(os.path.join(symlinked_dir, name))
+        assert not os.path.isabs(os.readlink(os.path.join(symlinked_dir, name)))
+        assert os.stat(os.path.join(hardlinked_dir, name)).st_nlink > 1
+
+    # re-signing the governance of the keystore updates every identity
+    governance_path = os.path.join(keystore_path, 'governance.p7s')
+    create_signed_governance_file(
+        governance_path, os.path.join(keystore_path, 'governance.xml'),
+        os.path.join(keystore_path, 'ca.cert.pem'), os.path.join(keystore_path, 'ca.key.pem'))
+    with open(governance_path, 'rb') as f:
+        governance = f.read()
+    for key_dir in (symlinked_dir, hardlinked_dir):
+        with open(os.path.join(key_dir, 'governance.p7s'), 'rb') as f:
+            assert f.read() == governance
+
+    # copies are materialized when distributing
+    target_path = str(tmpdir.join('target'))
+    assert distribute_key(keystore_path, target_path)
+    for key_dir in (os.path.join(target_path, 'foo', 'bar'), os.path.join(target_path, 'baz')):
+        governance_path = os.path.join(key_dir, 'governance.p7s')
+        assert not os.path.islink(governance_path)
+        assert os.stat(governance_path).st_nlink == 1
+
+    # and switching back to copies replaces the links
+    assert generate_artifacts(keystore_path, ['/foo/bar'], link_mode='copy')
+    assert not os.path.islink(os.path.join(symlinked_dir, 'governance.p7s'))
+
+
+def test_create_key_with_policy(tmpdir):
+    keystore_path = str(tmpdir)
+    policy_file_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'policies', 'talker_listener.xml')
+    assert create_keystore(keystore_path)
+    assert create_key(keystore_path, '/talker', policy_file_path=policy_file_path)
+
+    key_dir = os.path.join(keystore_path, 'talker')
+    # the key is generated from the curve parameters of the keystore
+    assert not os.path.exists(os.path.join(key_dir, 'ecdsaparam'))
+    with open(os.path.join(key_dir, 'permissions.xml')) as f:
+        assert '<topic>rt/chatter</topic>' in f.read()
+
+
+def test_create_key_in_concurrent_processes(tmpdir):
+    keystore_path = str(tmpdir)
+    assert create_keystore(keystore_path)
+    identities = ['/foo', '/bar', '/baz', '/qux']
+    # like the commands of a parallel build, each identity is created by a process of its own
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(identities)) as executor:
+        assert all(executor.map(create_key, [keystore_path] * len(identities), identities))
+
+    with open(os.path.join(keystore_path, 'index.txt')) as f:
+        entries = [line.split('\t') for line in f.read().splitlines()]
+    assert sorted(entry[3] for entry in entries) == ['1000', '1001', '1002', '1003']
+    assert sorted(entry[5] for entry in entries) == sorted(
+        '/CN=\\' + identity for identity in identities)
+
+
+def test_get_policy_identities():
+    policy_file_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'policies', 'sample_policy.xml')
+    assert get_policy_identities(policy_file_path) == [
+        '/talker', '/listener', '/add_two_ints_server', '/add_two_ints_client',
+        '/minimal_action_server', '/minimal_action_client', '/admin']
+
+
+def test_read_provisioning_manifests(tmpdir, capsys):
+    policies_dir = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'policies')
+    manifest_dir = tmpdir.mkdir('provisioning_manifest.d')
+    manifest_dir.join('pkg1.txt').write(
+        '# declared by pkg1\n'
+        'node /talker\n'
+        'policy %s\n' % os.path.join(policies_dir, 'sample_policy.xml'))
+    manifest_dir.join('pkg2.txt').write(
+        'node /listener\n'
+        'node /talker\n'
+        'policy %s\n'
+        'policy missing_policy.xml\n' % os.path.join(policies_dir, 'sample_policy.xml'))
+
+    # declarations of the whole workspace are returned once
+    assert read_provisioning_manifests([str(manifest_dir)]) == (
+        ['/talker', '/listener'], [os.path.join(policies_dir, 'sample_policy.xml')])
+    assert 'missing_policy.xml' in capsys.readouterr().err
+
+    # manifests of packages whose sources were removed are stale
+    manifest_dir.join('pkg3.txt').write(
+        'source %s\n'
+        'node /removed\n' % tmpdir.join('removed_pkg'))
+    assert read_provisioning_manifests([str(manifest_dir)])[0] == ['/talker', '/listener']
+    tmpdir.mkdir('removed_pkg')
+    assert read_provisioning_manifests([str(manifest_dir)])[0] == \
+        ['/talker', '/listener', '/removed']
+
+    manifest_dir.join('pkg4.txt').write('nodes /talker\n')
+    with pytest.raises(RuntimeError):
+        read_provisioning_manifests([str(manifest_dir)])
+
+
+def test_generate_artifacts_incremental(tmpdir, monkeypatch):
+    keystore_path = str(tmpdir)
+    policy_file_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'policies', 'add_two_ints.xml')
+    signed_permissions_path = os.path.join(
+        keystore_path, 'add_two_ints_server', 'permissions.p7s')
+
+    assert generate_artifacts(keystore_path, policy_files=[policy_file_path])
+    with open(signed_permissions_path, 'rb') as f:
+        signed_permissions = f.read()
+
+    # nothing changed, nothing is signed again
+    assert generate_artifacts(keystore_path, policy_files=[policy_file_path])
+    with open(signed_permissions_path, 'rb') as f:
+        assert f.read() == signed_permissions
+
+    # a different domain id changes the permissions of every identity
+    monkeypatch.setenv('ROS_DOMAIN_ID', '42')
+    assert generate_artifacts(keystore_path, policy_files=[policy_file_path])
+    with open(signed_permissions_path, 'rb') as f:
+        assert f.read() != signed_permissions
+
+
+def test_manifest_digest_covers_permissions_engine(tmpdir, monkeypatch):
+    keystore_path = str(tmpdir)
+    create_keystore(keystore_path)
+    policy = load_policy(os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'policies', 'add_two_ints.xml'))
+    policy_element = policy.find('profiles')
+
+    monkeypatch.delenv('SROS2_PERMISSIONS_ENGINE', raising=False)
+    inputs_digest = ArtifactManifest(keystore_path).get_inputs_digest(policy_element, '0')
+
+    # switching engine, or changing its source, invalidates the permissions
+    monkeypatch.setenv('SROS2_PERMISSIONS_ENGINE', 'xslt')
+    assert ArtifactManifest(keystore_path).get_inputs_digest(policy_element, '0') != \
+        inputs_digest
+    monkeypatch.delenv('SROS2_PERMISSIONS_ENGINE')
+    engine_file = tmpdir.join('_permissions.py')
+    engine_file.write('# fixed\n')
+    monkeypatch.setattr(
+        'sros2.api._manifest.get_permissions_engine_files', lambda: [str(engine_file)])
+    assert ArtifactManifest(keystore_path).get_inputs_digest(policy_element, '0') != \
+        inputs_digest
+
+
+def test_generate_artifacts_streamed(tmpdir, monkeypatch):
+    keystore_path = str(tmpdir.join('keystore'))
+    policies_dir = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'policies')
+    policy_file_path = os.path.join(policies_dir, 'sample_policy.xml')
+    # /talker is also in the policy, whose profile applies
+    identities = ['/talker', '/extra']
+    # permissions are created in several batches
+    monkeypatch.setattr('sros2.api.PERMISSIONS_BATCH_SIZE', 2)
+    assert generate_artifacts(
+        keystore_path, identities, [policy_file_path, policy_file_path], jobs=2)
+
+    policy_index = PolicyIndex(load_policy(policy_file_path))
+    for ns, node in policy_index.keys():
+        key_dir = os.path.join(keystore_path, ns.lstrip('/'), node)
+        expected_path = str(tmpdir.join(node + '.xml'))
+        create_permission_file(expected_path, '0', policy_index.get_policy_element(ns, node))
+        with open(os.path.join(key_dir, 'permissions.xml'), 'rb') as f, \
+                open(expected_path, 'rb') as expected:
+            assert f.read() == expected.read()
+        assert os.path.isfile(os.path.join(key_dir, 'permissions.p7s'))
+    assert os.path.isfile(os.path.join(keystore_path, 'extra', 'permissions.p7s'))
+
+    # serials follow the order profiles are streamed in, then the identities given
+    with open(os.path.join(keystore_path, 'index.txt')) as f:
+        subjects = [line.split('\t')[5] for line in f.read().splitlines()]
+    assert len(subjects) == len(policy_index) + 1
+    assert subjects[0] == '/CN=\\/talker'
+    assert subjects[-1] == '/CN=\\/extra'
+
+
+def test_generate_artifacts_merges_duplicate_profiles(tmpdir):
+    keystore_path = str(tmpdir.join('keystore'))
+    policy_file_paths = []
+    for name, topic in (('first.xml', 'a'), ('second.xml', 'b')):
+        policy_file_paths.append(str(tmpdir.join(name)))
+        with open(policy_file_paths[-1], 'w') as f:
+            f.write(
+                '<policy version="0.1.0"><profiles>'
+                '<profile ns="/" node="%s"/>'
+                '<profile ns="/" node="shared">'
+                '<topics publish="ALLOW"><topic>%s</topic></topics></profile>'
+                '</profiles></policy>' % (name[:-4], topic))
+    assert generate_artifacts(keystore_path, [], policy_file_paths)
+
+    with open(os.path.join(keystore_path, 'shared', 'permissions.xml')) as f:
+        permissions = f.read()
+    assert 'rt/a' in permissions
+    assert 'rt/b' in permissions
+    # the shared identity is provisioned once, when its last profile is found
+    with open(os.path.join(keystore_path, 'index.txt')) as f:
+        subjects = [line.split('\t')[5] for line in f.read().splitlines()]
+    assert subjects == ['/CN=\\/first', '/CN=\\/second', '/CN=\\/shared']
+
+
+def test_create_permission_files(tmpdir):
+    policy_file_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'policies', 'sample_policy.xml')
+    policy_index = PolicyIndex(load_policy(policy_file_path))
+    paths = [os.path.join(str(tmpdir), node + '.xml') for _, node in policy_index.keys()]
+    create_permission_files(paths, '42', policy_index.policy)
+
+    # splitting the permissions of the whole policy gives the same documents as
+    # transforming the profiles one at a time
+    for path, (ns, node) in zip(paths, policy_index.keys()):
+        expected_path = os.path.join(str(tmpdir), node + '.expected.xml')
+        create_permission_file(expected_path, '42', policy_index.get_policy_element(ns, node))
+        with open(path, 'rb') as f, open(expected_path, 'rb') as expected:
+            assert f.read() == expected.read()
@@ -0,0 +1,104 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from sros2.api import create_ca_conf_file, create_request_file
+from sros2.crypto import get_crypto_backend
+from sros2.crypto._openssl import get_openssl_toolchain, TOOLCHAIN_CACHE_FILE_NAME
+
+
+def _load_cert(path):
+    with open(path, 'rb') as f:
+        return x509.load_pem_x509_certificate(f.read(), default_backend())
+
+
+def test_cryptography_backend(tmpdir):
+    backend = get_crypto_backend('cryptography')
+    root = str(tmpdir)
+    ca_conf_path = os.path.join(root, 'ca_conf.cnf')
+    ecdsa_param_path = os.path.join(root, 'ecdsaparam')
+    ca_key_path = os.path.join(root, 'ca.key.pem')
+    ca_cert_path = os.path.join(root, 'ca.cert.pem')
+    create_ca_conf_file(ca_conf_path)
+    backend.create_ecdsa_param_file(ecdsa_param_path)
+    with open(ecdsa_param_path) as f:
+        assert f.read() == (
+            '-----BEGIN EC PARAMETERS-----\n'
+            'BggqhkjOPQMBBw==\n'
+            '-----END EC PARAMETERS-----\n')
+    backend.create_ca_key_cert(ecdsa_param_path, ca_conf_path, ca_key_path, ca_cert_path)
+    with open(os.path.join(root, 'index.txt'), 'w'):
+        pass
+    with open(os.path.join(root, 'serial'), 'w') as f:
+        f.write('1000')
+
+    key_dir = os.path.join(root, 'foo', 'bar')
+    os.makedirs(key_dir)
+    cnf_path = os.path.join(key_dir, 'request.cnf')
+    create_request_file(cnf_path, '/foo/bar')
+    backend.create_key_and_cert_req(
+        root, os.path.join('foo', 'bar'), cnf_path, ecdsa_param_path,
+        os.path.join(key_dir, 'key.pem'), os.path.join(key_dir, 'req.pem'))
+    backend.create_cert(root, os.path.join('foo', 'bar'))
+
+    ca_cert = _load_cert(ca_cert_path)
+    cert = _load_cert(os.path.join(key_dir, 'cert.pem'))
+    assert cert.issuer == ca_cert.subject
+    assert cert.subject.rfc4514_string() == 'CN=/foo/bar'
+    assert cert.serial_number == 0x1000
+    assert isinstance(cert.public_key().curve, ec.SECP256R1)
+    assert not cert.extensions.get_extension_for_class(x509.BasicConstraints).value.ca
+    with open(os.path.join(root, 'serial')) as f:
+        assert f.read() == '1001\n'
+    with open(os.path.join(root, 'index.txt')) as f:
+        assert f.read().endswith('\t\t1000\tunknown\t/CN=\\/foo\\/bar\n')
+
+    governance_path = os.path.join(root, 'governance.xml')
+    with open(governance_path, 'w') as f:
+        f.write('<dds>\n</dds>\n')
+    signed_governance_path = os.path.join(root, 'governance.p7s')
+    backend.create_smime_signed_file(
+        governance_path, signed_governance_path, ca_cert_path, ca_key_path)
+    with open(signed_governance_path, 'rb') as f:
+        signed = f.read()
+    assert signed.startswith(b'MIME-Version: 1.0\nContent-Type: multipart/signed;')
+    assert b'Content-Type: text/plain\r\n\r\n<dds>\r\n</dds>\r\n\n' in signed
+
+    paths = []
+    for name in ('a', 'b'):
+        in_path = os.path.join(root, name + '.xml')
+        with open(in_path, 'w') as f:
+            f.write('<%s/>\n' % name)
+        paths.append((in_path, os.path.join(root, name + '.p7s')))
+    backend.create_smime_signed_files(paths, ca_cert_path, ca_key_path)
+    for name, (_, out_path) in zip(('a', 'b'), paths):
+        with open(out_path, 'rb') as f:
+            assert b'Content-Type: text/plain\r\n\r\n<%s/>\r\n\n' % name.encode() in f.read()
+
+
+def test_openssl_toolchain_cache(tmpdir):
+    toolchain = get_openssl_toolchain(str(tmpdir))
+    assert toolchain.version.lower().startswith('openssl')
+    assert get_openssl_toolchain() is toolchain
+
+    with open(os.path.join(str(tmpdir), TOOLCHAIN_CACHE_FILE_NAME)) as f:
+        cache = json.load(f)
+    assert cache['executable'] == toolchain.executable
+    assert cache['mtime'] == os.stat(toolchain.executable).st_mtime
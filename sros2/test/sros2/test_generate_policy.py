@@ -0,0 +1,36 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+
+import pytest
+
+from sros2.verb.generate_policy import GeneratePolicyVerb
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser()
+    GeneratePolicyVerb().add_arguments(parser, 'ros2')
+    return parser.parse_args(argv)
+
+
+def test_generate_policy_watch_arguments():
+    args = _parse_args(['policy.xml', '--duration', '0', '--interval', '0.5'])
+    assert args.duration == 0.0
+    assert args.interval == 0.5
+    assert _parse_args(['policy.xml']).interval == 1.0
+
+    for argv in (['--interval', '-1'], ['--duration', '-0.5'], ['--interval', 'soon']):
+        with pytest.raises(SystemExit):
+            _parse_args(['policy.xml'] + argv)
@@ -0,0 +1,53 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import os
+
+from lxml import etree
+import pytest
+
+from sros2.policy import (
+    get_transport_schema,
+    load_policy,
+    transform_permissions,
+)
+
+test_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+policy_paths = [
+    path for path in sorted(glob.glob(os.path.join(test_dir, 'policies', '*.xml')))
+    if etree.parse(path).getroot().tag == 'policy'
+]
+
+
+@pytest.mark.parametrize('policy_path', policy_paths, ids=os.path.basename)
+def test_permissions_compiler_matches_template(policy_path):
+    permissions_xsd = etree.XMLSchema(etree.parse(get_transport_schema('dds', 'permissions.xsd')))
+    policy = load_policy(policy_path)
+
+    expected = transform_permissions(policy, '42', engine='xslt')
+    actual = transform_permissions(policy, '42', engine='python')
+
+    permissions_xsd.assertValid(actual)
+    assert etree.tostring(actual, pretty_print=True) == \
+        etree.tostring(expected, pretty_print=True)
+
+
+def test_permissions_engine_selection(monkeypatch):
+    policy = load_policy(os.path.join(test_dir, 'policies', 'talker_listener.xml'))
+    monkeypatch.setenv('SROS2_PERMISSIONS_ENGINE', 'xslt')
+    assert transform_permissions(policy).getroot().tag == 'dds'
+    monkeypatch.setenv('SROS2_PERMISSIONS_ENGINE', 'unknown')
+    with pytest.raises(RuntimeError):
+        transform_permissions(policy)
@@ -0,0 +1,331 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import io
+import os
+import threading
+
+from lxml import etree
+
+import pytest
+
+from sros2 import _profiling
+from sros2.policy import (
+    _get_compiled,
+    _include_resolver,
+    compact_policy,
+    compile_permissions,
+    dump_policy,
+    get_compiled_transport_template,
+    get_included_files,
+    get_policy_cache,
+    iter_policy,
+    iter_profile_keys,
+    load_policy,
+    PolicyIndex,
+)
+
+
+def test_compiled_cache_is_memoized_per_thread():
+    permissions_xsl = get_compiled_transport_template('dds', 'permissions.xsl')
+    assert isinstance(permissions_xsl, etree.XSLT)
+    assert get_compiled_transport_template('dds', 'permissions.xsl') is permissions_xsl
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(get_compiled_transport_template('dds', 'permissions.xsl')))
+    thread.start()
+    thread.join()
+    assert results[0] is not permissions_xsl
+
+
+def test_compiled_cache_is_invalidated_on_change(tmpdir):
+    schema_path = os.path.join(str(tmpdir), 'schema.xsd')
+    with open(schema_path, 'w') as f:
+        f.write(
+            '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+            '<xs:element name="foo"/></xs:schema>')
+    schema = _get_compiled(schema_path, etree.XMLSchema)
+    assert _get_compiled(schema_path, etree.XMLSchema) is schema
+    assert schema.validate(etree.fromstring('<foo/>'))
+
+    with open(schema_path, 'w') as f:
+        f.write(
+            '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+            '<xs:element name="bar"/></xs:schema>')
+    stat = os.stat(schema_path)
+    os.utime(schema_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    new_schema = _get_compiled(schema_path, etree.XMLSchema)
+    assert new_schema is not schema
+    assert not new_schema.validate(etree.fromstring('<foo/>'))
+
+
+def test_policy_index():
+    test_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    policy = load_policy(os.path.join(test_dir, 'policies', 'sample_policy.xml'))
+    policy_index = PolicyIndex(policy)
+    assert len(policy_index) == 7
+    assert ('/', 'admin') in policy_index.keys()
+
+    profile = policy_index.get_profile('/', 'talker')
+    assert profile is policy.find('profiles/profile[@ns="/"][@node="talker"]')
+    assert policy_index.get_profile('/', 'unknown') is None
+
+    permissions = policy_index.get_permissions('/', 'admin', 'service', 'request', 'ALLOW')
+    assert permissions.tag == 'services'
+    assert permissions is policy_index.get_permissions(
+        '/', 'admin', 'service', 'reply', 'ALLOW')
+    assert policy_index.get_permissions('/', 'admin', 'topic', 'publish', 'DENY') is None
+
+    # extracting a profile leaves the policy untouched
+    policy_element = policy_index.get_policy_element('/', 'talker')
+    assert policy_element.find('profiles/profile').get('node') == 'talker'
+    assert profile.getparent() is policy.find('profiles')
+
+    permissions = policy_index.add_permissions('/foo', 'bar', 'service', 'reply', 'ALLOW')
+    assert permissions.getparent() is policy_index.get_profile('/foo', 'bar')
+    assert permissions is policy_index.add_permissions(
+        '/foo', 'bar', 'service', 'reply', 'ALLOW')
+    assert len(policy_index) == 8
+
+
+def test_iter_policy(tmpdir, monkeypatch):
+    # cached policies are compared with test_policy_cache, they lack unused namespaces
+    monkeypatch.delenv('SROS2_POLICY_CACHE')
+    test_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    policy_path = os.path.join(test_dir, 'policies', 'sample_policy.xml')
+    policy_index = PolicyIndex(load_policy(policy_path))
+    # profiles included at any level are streamed like they are loaded
+    policy_elements = list(iter_policy(policy_path))
+    assert [etree.tostring(policy_element) for policy_element in policy_elements] == [
+        etree.tostring(policy_index.get_policy_element(ns, node))
+        for ns, node in policy_index.keys()
+    ]
+
+    invalid_policy_path = str(tmpdir.join('invalid.xml'))
+    with open(invalid_policy_path, 'w') as f:
+        f.write(
+            '<policy version="0.1.0"><profiles>'
+            '<profile ns="/" node="valid"/><profile ns="/"/>'
+            '</profiles></policy>')
+    policy_elements = iter_policy(invalid_policy_path)
+    assert next(policy_elements).find('profiles/profile').get('node') == 'valid'
+    with pytest.raises(RuntimeError, match="'node' is required"):
+        next(policy_elements)
+
+
+def test_iter_policy_with_included_profiles(tmpdir):
+    # the <profiles> of a policy may be included as a whole
+    policy_path = str(tmpdir.join('policy.xml'))
+    with open(policy_path, 'w') as f:
+        f.write(
+            '<policy version="0.1.0" xmlns:xi="http://www.w3.org/2001/XInclude">'
+            '<xi:include href="profiles.xml"/></policy>')
+    included_path = str(tmpdir.join('profiles.xml'))
+    with open(included_path, 'w') as f:
+        f.write(
+            '<profiles xmlns:xi="http://www.w3.org/2001/XInclude">'
+            '<profile ns="/" node="talker"><topics publish="ALLOW"><topic>chatter</topic>'
+            '</topics></profile>'
+            '<xi:include href="listener.xml"/></profiles>')
+    with open(str(tmpdir.join('listener.xml')), 'w') as f:
+        f.write(
+            '<profile ns="/" node="listener"><topics subscribe="ALLOW"><topic>chatter</topic>'
+            '</topics></profile>')
+
+    policy_index = PolicyIndex(load_policy(policy_path))
+    assert list(policy_index.keys()) == [('/', 'talker'), ('/', 'listener')]
+    assert [etree.tostring(policy_element) for policy_element in iter_policy(policy_path)] == [
+        etree.tostring(policy_index.get_policy_element(ns, node))
+        for ns, node in policy_index.keys()
+    ]
+    assert list(iter_profile_keys(policy_path)) == list(policy_index.keys())
+    assert get_included_files(policy_path) == [
+        str(tmpdir.join('listener.xml')), included_path]
+
+
+def test_included_files_are_cached(tmpdir, monkeypatch):
+    monkeypatch.delenv('SROS2_POLICY_CACHE')
+    fragment_path = str(tmpdir.join('fragment.xml'))
+    with open(fragment_path, 'w') as f:
+        f.write('<profile ns="/" node="foo"><topics publish="ALLOW"><topic>a</topic></topics>'
+                '</profile>')
+    policy_paths = []
+    for name in ('first.xml', 'second.xml'):
+        policy_paths.append(str(tmpdir.join(name)))
+        with open(policy_paths[-1], 'w') as f:
+            f.write(
+                '<policy version="0.1.0" xmlns:xi="http://www.w3.org/2001/XInclude">'
+                '<profiles><xi:include href="fragment.xml"/></profiles></policy>')
+    policy = load_policy(policy_paths[0])
+    assert policy.findtext('profiles/profile/topics/topic') == 'a'
+    assert _include_resolver.entries[fragment_path][1].startswith(b'<profile')
+    # the cached contents are served to other policies, until the file changes
+    mtime, data, _ = _include_resolver.entries[fragment_path]
+    _include_resolver.entries[fragment_path] = (mtime, data.replace(b'>a<', b'>cached<'), None)
+    assert load_policy(policy_paths[1]).findtext('profiles/profile/topics/topic') == 'cached'
+    assert list(iter_profile_keys(policy_paths[1])) == [('/', 'foo')]
+    stat = os.stat(fragment_path)
+    os.utime(fragment_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    policy_element = next(iter_policy(policy_paths[1]))
+    assert policy_element.findtext('profiles/profile/topics/topic') == 'a'
+
+
+def test_policy_cache(tmpdir, monkeypatch, policy_cache_dir):
+    cache_dir = policy_cache_dir
+    fragment_path = str(tmpdir.join('fragment.xml'))
+    with open(fragment_path, 'w') as f:
+        f.write('<profile ns="/" node="foo"><topics publish="ALLOW"><topic>a</topic></topics>'
+                '</profile>')
+    policy_path = str(tmpdir.join('policy.xml'))
+    with open(policy_path, 'w') as f:
+        f.write(
+            '<policy version="0.1.0" xmlns:xi="http://www.w3.org/2001/XInclude">'
+            '<profiles><xi:include href="fragment.xml"/></profiles></policy>')
+    policy = load_policy(policy_path)
+    entry_paths = glob.glob(os.path.join(cache_dir, '*', '*.xml'))
+    assert len(entry_paths) == 1
+
+    # a cached policy is loaded as it was resolved, without XInclude nor validation
+    profiler = _profiling.enable_profiling()
+    try:
+        cached_policy = load_policy(policy_path)
+        policy_elements = list(iter_policy(policy_path))
+    finally:
+        _profiling.disable_profiling()
+    assert profiler.counters['cached_policies'] == 2
+    assert not any('validate_policy' in stack for stack in profiler.spans)
+    assert etree.tostring(cached_policy) == etree.tostring(policy)
+    assert cached_policy.docinfo.URL == policy_path
+    # only the namespace declarations in scope of the profiles may differ
+    assert etree.tostring(
+        policy_elements[0].find('profiles/profile'), method='c14n', exclusive=True) == \
+        etree.tostring(policy.find('profiles/profile'), method='c14n', exclusive=True)
+
+    # changing an included file invalidates the entry, which is written anew
+    with open(fragment_path, 'w') as f:
+        f.write('<profile ns="/" node="foo"><topics publish="ALLOW"><topic>b</topic></topics>'
+                '</profile>')
+    policy_elements = list(iter_policy(policy_path))
+    assert policy_elements[0].findtext('profiles/profile/topics/topic') == 'b'
+    assert load_policy(policy_path).findtext('profiles/profile/topics/topic') == 'b'
+    assert glob.glob(os.path.join(cache_dir, '*', '*.xml')) == entry_paths
+    with open(entry_paths[0], 'rb') as f:
+        entry = f.read()
+    assert b'<topic>b</topic>' in entry
+
+    # a corrupted entry is not trusted, the policy is validated again
+    with open(entry_paths[0], 'wb') as f:
+        f.write(entry.replace(b'<topic>b</topic>', b'<topic>c</topic>'))
+    assert load_policy(policy_path).findtext('profiles/profile/topics/topic') == 'b'
+
+    # entries of policies which were not loaded for long are pruned
+    stale_entry_dir = os.path.join(cache_dir, 'stale')
+    os.makedirs(stale_entry_dir)
+    stale_entry_path = os.path.join(stale_entry_dir, 'entry.xml')
+    with open(stale_entry_path, 'w') as f:
+        f.write('stale')
+    os.utime(stale_entry_path, (0, 0))
+    with open(fragment_path, 'a') as f:
+        f.write('\n')
+    load_policy(policy_path)
+    assert not os.path.exists(stale_entry_dir)
+    assert len(glob.glob(os.path.join(cache_dir, '*', '*.xml'))) == 1
+
+    # the cache is only used when enabled
+    monkeypatch.delenv('SROS2_POLICY_CACHE')
+    assert get_policy_cache() is None
+
+
+def test_get_included_files():
+    policies_dir = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'policies')
+    assert get_included_files(os.path.join(policies_dir, 'talker_listener.xml')) == [
+        os.path.join(policies_dir, 'common', 'node.xml'),
+        os.path.join(policies_dir, 'common', 'node', 'logging.xml'),
+        os.path.join(policies_dir, 'common', 'node', 'parameters.xml'),
+        os.path.join(policies_dir, 'common', 'node', 'time.xml'),
+    ]
+
+
+def test_merge_profile():
+    policy_index = PolicyIndex(etree.fromstring(
+        '<policy version="0.1.0"><profiles><profile ns="/" node="foo">'
+        '<topics publish="ALLOW"><topic>a</topic></topics>'
+        '</profile></profiles></policy>'))
+    other_policy = etree.fromstring(
+        '<policy version="0.1.0"><profiles><profile ns="/" node="foo">'
+        '<topics xml:base="common.xml" publish="ALLOW"><topic>a</topic></topics>'
+        '<topics publish="ALLOW"><topic>b</topic></topics>'
+        '</profile></profiles></policy>')
+    assert policy_index.get_permissions('/', 'foo', 'topic', 'publish', 'ALLOW') is not None
+    policy_index.add_expressions('/', 'foo', 'topic', 'publish', 'ALLOW', [])
+    profile = policy_index.merge_profile(other_policy.find('profiles/profile'))
+    assert [permissions.findtext('topic') for permissions in profile] == ['a', 'b']
+    assert policy_index.add_expressions(
+        '/', 'foo', 'topic', 'publish', 'ALLOW', ['a', 'b', 'c']) == ['c']
+    dumped = etree.tostring(policy_index.policy)
+    policy_index.merge_profile(other_policy.find('profiles/profile'))
+    assert etree.tostring(policy_index.policy) == dumped
+
+
+def test_merge_is_idempotent(tmpdir):
+    test_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    policy = load_policy(os.path.join(test_dir, 'policies', 'sample_policy.xml'))
+    policy_index = PolicyIndex(policy)
+    # rosout is already allowed to be published through an included expression list
+    assert policy_index.add_expressions(
+        '/', 'talker', 'topic', 'publish', 'ALLOW', ['rosout', 'chatter', 'new', 'new']) == \
+        ['new']
+    stream = io.StringIO()
+    dump_policy(policy, stream)
+    dumped = stream.getvalue()
+
+    policy_path = str(tmpdir.join('policy.xml'))
+    with open(policy_path, 'w') as f:
+        f.write(dumped)
+    policy = load_policy(policy_path)
+    policy_index = PolicyIndex(policy)
+    assert policy_index.add_expressions(
+        '/', 'talker', 'topic', 'publish', 'ALLOW', ['chatter', 'new']) == []
+    stream = io.StringIO()
+    dump_policy(policy, stream)
+    assert stream.getvalue() == dumped
+
+
+def test_compact_policy():
+    test_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    policy = load_policy(os.path.join(test_dir, 'policies', 'sample_policy.xml'))
+    compacted, report = compact_policy(policy, ['/*/*parameters', '/robot/*'])
+
+    profile = compacted.find('profiles/profile[@node="admin"]')
+    services = profile.findall('services')
+    assert len(services) == 1
+    assert [service.text for service in services[0]] == \
+        ['/*/*parameters', '~get_parameter_types', '~set_parameters_atomically', 'add_two_ints']
+    # the publish and subscribe lists of the same topics are merged
+    assert [topics.attrib for topics in profile.findall('topics')].count(
+        {'publish': 'ALLOW', 'subscribe': 'ALLOW'}) == 1
+
+    # access is only widened to the allowed wildcards
+    grants = compile_permissions(compacted).findall('permissions/grant')
+    topics = {topic.text for topic in grants[-1].iterfind('allow_rule/publish/topics/topic')}
+    assert 'rq/*/*parametersRequest' in topics
+    assert 'rq/robot/*Request' not in topics
+
+    assert [grant_size.name for grant_size in report] == [grant.get('name') for grant in grants]
+    admin = report[-1]
+    assert admin.topics_after < admin.topics_before
+    assert admin.bytes_after < admin.bytes_before
@@ -0,0 +1,60 @@
+# Copyright 2019 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+
+from sros2 import _profiling
+from sros2.api import create_key, create_keystore
+
+
+def test_profiling(tmpdir):
+    keystore_path = os.path.join(str(tmpdir), 'keystore')
+    profiler = _profiling.enable_profiling()
+    try:
+        with _profiling.span('test'):
+            create_keystore(keystore_path)
+            create_key(keystore_path, '/foo/bar')
+    finally:
+        _profiling.disable_profiling()
+
+    assert ('test', 'create_keystore', 'create_ca_key_cert') in profiler.spans
+    assert ('test', 'create_key', 'create_cert_for_identity', 'create_cert') in profiler.spans
+    assert profiler.spans[('test', 'create_key')][0] == 1
+    assert profiler.counters['signed_files'] == 1
+    assert profiler.counters['certs'] == 1
+
+    json_path = os.path.join(str(tmpdir), 'profile.json')
+    profiler.write(json_path)
+    with open(json_path) as f:
+        report = json.load(f)
+    root = next(span for span in report['spans'] if span['stack'] == ['test'])
+    assert 0 <= root['self_seconds'] <= root['seconds']
+
+    folded_path = os.path.join(str(tmpdir), 'profile.folded')
+    profiler.write(folded_path)
+    with open(folded_path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == len(profiler.spans)
+    assert any(line.startswith('test;create_key;create_key_and_cert_req_for_identity ')
+               for line in lines)
+
+    stream = io.StringIO()
+    profiler.print_report(stream)
+    assert stream.getvalue().split()[0] == 'test'
+
+    # nothing is recorded once disabled
+    create_key(keystore_path, '/foo/baz')
+    assert profiler.spans[('test', 'create_key')][0] == 1
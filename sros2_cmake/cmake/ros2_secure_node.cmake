@@ -12,13 +12,75 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-macro(ros2_secure_node)
+function(_ros2_secure_node_remove_stale_manifests manifest_dir manifest)
+  # manifests of a tree configured from the same sources before, e.g. of a renamed package,
+  # or of sources which do not exist anymore, would keep provisioning their identities
+  file(GLOB manifests "${manifest_dir}/*.txt")
+  foreach(other_manifest ${manifests})
+    if(other_manifest STREQUAL manifest)
+      continue()
+    endif()
+    file(STRINGS "${other_manifest}" sources REGEX "^source ")
+    if(NOT sources)
+      continue()
+    endif()
+    list(GET sources 0 source)
+    string(REGEX REPLACE "^source " "" source "${source}")
+    if(source STREQUAL CMAKE_SOURCE_DIR OR NOT EXISTS "${source}")
+      message(STATUS "Removing stale provisioning manifest ${other_manifest}")
+      file(REMOVE "${other_manifest}")
+    endif()
+  endforeach()
+endfunction()
+
+function(_ros2_secure_node_add_provisioning keystore keystore_target program manifest)
+  # a single command provisions all the identities and policy files declared by this build
+  # tree, it only runs again when the declarations or their policy files change
+  string(MD5 keystore_hash "${keystore}")
+  get_property(dependencies GLOBAL PROPERTY "SROS2_CMAKE_BATCH_DEPENDS_${keystore_hash}")
+  set_property(GLOBAL PROPERTY "SROS2_CMAKE_BATCH_DEPENDS_${keystore_hash}" "")
+  list(REMOVE_DUPLICATES dependencies)
+
+  set(target "${PROJECT_NAME}_security_artifacts")
+  set(target_index 1)
+  while(TARGET ${target})
+    math(EXPR target_index "${target_index} + 1")
+    set(target "${PROJECT_NAME}_security_artifacts_${target_index}")
+  endwhile()
+  set(stamp "${CMAKE_CURRENT_BINARY_DIR}/${target}.stamp")
+  add_custom_command(
+    OUTPUT ${stamp}
+    COMMAND ${program} security generate_artifacts -k ${keystore} -m ${manifest}
+    COMMAND ${CMAKE_COMMAND} -E touch ${stamp}
+    DEPENDS "${keystore}/ca.cert.pem" "${keystore}/governance.p7s" ${dependencies}
+    COMMENT "Generating security artifacts declared in ${manifest}"
+    VERBATIM
+  )
+  add_custom_target(${target} ALL DEPENDS ${stamp})
+  add_dependencies(${target} ${keystore_target})
+endfunction()
+
+function(ros2_secure_node)
   # ros2_secure_node(NODES <node_1> <node_2>...<node_n>)
   #
   # NODES (macro multi-arg) takes the node names for which artifacts will be generated
   # SECURITY (cmake arg) if not defined or OFF, will not generate keystore/keys/permissions
+  # SECURITY_BATCH (cmake arg) if not defined or ON, a single command provisions all the declarations of the build tree, if WORKSPACE, nothing is generated at build time, if OFF, each node gets a command of its own
   # POLICY_FILE (cmake arg) if defined, policies defined in the file will used to generate permission files for all the nodes listed in the policy file
   # ROS_SECURITY_ROOT_DIRECTORY (env variable) will be the location of the keystore
+  #
+  # The NODES and POLICY_FILE of every call of a build tree are declared in its provisioning
+  # manifest, <keystore>/provisioning_manifest.d/<project>.txt. The manifests of all the
+  # packages of a workspace are provisioned in one process with
+  # 'ros2 security generate_artifacts -k <keystore> -m <keystore>/provisioning_manifest.d',
+  # which is meant to run once after building the workspace with SECURITY_BATCH=WORKSPACE.
+  # With SECURITY_BATCH=ON, the manifest of a tree is provisioned by a single command at
+  # build time, added at the end of its configuration with CMake 3.19 or later, or for
+  # each call otherwise. With SECURITY_BATCH=OFF, the keystore and the artifacts of each
+  # identity are generated by commands of their own, which make or ninja run in parallel
+  # with -j.
+  # Commands only run again when the policy file, the files it includes or the keystore CA
+  # change.
   if(NOT SECURITY)
     message(STATUS "Not generating security files")
     return()
@@ -31,35 +93,163 @@ macro(ros2_secure_node)
     set(SECURITY_KEYSTORE ${DEFAULT_KEYSTORE})
   endif()
   cmake_parse_arguments(ros2_secure_node "" "" "NODES" ${ARGN})
-  set(generate_artifacts_command ${PROGRAM} security generate_artifacts -k ${SECURITY_KEYSTORE})
-  list(LENGTH ros2_secure_node_NODES nb_nodes)
-  if(${nb_nodes} GREATER "0")
-    list(APPEND generate_artifacts_command "-n")
-    foreach(node ${ros2_secure_node_NODES})
-        list(APPEND generate_artifacts_command ${node})
-    endforeach()
+  if(NOT DEFINED SECURITY_BATCH)
+    set(batch_mode ON)
+  elseif(SECURITY_BATCH STREQUAL "WORKSPACE")
+    set(batch_mode WORKSPACE)
+  elseif(SECURITY_BATCH)
+    set(batch_mode ON)
+  else()
+    set(batch_mode OFF)
   endif()
+  string(MD5 keystore_hash "${SECURITY_KEYSTORE}")
+
+  set(identities ${ros2_secure_node_NODES})
+  set(policy "")
+  set(policy_identities "")
+  set(policy_dependencies "")
   if(POLICY_FILE)
     if(EXISTS ${POLICY_FILE})
-      set(policy ${POLICY_FILE})
-      list(APPEND generate_artifacts_command -p ${policy})
+      get_filename_component(policy "${POLICY_FILE}" ABSOLUTE)
     else()
       message(WARNING "policy file '${POLICY_FILE}' doesn't exist, skipping..")
     endif()
   endif()
+  if(policy AND NOT batch_mode STREQUAL "WORKSPACE")
+    # listing the includes of the policy, and its identities for commands of their own, only
+    # takes parsing it
+    execute_process(
+      COMMAND ${PROGRAM} security list_policy --included-files ${policy}
+      RESULT_VARIABLE list_result
+      OUTPUT_VARIABLE policy_dependencies
+      ERROR_VARIABLE list_error
+      OUTPUT_STRIP_TRAILING_WHITESPACE
+    )
+    if(${list_result} EQUAL 0 AND batch_mode STREQUAL "OFF")
+      execute_process(
+        COMMAND ${PROGRAM} security list_policy ${policy}
+        RESULT_VARIABLE list_result
+        OUTPUT_VARIABLE policy_identities
+        ERROR_VARIABLE list_error
+        OUTPUT_STRIP_TRAILING_WHITESPACE
+      )
+    endif()
+    if(NOT ${list_result} EQUAL 0)
+      message(WARNING "policy file '${POLICY_FILE}' can't be read, skipping..\n${list_error}")
+      set(policy "")
+      set(policy_identities "")
+      set(policy_dependencies "")
+    else()
+      string(REPLACE "\n" ";" policy_identities "${policy_identities}")
+      string(REPLACE "\n" ";" policy_dependencies "${policy_dependencies}")
+      set(policy_dependencies ${policy} ${policy_dependencies})
+      # profiles and includes added to the policy need commands or dependencies of their own
+      set_property(DIRECTORY APPEND PROPERTY CMAKE_CONFIGURE_DEPENDS ${policy_dependencies})
+      list(APPEND identities ${policy_identities})
+    endif()
+  endif()
+  if(identities)
+    list(REMOVE_DUPLICATES identities)
+  endif()
 
-  message(STATUS "Executing: ${generate_artifacts_command}")
-  execute_process(
-    COMMAND ${generate_artifacts_command}
-    RESULT_VARIABLE POLICY_RESULT
-    ERROR_VARIABLE POLICY_ERROR
-    OUTPUT_QUIET
-  )
-  if(NOT ${POLICY_RESULT} EQUAL 0)
-    message("Failed to generate security artifacts")
-    message("${POLICY_ERROR}")
-  else()
-    message(STATUS "artifacts generated successfully")
+  # the manifest of a build tree holds the declarations of all its calls, and is only
+  # rewritten when they change so that it does not trigger builds of its own
+  set(manifest_dir "${SECURITY_KEYSTORE}/provisioning_manifest.d")
+  set(manifest "${manifest_dir}/${CMAKE_PROJECT_NAME}.txt")
+  set(build_manifest "${CMAKE_BINARY_DIR}/sros2_cmake/provisioning_manifest.txt")
+  get_property(manifest_content GLOBAL PROPERTY "SROS2_CMAKE_MANIFEST_${keystore_hash}")
+  if(NOT manifest_content)
+    _ros2_secure_node_remove_stale_manifests("${manifest_dir}" "${manifest}")
+    set(manifest_content "source ${CMAKE_SOURCE_DIR}\n")
+  endif()
+  foreach(node ${ros2_secure_node_NODES})
+    string(APPEND manifest_content "node ${node}\n")
+  endforeach()
+  if(policy)
+    string(APPEND manifest_content "policy ${policy}\n")
+  endif()
+  set_property(GLOBAL PROPERTY "SROS2_CMAKE_MANIFEST_${keystore_hash}" "${manifest_content}")
+  file(WRITE "${build_manifest}.in" "${manifest_content}")
+  configure_file("${build_manifest}.in" "${build_manifest}" COPYONLY)
+  configure_file("${build_manifest}" "${manifest}" COPYONLY)
+
+  if(batch_mode STREQUAL "WORKSPACE")
+    return()
+  endif()
+
+  # the keystore is created once for the whole build
+  set(ca_outputs "${SECURITY_KEYSTORE}/ca.cert.pem" "${SECURITY_KEYSTORE}/governance.p7s")
+  get_property(keystore_target GLOBAL PROPERTY "SROS2_CMAKE_KEYSTORE_TARGET_${keystore_hash}")
+  if(NOT keystore_target)
+    set(keystore_target "${PROJECT_NAME}_security_keystore_${keystore_hash}")
+    add_custom_command(
+      OUTPUT ${ca_outputs}
+      COMMAND ${PROGRAM} security create_keystore ${SECURITY_KEYSTORE}
+      COMMENT "Creating security keystore ${SECURITY_KEYSTORE}"
+      VERBATIM
+    )
+    add_custom_target(${keystore_target} DEPENDS ${ca_outputs})
+    set_property(GLOBAL PROPERTY "SROS2_CMAKE_KEYSTORE_TARGET_${keystore_hash}" ${keystore_target})
+  endif()
+
+  if(batch_mode STREQUAL "ON")
+    set_property(GLOBAL APPEND PROPERTY "SROS2_CMAKE_BATCH_DEPENDS_${keystore_hash}"
+      ${build_manifest} ${policy_dependencies})
+    if(CMAKE_VERSION VERSION_LESS 3.19)
+      _ros2_secure_node_add_provisioning(
+        "${SECURITY_KEYSTORE}" ${keystore_target} ${PROGRAM} "${build_manifest}")
+      return()
+    endif()
+    get_property(deferred GLOBAL PROPERTY "SROS2_CMAKE_BATCH_DEFERRED_${keystore_hash}")
+    if(NOT deferred)
+      set_property(GLOBAL PROPERTY "SROS2_CMAKE_BATCH_DEFERRED_${keystore_hash}" ON)
+      # the arguments of a deferred call are only evaluated when it runs
+      cmake_language(EVAL CODE "cmake_language(DEFER DIRECTORY [[${CMAKE_SOURCE_DIR}]] \
+        CALL _ros2_secure_node_add_provisioning [[${SECURITY_KEYSTORE}]] \
+        [[${keystore_target}]] [[${PROGRAM}]] [[${build_manifest}]])")
+    endif()
+    return()
   endif()
-endmacro()
 
+  set(target "${PROJECT_NAME}_security_artifacts")
+  set(target_index 1)
+  while(TARGET ${target})
+    math(EXPR target_index "${target_index} + 1")
+    set(target "${PROJECT_NAME}_security_artifacts_${target_index}")
+  endwhile()
+
+  set(outputs "")
+  set(target_dependencies ${keystore_target})
+  foreach(identity ${identities})
+    string(REGEX REPLACE "^/" "" identity_dir "${identity}")
+    set(output "${SECURITY_KEYSTORE}/${identity_dir}/permissions.p7s")
+    # an identity is generated by the target of the first call which declares it
+    string(MD5 output_hash "${output}")
+    get_property(output_target GLOBAL PROPERTY "SROS2_CMAKE_OUTPUT_TARGET_${output_hash}")
+    if(output_target)
+      list(APPEND target_dependencies ${output_target})
+      continue()
+    endif()
+    set_property(GLOBAL PROPERTY "SROS2_CMAKE_OUTPUT_TARGET_${output_hash}" ${target})
+    list(APPEND outputs ${output})
+    # identities without a profile get the default policy
+    set(command ${PROGRAM} security create_key ${SECURITY_KEYSTORE} ${identity})
+    set(dependencies ${ca_outputs})
+    list(FIND policy_identities ${identity} index)
+    if(NOT ${index} EQUAL -1)
+      list(APPEND command -p ${policy})
+      list(APPEND dependencies ${policy_dependencies})
+    endif()
+    add_custom_command(
+      OUTPUT ${output}
+      COMMAND ${command}
+      DEPENDS ${dependencies}
+      COMMENT "Generating security artifacts for ${identity}"
+      VERBATIM
+    )
+  endforeach()
+
+  add_custom_target(${target} ALL DEPENDS ${outputs})
+  list(REMOVE_DUPLICATES target_dependencies)
+  add_dependencies(${target} ${target_dependencies})
+endfunction()